@@ -0,0 +1,187 @@
+"""
+Ingestione write-behind dei messaggi di chat (CHAT_WRITE_BEHIND=1).
+
+Con molti messaggi ravvicinati (es. poco prima della partenza) ogni
+messaggio salvato è una transazione con il suo commit. In modalità
+write-behind la view costruisce il ChatMessage (id e created_at assegnati
+subito) e lo mette in un buffer del processo; un thread in background lo
+scrive con bulk_create, in una transazione per lotto, quando il lotto
+raggiunge CHAT_WRITE_BEHIND_BATCH_SIZE messaggi oppure quando il primo
+messaggio in attesa ha CHAT_WRITE_BEHIND_FLUSH_MS millisecondi.
+
+Ordine: created_at è assegnato alla scrittura del lotto, crescente
+nell'ordine di arrivo al buffer, e non alla creazione del messaggio. Con
+l'istante di creazione un messaggio in attesa risulterebbe più vecchio dei
+messaggi salvati nel frattempo (percorso sincrono, altri processi): i
+lettori con ?after= (liste e long-poll) sarebbero già oltre la sua chiave
+(created_at, id) e non lo vedrebbero mai. Così un lotto si comporta come un
+salvataggio sincrono, con la sola finestra della propria transazione. Il
+created_at della risposta 202 è quindi provvisorio.
+
+Visibilità e durabilità: il client riceve 202 prima della scrittura; il
+messaggio diventa visibile a liste, inbox e long-poll al massimo dopo
+CHAT_WRITE_BEHIND_FLUSH_MS. Alla chiusura ordinata del processo (atexit) il
+buffer viene svuotato; in caso di crash (SIGKILL, OOM) i messaggi ancora in
+attesa vanno persi: al massimo un intervallo di flush. Chi non può
+accettarlo lascia CHAT_WRITE_BEHIND disattivato.
+
+Ripiego sincrono: il messaggio viene salvato subito nella richiesta se il
+buffer è chiuso o pieno (CHAT_WRITE_BEHIND_MAX_PENDING); se il bulk_create
+di un lotto fallisce, il lotto viene riscritto un messaggio alla volta, così
+un messaggio non valido (es. thread cancellato nel frattempo) non fa perdere
+gli altri.
+"""
+
+import atexit
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, transaction
+from django.utils import timezone
+
+from .longpoll import notify_new_message
+from .models import ChatMessage
+
+
+logger = logging.getLogger(__name__)
+
+# Distanza tra i created_at dei messaggi di un lotto, per mantenerne l'ordine
+CREATED_AT_STEP = timedelta(microseconds=1)
+
+
+def save_message(message):
+    """Salvataggio sincrono, con i segnali (notifica del long-poll inclusa)"""
+    message.save(force_insert=True)
+    return message
+
+
+class ChatMessageBuffer:
+    """Buffer dei messaggi in attesa e thread che li scrive a lotti"""
+
+    def __init__(self, batch_size, flush_interval, max_pending):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending = []
+        self._condition = threading.Condition()
+        self._thread = None
+        self._closed = False
+        self._last_created_at = None
+
+    def submit(self, message):
+        """Accoda il messaggio; False se il chiamante deve salvarlo subito"""
+        with self._condition:
+            if self._closed or len(self._pending) >= self.max_pending:
+                return False
+            # Avviato al primo messaggio, e riavviato se il precedente è terminato
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="chat-write-behind", daemon=True)
+                self._thread.start()
+            self._pending.append(message)
+            # Sveglia il writer al primo messaggio (parte il timer) e a lotto pieno
+            if len(self._pending) == 1 or len(self._pending) >= self.batch_size:
+                self._condition.notify()
+        return True
+
+    def close(self, timeout=10):
+        """Smette di accettare messaggi e attende la scrittura di quelli in attesa"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def _next_batch(self):
+        """Attende un lotto pieno o scaduto; None quando il buffer è chiuso e vuoto"""
+        with self._condition:
+            while not self._pending and not self._closed:
+                self._condition.wait()
+            if not self._pending:
+                return None
+            deadline = time.monotonic() + self.flush_interval
+            while len(self._pending) < self.batch_size and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            batch = self._pending[:self.batch_size]
+            del self._pending[:self.batch_size]
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                break
+            close_old_connections()
+            try:
+                self.flush(batch)
+            except Exception:
+                logger.exception("Scrittura di %d messaggi di chat non riuscita", len(batch))
+        close_old_connections()
+
+    def _assign_created_at(self, batch):
+        """created_at al momento della scrittura, crescente nell'ordine del buffer"""
+        created_at = timezone.now()
+        if self._last_created_at is not None and created_at <= self._last_created_at:
+            created_at = self._last_created_at + CREATED_AT_STEP
+        for message in batch:
+            message.created_at = created_at
+            created_at += CREATED_AT_STEP
+        self._last_created_at = created_at - CREATED_AT_STEP
+
+    def flush(self, batch):
+        self._assign_created_at(batch)
+        try:
+            with transaction.atomic():
+                ChatMessage.objects.bulk_create(batch)
+        except DatabaseError:
+            logger.warning("bulk_create di %d messaggi fallito, salvataggio uno alla volta", len(batch), exc_info=True)
+            saved = []
+            for message in batch:
+                try:
+                    with transaction.atomic():
+                        message.save(force_insert=True)
+                except DatabaseError:
+                    logger.exception("Messaggio di chat %s scartato", message.pk)
+                else:
+                    saved.append(message)
+            batch = saved
+
+        # bulk_create non invia post_save: i long-poll vanno svegliati qui
+        for thread_id in {message.thread_id for message in batch}:
+            notify_new_message(thread_id)
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_message_buffer():
+    """Buffer del processo, creato al primo uso e svuotato all'uscita"""
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = ChatMessageBuffer(
+                    batch_size=settings.CHAT_WRITE_BEHIND_BATCH_SIZE,
+                    flush_interval=settings.CHAT_WRITE_BEHIND_FLUSH_MS / 1000,
+                    max_pending=settings.CHAT_WRITE_BEHIND_MAX_PENDING,
+                )
+                atexit.register(_buffer.close)
+    return _buffer
+
+
+def ingest_message(message):
+    """
+    Salva il messaggio, a lotti se CHAT_WRITE_BEHIND è attivo.
+    Restituisce True se il messaggio è già scritto, False se è in coda.
+    """
+    if settings.CHAT_WRITE_BEHIND and get_message_buffer().submit(message):
+        return False
+    save_message(message)
+    return True
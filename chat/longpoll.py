@@ -0,0 +1,68 @@
+"""
+Attesa asincrona di nuovi messaggi per il long-poll della chat.
+
+Ogni richiesta in attesa registra un asyncio.Event per il thread sul proprio
+event loop; il salvataggio di un messaggio (segnale post_save, dopo il commit)
+sveglia le attese del thread. I salvataggi avvengono in thread di lavoro, per
+questo l'evento viene impostato con call_soon_threadsafe.
+
+Il registro è per processo: con più worker un messaggio salvato da un altro
+processo non sveglia l'attesa, che se ne accorge al controllo periodico sul
+database (vedi LONG_POLL_RECHECK_SECONDS in chat/views.py).
+"""
+
+import asyncio
+import threading
+from collections import defaultdict
+
+
+_waiters = defaultdict(set)
+_waiters_lock = threading.Lock()
+
+
+def notify_new_message(thread_id):
+    """Sveglia tutte le richieste in attesa sul thread"""
+    with _waiters_lock:
+        waiters = list(_waiters.get(thread_id, ()))
+    for loop, event in waiters:
+        try:
+            loop.call_soon_threadsafe(event.set)
+        except RuntimeError:
+            pass  # Event loop già chiuso: la richiesta è terminata
+
+
+class MessageWaiter:
+    """
+    Attesa di nuovi messaggi su un thread, da usare come context manager.
+
+    L'attesa va registrata prima di leggere i messaggi: così un messaggio
+    confermato tra la lettura e wait() la sveglia comunque.
+    """
+
+    def __init__(self, thread_id):
+        self.thread_id = thread_id
+        self.event = asyncio.Event()
+        self._key = None
+
+    def __enter__(self):
+        self._key = (asyncio.get_running_loop(), self.event)
+        with _waiters_lock:
+            _waiters[self.thread_id].add(self._key)
+        return self
+
+    def __exit__(self, *exc_info):
+        with _waiters_lock:
+            thread_waiters = _waiters.get(self.thread_id)
+            if thread_waiters is not None:
+                thread_waiters.discard(self._key)
+                if not thread_waiters:
+                    del _waiters[self.thread_id]
+
+    async def wait(self, timeout):
+        """True se è arrivato un messaggio (anche prima della chiamata) entro timeout secondi"""
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        self.event.clear()
+        return True
@@ -0,0 +1,97 @@
+"""
+Sposta i messaggi di chat più vecchi di N mesi in ArchivedChatMessage.
+
+Lavora a lotti di --batch-size messaggi, dal più vecchio: ogni lotto è una
+transazione che copia i messaggi nell'archivio, li cancella dalla tabella
+principale e aggiorna ChatThread.archived_until e archived_until_id, così le
+letture vedono ogni messaggio in una sola delle due tabelle. Il comando si può interrompere
+e rilanciare in qualsiasi momento.
+
+Esempi:
+    python manage.py archive_chat_messages --months 6
+    python manage.py archive_chat_messages --months 12 --batch-size 500 --max-batches 100
+"""
+
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from chat.models import ArchivedChatMessage, ChatMessage, ChatThread
+
+
+ARCHIVED_FIELDS = ("id", "thread_id", "sender_id", "body", "created_at")
+
+
+def months_ago(moment, months):
+    """Stesso giorno di `months` mesi prima (o l'ultimo giorno del mese, se più corto)"""
+    month_index = moment.year * 12 + moment.month - 1 - months
+    year, month = divmod(month_index, 12)
+    month += 1
+    first_of_next = moment.replace(year=year + month // 12, month=month % 12 + 1, day=1)
+    last_day = (first_of_next - timedelta(days=1)).day
+    return moment.replace(year=year, month=month, day=min(moment.day, last_day))
+
+
+class Command(BaseCommand):
+    help = 'Sposta a lotti i messaggi di chat più vecchi di N mesi nella tabella di archivio'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months', type=int, default=6, help='Età minima in mesi dei messaggi da archiviare (default: 6)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Messaggi per transazione (default: 1000)')
+        parser.add_argument('--max-batches', type=int, help='Numero massimo di lotti per esecuzione')
+        parser.add_argument('--dry-run', action='store_true', help='Conta i messaggi da archiviare senza spostarli')
+
+    def handle(self, *args, **options):
+        if options['months'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--months e --batch-size devono essere positivi')
+        cutoff = months_ago(timezone.now(), options['months'])
+        old_messages = ChatMessage.objects.filter(created_at__lt=cutoff)
+
+        if options['dry_run']:
+            self.stdout.write(f'{old_messages.count()} messaggi precedenti a {cutoff.isoformat()} da archiviare')
+            return
+
+        started = time.perf_counter()
+        moved = batches = 0
+        while options['max_batches'] is None or batches < options['max_batches']:
+            count = self.archive_batch(old_messages, options['batch_size'])
+            if not count:
+                break
+            moved += count
+            batches += 1
+            self.stderr.write(f'Lotto {batches}: {count} messaggi archiviati')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{moved} messaggi precedenti a {cutoff.isoformat()} archiviati in {batches} lotti '
+            f'({time.perf_counter() - started:.1f}s)'
+        ))
+
+    def archive_batch(self, old_messages, batch_size):
+        with transaction.atomic():
+            batch = old_messages.order_by('created_at', 'id')
+            if connection.features.has_select_for_update_skip_locked:
+                # Due esecuzioni concorrenti si dividono i messaggi invece di attendersi
+                batch = batch.select_for_update(skip_locked=True)
+            rows = list(batch.values(*ARCHIVED_FIELDS)[:batch_size])
+            if not rows:
+                return 0
+
+            ArchivedChatMessage.objects.bulk_create([ArchivedChatMessage(**row) for row in rows])
+            ChatMessage.objects.filter(id__in=[row['id'] for row in rows]).delete()
+
+            # Righe in ordine crescente: l'ultima di ogni thread è la più recente.
+            # Si salva la chiave (created_at, id): un lotto può dividere messaggi con la stessa data
+            archived_until = {row['thread_id']: (row['created_at'], row['id']) for row in rows}
+            for thread_id, (created_at, message_id) in archived_until.items():
+                ChatThread.objects.filter(
+                    Q(archived_until__isnull=True)
+                    | Q(archived_until__lt=created_at)
+                    | Q(archived_until=created_at, archived_until_id__isnull=True)
+                    | Q(archived_until=created_at, archived_until_id__lt=message_id),
+                    pk=thread_id,
+                ).update(archived_until=created_at, archived_until_id=message_id)
+        return len(rows)
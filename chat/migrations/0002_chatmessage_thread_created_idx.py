@@ -0,0 +1,19 @@
+# Generated by Django 5.2.10 on 2026-10-18 00:12
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['thread', 'created_at', 'id'], name='chat_msg_thread_created_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.10 on 2026-10-18 01:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_archivedchatmessage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatthread',
+            name='archived_until_id',
+            field=models.UUIDField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -1,12 +1,32 @@
 import uuid
+from datetime import datetime, timezone as dt_timezone
 from django.conf import settings
 from django.db import models
+from django.db.models import Count, F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from rides.models import RideOffer
 
+# last_read_at vuoto: tutti i messaggi del thread sono da leggere
+NEVER_READ = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
 class ChatThread(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     ride = models.ForeignKey(RideOffer, null=True, blank=True, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Chiave (created_at, id) dell'ultimo messaggio spostato in ArchivedChatMessage (None: nessuno)
+    archived_until = models.DateTimeField(null=True, blank=True, editable=False)
+    archived_until_id = models.UUIDField(null=True, blank=True, editable=False)
+
+    @classmethod
+    def for_participant(cls, thread_id, user_id):
+        """Il thread se l'utente vi partecipa, altrimenti None"""
+        return cls.objects.filter(pk=thread_id, participants__user_id=user_id).first()
+
+    @classmethod
+    async def afor_participant(cls, thread_id, user_id):
+        return await cls.objects.filter(pk=thread_id, participants__user_id=user_id).afirst()
 
 class ChatParticipant(models.Model):
     thread = models.ForeignKey(ChatThread, on_delete=models.CASCADE, related_name="participants")
@@ -16,9 +36,151 @@ class ChatParticipant(models.Model):
     class Meta:
         unique_together = ("thread", "user")
 
-class ChatMessage(models.Model):
+    @classmethod
+    def inbox_queryset(cls, user_id):
+        """
+        Thread dell'utente con ultimo messaggio e numero di non letti, in una
+        sola query: i dati per thread sono subquery correlate che usano
+        l'indice (thread, created_at, id). Ordinati dal thread più recente.
+        Non letti: messaggi degli altri partecipanti dopo last_read_at (tutti
+        se l'utente non ha mai letto il thread).
+        """
+        last_message = ChatMessage.objects.filter(
+            thread_id=OuterRef("thread_id")
+        ).order_by("-created_at", "-id")
+        unread = ChatMessage.objects.filter(
+            thread_id=OuterRef("thread_id"),
+            created_at__gt=OuterRef("read_since"),
+        ).exclude(
+            sender_id=OuterRef("user_id")
+        ).order_by().values("thread_id").annotate(count=Count("id")).values("count")
+
+        return cls.objects.filter(user_id=user_id).annotate(
+            read_since=Coalesce(F("last_read_at"), Value(NEVER_READ)),
+            last_message_id=Subquery(last_message.values("id")[:1]),
+            last_message_body=Subquery(last_message.values("body")[:1]),
+            last_message_sender_id=Subquery(last_message.values("sender_id")[:1]),
+            last_message_at=Subquery(last_message.values("created_at")[:1]),
+            unread_count=Coalesce(Subquery(unread), 0),
+        ).select_related("thread").order_by(
+            # Thread con tutti i messaggi archiviati: senza ultimo messaggio, ordinati per data di archivio
+            Coalesce(F("last_message_at"), F("thread__archived_until")).desc(nulls_last=True),
+            "-thread__created_at",
+        )
+
+def _at_or_past(key, thread):
+    """True se la chiave (created_at, id) non precede l'ultimo messaggio archiviato"""
+    created_at, message_id = key
+    if created_at != thread.archived_until:
+        return created_at > thread.archived_until
+    # Thread archiviati senza id: a parità di data i messaggi possono essere in entrambe le tabelle
+    return thread.archived_until_id is not None and message_id >= thread.archived_until_id
+
+
+def _past(key, thread):
+    """True se la chiave (created_at, id) segue l'ultimo messaggio archiviato"""
+    created_at, message_id = key
+    if created_at != thread.archived_until:
+        return created_at > thread.archived_until
+    return thread.archived_until_id is None or message_id > thread.archived_until_id
+
+
+class BaseChatMessage(models.Model):
+    """Campi e paginazione comuni a ChatMessage e ArchivedChatMessage"""
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    body = models.TextField(blank=True)
+    # Il buffer write-behind (chat/ingest.py) lo riassegna alla scrittura del lotto
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def page_queryset(cls, thread_id, before=None, after=None, limit=50):
+        """
+        Una pagina di messaggi del thread tramite l'indice (thread, created_at, id).
+        `before` / `after` sono chiavi (created_at, id): senza chiavi restituisce i
+        più recenti. I messaggi più vecchi di `before` (o gli ultimi) arrivano in
+        ordine decrescente, quelli più nuovi di `after` in ordine crescente.
+        """
+        messages = cls.objects.filter(thread_id=thread_id).select_related("sender")
+        if after is not None:
+            created_at, message_id = after
+            messages = messages.filter(
+                Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=message_id)
+            ).order_by("created_at", "id")
+        else:
+            if before is not None:
+                created_at, message_id = before
+                messages = messages.filter(
+                    Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=message_id)
+                )
+            messages = messages.order_by("-created_at", "-id")
+        return messages[:limit]
+
+
+class ChatMessage(BaseChatMessage):
     thread = models.ForeignKey(ChatThread, on_delete=models.CASCADE, related_name="messages")
     sender = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
-    body = models.TextField(blank=True)
-    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Storico di un thread in ordine di invio, letto a pagine con cursore (created_at, id)
+            models.Index(fields=["thread", "created_at", "id"], name="chat_msg_thread_created_idx"),
+            # Selezione dei messaggi da archiviare (archive_chat_messages)
+            models.Index(fields=["created_at"], name="chat_msg_created_idx"),
+        ]
+
+    @staticmethod
+    def page_sources(thread, before=None, after=None):
+        """
+        Tabelle da leggere, nell'ordine della pagina. Tutti i messaggi
+        archiviati di un thread hanno chiave (created_at, id) fino a quella di
+        thread.archived_until e quelli nella tabella principale successiva,
+        con lo stesso ordine dei cursori: le pagine recenti non toccano
+        l'archivio, quelle vecchie non toccano la tabella principale.
+        """
+        archived_until = thread.archived_until
+        if archived_until is None:
+            return [ChatMessage]
+        if after is not None:
+            return [ChatMessage] if _at_or_past(after, thread) else [ArchivedChatMessage, ChatMessage]
+        if before is not None and not _past(before, thread):
+            return [ArchivedChatMessage]
+        return [ChatMessage, ArchivedChatMessage]
+
+    @classmethod
+    def page(cls, thread, before=None, after=None, limit=50):
+        """Come page_queryset, ma continua nell'archivio se il thread ne ha uno"""
+        messages = []
+        for model in cls.page_sources(thread, before, after):
+            messages += model.page_queryset(thread.pk, before, after, limit - len(messages))
+            if len(messages) >= limit:
+                break
+        return messages
+
+    @classmethod
+    async def apage(cls, thread, before=None, after=None, limit=50):
+        """Versione asincrona di page"""
+        messages = []
+        for model in cls.page_sources(thread, before, after):
+            messages += [
+                message async for message in model.page_queryset(thread.pk, before, after, limit - len(messages))
+            ]
+            if len(messages) >= limit:
+                break
+        return messages
+
+
+class ArchivedChatMessage(BaseChatMessage):
+    """
+    Messaggi vecchi spostati fuori da ChatMessage (archive_chat_messages): la
+    tabella principale resta piccola e gli indici caldi in memoria.
+    """
+    thread = models.ForeignKey(ChatThread, on_delete=models.CASCADE, related_name="archived_messages")
+    sender = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="+")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["thread", "created_at", "id"], name="chat_archived_thread_idx"),
+        ]
@@ -0,0 +1,84 @@
+"""
+Paginazione a cursore dei messaggi di chat, in entrambe le direzioni.
+
+Il cursore è la chiave (created_at, id) di un messaggio codificata in
+base64: "before" legge i messaggi più vecchi, "after" quelli più nuovi.
+Ogni pagina è una range scan sull'indice (thread, created_at, id), quindi
+il costo non dipende dalla lunghezza del thread; le pagine vecchie
+proseguono nell'archivio (vedi ChatMessage.page).
+"""
+
+import base64
+import json
+import uuid
+from datetime import datetime
+
+from rest_framework.exceptions import ParseError
+
+from rides.pagination import INVALID_CURSOR_MESSAGE, parse_page_size
+
+
+BEFORE_QUERY_PARAM = "before"
+AFTER_QUERY_PARAM = "after"
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 100
+
+
+def encode_message_cursor(message):
+    position = {"t": message.created_at.isoformat(), "id": str(message.id)}
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+
+def decode_message_cursor(cursor):
+    """Restituisce la chiave (created_at, id); ParseError (400) se il cursore è malformato"""
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(position["t"]), uuid.UUID(position["id"])
+    except (TypeError, ValueError, KeyError, UnicodeDecodeError):
+        raise ParseError(INVALID_CURSOR_MESSAGE)
+
+
+class MessagePageRequest:
+    """Parametri di una pagina di messaggi letti dalla query string"""
+
+    def __init__(self, query_params):
+        before = query_params.get(BEFORE_QUERY_PARAM)
+        after = query_params.get(AFTER_QUERY_PARAM)
+        self.before = decode_message_cursor(before) if before else None
+        self.after = decode_message_cursor(after) if after else None
+        self.after_cursor = after or None
+        self.page_size = parse_page_size(query_params.get("page_size"), DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+
+    def fetch(self, thread):
+        from .models import ChatMessage
+
+        # Una riga in più per sapere se la pagina continua
+        return ChatMessage.page(thread, before=self.before, after=self.after, limit=self.page_size + 1)
+
+    async def afetch(self, thread):
+        from .models import ChatMessage
+
+        return await ChatMessage.apage(thread, before=self.before, after=self.after, limit=self.page_size + 1)
+
+    def payload(self, messages, serialize):
+        """
+        Risposta con i messaggi in ordine cronologico e i cursori per
+        continuare verso i più vecchi (older_cursor) o i più nuovi (newer_cursor).
+        """
+        has_more = len(messages) > self.page_size
+        messages = list(messages[:self.page_size])
+        if self.after is None:
+            messages.reverse()
+            has_older = has_more
+        else:
+            has_older = True
+
+        older_cursor = encode_message_cursor(messages[0]) if messages and has_older else None
+        # Senza messaggi nuovi il cursore "after" resta quello ricevuto (long-poll)
+        newer_cursor = encode_message_cursor(messages[-1]) if messages else self.after_cursor
+        return {
+            "results": serialize(messages),
+            "older_cursor": older_cursor,
+            "newer_cursor": newer_cursor,
+            "has_more_newer": self.after is not None and has_more,
+        }
@@ -0,0 +1,58 @@
+from rest_framework import serializers
+from drf_spectacular.utils import extend_schema_field
+from rides.serializers import FastSerializerPlan
+from .models import ChatMessage, ChatParticipant
+
+
+class ChatMessageSerializer(serializers.ModelSerializer):
+    sender_name = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ChatMessage
+        fields = ["id", "thread", "sender", "sender_name", "body", "created_at"]
+        read_only_fields = fields
+
+    @extend_schema_field(serializers.CharField())
+    def get_sender_name(self, obj) -> str:
+        return f"{obj.sender.first_name} {obj.sender.last_name}".strip() or obj.sender.username
+
+
+class ChatMessageCreateSerializer(serializers.Serializer):
+    body = serializers.CharField(max_length=4000, trim_whitespace=True)
+
+
+LAST_MESSAGE_DATETIME = serializers.DateTimeField()
+
+
+class ChatInboxLastMessageSerializer(serializers.Serializer):
+    id = serializers.UUIDField()
+    sender = serializers.IntegerField()
+    body = serializers.CharField()
+    created_at = serializers.DateTimeField()
+
+
+class ChatInboxEntrySerializer(serializers.ModelSerializer):
+    """Riga dell'inbox: un ChatParticipant annotato da ChatParticipant.inbox_queryset"""
+    ride = serializers.UUIDField(source="thread.ride_id", allow_null=True, read_only=True)
+    unread_count = serializers.IntegerField(read_only=True)
+    last_message = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ChatParticipant
+        fields = ["thread", "ride", "last_read_at", "unread_count", "last_message"]
+        read_only_fields = fields
+
+    @extend_schema_field(ChatInboxLastMessageSerializer(allow_null=True))
+    def get_last_message(self, obj):
+        if obj.last_message_id is None:
+            return None
+        # Dict costruito a mano: un serializer annidato per riga costerebbe più della query
+        return {
+            "id": str(obj.last_message_id),
+            "sender": obj.last_message_sender_id,
+            "body": obj.last_message_body,
+            "created_at": LAST_MESSAGE_DATETIME.to_representation(obj.last_message_at),
+        }
+
+
+chat_inbox_plan = FastSerializerPlan(ChatInboxEntrySerializer)
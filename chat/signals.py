@@ -0,0 +1,13 @@
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from .longpoll import notify_new_message
+from .models import ChatMessage
+
+
+@receiver(post_save, sender=ChatMessage)
+def chat_message_created(sender, instance, created, **kwargs):
+    """Sveglia i long-poll in attesa sul thread quando il messaggio è confermato"""
+    if created:
+        thread_id = instance.thread_id
+        transaction.on_commit(lambda: notify_new_message(thread_id))
@@ -1,3 +1,310 @@
-from django.test import TestCase
+import time
+import uuid
+from datetime import timedelta
+from io import StringIO
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import AsyncClient, TestCase, TransactionTestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from rides.pagination import INVALID_CURSOR_MESSAGE
+
+from .ingest import ChatMessageBuffer
+from .models import ArchivedChatMessage, ChatMessage, ChatParticipant, ChatThread
+from .pagination import encode_message_cursor
+
+User = get_user_model()
+
+
+class ChatInboxTests(TestCase):
+    """L'inbox si calcola con una query sola, qualunque sia il numero di thread"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="anna@example.com")
+        cls.other = User.objects.create_user(username="bruno@example.com")
+
+    def create_threads(self, count, messages=3, read=False):
+        threads = []
+        for _ in range(count):
+            thread = ChatThread.objects.create()
+            ChatParticipant.objects.create(
+                thread=thread, user=self.user, last_read_at=timezone.now() if read else None,
+            )
+            ChatParticipant.objects.create(thread=thread, user=self.other)
+            for i in range(messages):
+                ChatMessage.objects.create(thread=thread, sender=self.other, body=f"Messaggio {i}")
+            threads.append(thread)
+        return threads
+
+    def get_inbox(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get("/api/chat/inbox/")
+        self.assertEqual(response.status_code, 200)
+        return response.json()["results"]
+
+    def test_query_count_does_not_depend_on_threads(self):
+        self.create_threads(2)
+        with self.assertNumQueries(1):
+            self.assertEqual(len(self.get_inbox()), 2)
+
+        self.create_threads(20)
+        with self.assertNumQueries(1):
+            self.assertEqual(len(self.get_inbox()), 22)
+
+    def test_last_message_and_unread_count(self):
+        read_thread, unread_thread = self.create_threads(2)
+        ChatParticipant.objects.filter(thread=read_thread, user=self.user).update(
+            last_read_at=timezone.now() + timedelta(seconds=1),
+        )
+        ChatMessage.objects.create(thread=unread_thread, sender=self.user, body="Risposta")
+        empty_thread = ChatThread.objects.create()
+        ChatParticipant.objects.create(thread=empty_thread, user=self.user)
+
+        entries = {entry["thread"]: entry for entry in self.get_inbox()}
+
+        self.assertEqual(entries[str(read_thread.pk)]["unread_count"], 0)
+        # I messaggi dell'utente stesso non contano come non letti
+        self.assertEqual(entries[str(unread_thread.pk)]["unread_count"], 3)
+        self.assertEqual(entries[str(unread_thread.pk)]["last_message"]["body"], "Risposta")
+        self.assertIsNone(entries[str(empty_thread.pk)]["last_message"])
+        self.assertEqual(entries[str(empty_thread.pk)]["unread_count"], 0)
+
+
+class ChatMessagePaginationTests(TestCase):
+    """Cursori before/after: ogni messaggio una volta sola, anche con created_at uguali"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="anna@example.com")
+        cls.thread = ChatThread.objects.create()
+        ChatParticipant.objects.create(thread=cls.thread, user=cls.user)
+        now = timezone.now()
+        # Tre gruppi di messaggi con lo stesso istante: l'ordine lo decide l'id
+        for i in range(9):
+            ChatMessage.objects.create(
+                thread=cls.thread, sender=cls.user, body=f"Messaggio {i}", created_at=now - timedelta(seconds=3 - i // 3),
+            )
+        cls.expected = [
+            str(pk) for pk in ChatMessage.objects.order_by("created_at", "id").values_list("id", flat=True)
+        ]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = f"/api/chat/threads/{self.thread.pk}/messages/"
+
+    def get_page(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        page = response.json()
+        return [message["id"] for message in page["results"]], page
+
+    def test_before_walk_reaches_first_message(self):
+        ids, page = self.get_page(page_size=2)
+        seen = ids
+        while page["older_cursor"]:
+            ids, page = self.get_page(page_size=2, before=page["older_cursor"])
+            self.assertLessEqual(len(ids), 2)
+            seen = ids + seen
+        self.assertEqual(seen, self.expected)
+
+    def test_after_walk_reaches_last_message(self):
+        first = ChatMessage.objects.get(pk=self.expected[0])
+        page = {"newer_cursor": encode_message_cursor(first), "has_more_newer": True}
+        seen = [self.expected[0]]
+        while page["has_more_newer"]:
+            ids, page = self.get_page(page_size=2, after=page["newer_cursor"])
+            seen += ids
+        self.assertEqual(seen, self.expected)
+
+        # Oltre l'ultimo messaggio: pagina vuota, il cursore resta lo stesso
+        ids, last_page = self.get_page(after=page["newer_cursor"])
+        self.assertEqual(ids, [])
+        self.assertEqual(last_page["newer_cursor"], page["newer_cursor"])
+
+    def test_invalid_cursor_returns_400(self):
+        for params in ({"before": "non-valido"}, {"after": "e30="}):
+            with self.subTest(params=params):
+                response = self.client.get(self.url, params)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json()["detail"], INVALID_CURSOR_MESSAGE)
+
+
+class ChatLongPollTests(TestCase):
+    """Il long-poll risponde subito se ci sono messaggi nuovi, altrimenti allo scadere del timeout"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="anna@example.com")
+        cls.thread = ChatThread.objects.create()
+        ChatParticipant.objects.create(thread=cls.thread, user=cls.user)
+        cls.first = ChatMessage.objects.create(thread=cls.thread, sender=cls.user, body="Primo")
+
+    def setUp(self):
+        # Utente autenticato dalla cache: niente voci rimaste da altri test con lo stesso pk
+        cache.clear()
+        self.client = AsyncClient()
+        self.url = f"/api/chat/threads/{self.thread.pk}/messages/poll/"
+        self.headers = {"Authorization": f"Bearer {AccessToken.for_user(self.user)}"}
+
+    async def test_returns_immediately_with_new_messages(self):
+        second = await ChatMessage.objects.acreate(
+            thread=self.thread, sender=self.user, body="Secondo", created_at=self.first.created_at + timedelta(seconds=1),
+        )
+        started = time.monotonic()
+        response = await self.client.get(
+            self.url, {"after": encode_message_cursor(self.first), "timeout": 5}, headers=self.headers,
+        )
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(response.status_code, 200)
+        page = response.json()
+        self.assertEqual([message["id"] for message in page["results"]], [str(second.pk)])
+        self.assertEqual(page["newer_cursor"], encode_message_cursor(second))
+
+    async def test_returns_empty_after_timeout(self):
+        cursor = encode_message_cursor(self.first)
+        started = time.monotonic()
+        response = await self.client.get(self.url, {"after": cursor, "timeout": 0.3}, headers=self.headers)
+        self.assertGreaterEqual(time.monotonic() - started, 0.3)
+        self.assertEqual(response.status_code, 200)
+        page = response.json()
+        self.assertEqual(page["results"], [])
+        self.assertEqual(page["newer_cursor"], cursor)
+
+    async def test_invalid_cursor_returns_400(self):
+        response = await self.client.get(self.url, {"after": "non-valido"}, headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["detail"], INVALID_CURSOR_MESSAGE)
+
+
+class ChatArchiveTests(TestCase):
+    """I messaggi archiviati restano leggibili dalla stessa API"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="anna@example.com")
+        cls.thread = ChatThread.objects.create()
+        ChatParticipant.objects.create(thread=cls.thread, user=cls.user)
+        now = timezone.now()
+        for i in range(8):
+            # 0-4 di un anno fa, 5-7 recenti
+            created_at = now - timedelta(days=365 - i) if i < 5 else now - timedelta(minutes=10 - i)
+            ChatMessage.objects.create(thread=cls.thread, sender=cls.user, body=f"Messaggio {i}", created_at=created_at)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        call_command("archive_chat_messages", months=6, batch_size=2, stdout=StringIO(), stderr=StringIO())
+        self.thread.refresh_from_db()
+
+    def get_page(self, **params):
+        response = self.client.get(f"/api/chat/threads/{self.thread.pk}/messages/", params)
+        self.assertEqual(response.status_code, 200)
+        page = response.json()
+        return [message["body"] for message in page["results"]], page
+
+    def test_old_messages_are_moved_in_batches(self):
+        self.assertEqual(ArchivedChatMessage.objects.count(), 5)
+        self.assertEqual(ChatMessage.objects.count(), 3)
+        self.assertEqual(self.thread.archived_until, ArchivedChatMessage.objects.latest("created_at").created_at)
+
+    def test_pages_continue_into_archive(self):
+        with self.assertNumQueries(2):  # thread + messaggi recenti, senza archivio
+            bodies, page = self.get_page(page_size=2)
+        self.assertEqual(bodies, ["Messaggio 6", "Messaggio 7"])
+
+        bodies, page = self.get_page(page_size=3, before=page["older_cursor"])
+        self.assertEqual(bodies, ["Messaggio 3", "Messaggio 4", "Messaggio 5"])
+
+        bodies, page = self.get_page(page_size=5, before=page["older_cursor"])
+        self.assertEqual(bodies, ["Messaggio 0", "Messaggio 1", "Messaggio 2"])
+        self.assertIsNone(page["older_cursor"])
+
+        bodies, page = self.get_page(page_size=4, after=page["newer_cursor"])
+        self.assertEqual(bodies, ["Messaggio 3", "Messaggio 4", "Messaggio 5", "Messaggio 6"])
+        self.assertTrue(page["has_more_newer"])
+
+    def test_equal_timestamps_across_archive_boundary(self):
+        # Quattro messaggi con la stessa data: il lotto ne archivia due, gli altri restano
+        thread = ChatThread.objects.create()
+        ChatParticipant.objects.create(thread=thread, user=self.user)
+        created_at = timezone.now() - timedelta(days=365)
+        for i in range(4):
+            ChatMessage.objects.create(
+                id=uuid.UUID(int=i + 1), thread=thread, sender=self.user, body=f"Pari {i}", created_at=created_at,
+            )
+        ChatMessage.objects.create(thread=thread, sender=self.user, body="Recente")
+        call_command("archive_chat_messages", months=6, batch_size=2, max_batches=1, stdout=StringIO(), stderr=StringIO())
+        thread.refresh_from_db()
+        self.assertEqual(ArchivedChatMessage.objects.filter(thread=thread).count(), 2)
+        self.assertEqual((thread.archived_until, thread.archived_until_id), (created_at, uuid.UUID(int=2)))
+        self.thread = thread
+
+        bodies, page = self.get_page(page_size=2)
+        self.assertEqual(bodies, ["Pari 3", "Recente"])
+        bodies, page = self.get_page(page_size=2, before=page["older_cursor"])
+        self.assertEqual(bodies, ["Pari 1", "Pari 2"])
+        bodies, page = self.get_page(page_size=2, before=page["older_cursor"])
+        self.assertEqual(bodies, ["Pari 0"])
+        bodies, page = self.get_page(page_size=2, after=page["newer_cursor"])
+        self.assertEqual(bodies, ["Pari 1", "Pari 2"])
+
+
+class ChatMessageBufferTests(TransactionTestCase):
+    """Scrittura a lotti dei messaggi e ripiego un messaggio alla volta"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="anna@example.com")
+        self.thread = ChatThread.objects.create()
+
+    def message(self, i):
+        return ChatMessage(thread=self.thread, sender=self.user, body=f"Messaggio {i}")
+
+    def test_failed_batch_is_saved_one_by_one(self):
+        duplicate = ChatMessage.objects.create(thread=self.thread, sender=self.user, body="Già salvato")
+        batch = [self.message(0), ChatMessage(id=duplicate.id, thread=self.thread, sender=self.user), self.message(2)]
+
+        with self.assertLogs("chat.ingest", level="WARNING"):
+            ChatMessageBuffer(batch_size=10, flush_interval=1, max_pending=10).flush(batch)
+
+        self.assertEqual(
+            list(ChatMessage.objects.order_by("created_at").values_list("body", flat=True)),
+            ["Già salvato", "Messaggio 0", "Messaggio 2"],
+        )
+
+    def test_created_at_assigned_at_flush(self):
+        buffer = ChatMessageBuffer(batch_size=10, flush_interval=1, max_pending=10)
+        queued = [self.message(i) for i in range(3)]
+        # Salvato mentre i messaggi sono ancora in coda
+        saved = ChatMessage.objects.create(thread=self.thread, sender=self.user, body="Sincrono")
+
+        buffer.flush(queued)
+        buffer.flush([self.message(3)])
+
+        # Un lettore fermo al messaggio sincrono vede quelli scritti dopo, nell'ordine del buffer
+        newer = ChatMessage.page(self.thread, after=(saved.created_at, saved.id), limit=10)
+        self.assertEqual([message.body for message in newer], [f"Messaggio {i}" for i in range(4)])
+
+    def test_buffered_messages_are_written_in_order(self):
+        if connection.vendor == "sqlite" and connection.is_in_memory_db():
+            self.skipTest("SQLite in memoria non regge scritture da un altro thread")
+
+        # Il lotto non si riempie: il writer attende flush_interval prima di scrivere
+        buffer = ChatMessageBuffer(batch_size=100, flush_interval=0.2, max_pending=5)
+        messages = [self.message(i) for i in range(8)]
+        accepted = [buffer.submit(message) for message in messages]
+        buffer.close()
+
+        # Oltre max_pending il chiamante deve salvare in modo sincrono
+        self.assertEqual(accepted, [True] * 5 + [False] * 3)
+        self.assertEqual(
+            list(ChatMessage.objects.order_by("created_at", "id").values_list("id", flat=True)),
+            [message.id for message in messages[:5]],
+        )
+        self.assertFalse(buffer.submit(self.message(99)))
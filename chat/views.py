@@ -1,3 +1,178 @@
-from django.shortcuts import render
+"""
+Storico e invio dei messaggi di un thread, con long-poll per i nuovi.
 
-# Create your views here.
+La lettura è paginata a cursore in entrambe le direzioni (vedi
+chat/pagination.py). Il long-poll è una view Django async: l'attesa di un
+nuovo messaggio non occupa un thread sotto ASGI.
+"""
+
+import time
+
+from asgiref.sync import sync_to_async
+from django.utils import timezone
+from django.views.decorators.http import require_GET
+from rest_framework import permissions, status
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.exceptions import APIException, NotAuthenticated
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from drf_spectacular.utils import extend_schema, OpenApiParameter
+from config.http import json_response
+
+from .ingest import ingest_message
+from .longpoll import MessageWaiter
+from .models import ChatMessage, ChatParticipant, ChatThread
+from .pagination import AFTER_QUERY_PARAM, BEFORE_QUERY_PARAM, MessagePageRequest
+from .serializers import (
+    ChatInboxEntrySerializer,
+    ChatMessageCreateSerializer,
+    ChatMessageSerializer,
+    chat_inbox_plan,
+)
+
+
+LONG_POLL_DEFAULT_TIMEOUT = 25
+LONG_POLL_MAX_TIMEOUT = 30
+# Controllo periodico sul database per i messaggi salvati da altri processi
+LONG_POLL_RECHECK_SECONDS = 2
+
+
+def serialize_messages(messages):
+    return ChatMessageSerializer(messages, many=True).data
+
+
+def _thread_access_error(thread_id):
+    """Messaggio e status per chi non partecipa al thread"""
+    if ChatThread.objects.filter(pk=thread_id).exists():
+        return {'message': 'Non partecipi a questa chat'}, status.HTTP_403_FORBIDDEN
+    return {'message': 'Chat non trovata'}, status.HTTP_404_NOT_FOUND
+
+
+@extend_schema(
+    methods=['GET'],
+    parameters=[
+        OpenApiParameter(name=BEFORE_QUERY_PARAM, description='Cursore: messaggi più vecchi di questo', required=False, type=str),
+        OpenApiParameter(name=AFTER_QUERY_PARAM, description='Cursore: messaggi più nuovi di questo', required=False, type=str),
+        OpenApiParameter(name='page_size', description='Messaggi per pagina (max 100)', required=False, type=int),
+    ],
+    responses={200: ChatMessageSerializer(many=True)},
+    description='Messaggi del thread in ordine cronologico, a pagine con cursore verso i più vecchi o i più nuovi. Senza cursore restituisce gli ultimi.'
+)
+@extend_schema(
+    methods=['POST'],
+    request=ChatMessageCreateSerializer,
+    responses={201: ChatMessageSerializer, 202: ChatMessageSerializer},
+    description='Invia un messaggio nel thread. Con la scrittura a lotti attiva (CHAT_WRITE_BEHIND) risponde 202: il messaggio diventa visibile entro pochi millisecondi, con il created_at definitivo assegnato alla scrittura.'
+)
+@api_view(['GET', 'POST'])
+@permission_classes([permissions.IsAuthenticated])
+def thread_messages(request, thread_id):
+    """Lista (GET) o invio (POST) dei messaggi di un thread, solo per i partecipanti"""
+    thread = ChatThread.for_participant(thread_id, request.user.id)
+    if thread is None:
+        body, status_code = _thread_access_error(thread_id)
+        return Response(body, status=status_code)
+
+    if request.method == 'POST':
+        serializer = ChatMessageCreateSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response({
+                'message': 'Dati non validi',
+                'errors': serializer.errors
+            }, status=status.HTTP_400_BAD_REQUEST)
+        message = ChatMessage(thread_id=thread_id, sender=request.user, body=serializer.validated_data['body'])
+        # Con CHAT_WRITE_BEHIND il messaggio può essere ancora in coda: 202
+        written = ingest_message(message)
+        return Response(
+            ChatMessageSerializer(message).data,
+            status=status.HTTP_201_CREATED if written else status.HTTP_202_ACCEPTED,
+        )
+
+    page = MessagePageRequest(request.query_params)
+    return Response(page.payload(page.fetch(thread), serialize_messages))
+
+
+@extend_schema(
+    responses={200: ChatInboxEntrySerializer(many=True)},
+    description='Inbox dell\'utente: tutti i suoi thread con ultimo messaggio e numero di messaggi non letti, dal più recente.'
+)
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def chat_inbox(request):
+    """Thread dell'utente con ultimo messaggio e non letti, in una sola query"""
+    entries = ChatParticipant.inbox_queryset(request.user.id)
+    return Response({'results': chat_inbox_plan.serialize_many(entries)})
+
+
+@extend_schema(
+    request=None,
+    responses={204: None},
+    description='Segna come letti tutti i messaggi del thread.'
+)
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def mark_thread_read(request, thread_id):
+    """Aggiorna last_read_at del partecipante: azzera i non letti nell'inbox"""
+    updated = ChatParticipant.objects.filter(
+        thread_id=thread_id, user_id=request.user.id,
+    ).update(last_read_at=timezone.now())
+    if not updated:
+        body, status_code = _thread_access_error(thread_id)
+        return Response(body, status=status_code)
+    return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+def _authenticate(request):
+    """Autenticazione DRF (JWT) su una richiesta Django: utente o None"""
+    for authentication_class in api_settings.DEFAULT_AUTHENTICATION_CLASSES:
+        result = authentication_class().authenticate(request)
+        if result is not None:
+            return result[0]
+    return None
+
+
+def _parse_timeout(value):
+    try:
+        timeout = float(value) if value else LONG_POLL_DEFAULT_TIMEOUT
+    except ValueError:
+        timeout = LONG_POLL_DEFAULT_TIMEOUT
+    return max(0, min(timeout, LONG_POLL_MAX_TIMEOUT))
+
+
+@require_GET
+async def poll_thread_messages(request, thread_id):
+    """
+    Long-poll dei nuovi messaggi: con ?after=<cursore> risponde appena ci sono
+    messaggi più nuovi, oppure a vuoto dopo ?timeout secondi (max 30). La
+    risposta ha la stessa forma di GET thread_messages: il client riparte da
+    newer_cursor.
+    """
+    try:
+        user = await sync_to_async(_authenticate)(request)
+    except APIException as e:
+        return json_response({"detail": e.detail}, status=e.status_code)
+    if user is None:
+        error = NotAuthenticated()
+        return json_response({"detail": error.detail}, status=error.status_code)
+
+    thread = await ChatThread.afor_participant(thread_id, user.id)
+    if thread is None:
+        body, status_code = await sync_to_async(_thread_access_error)(thread_id)
+        return json_response(body, status=status_code)
+
+    try:
+        page = MessagePageRequest(request.GET)
+    except APIException as e:
+        return json_response({"detail": e.detail}, status=e.status_code)
+
+    deadline = time.monotonic() + _parse_timeout(request.GET.get("timeout"))
+    # Registrata prima della lettura: un messaggio confermato nel frattempo la sveglia
+    with MessageWaiter(thread_id) as waiter:
+        while True:
+            messages = await page.afetch(thread)
+            remaining = deadline - time.monotonic()
+            if messages or page.after is None or remaining <= 0:
+                break
+            await waiter.wait(min(remaining, LONG_POLL_RECHECK_SECONDS))
+
+    return json_response(page.payload(messages, serialize_messages))
@@ -0,0 +1,12 @@
+"""
+Risposte HTTP condivise dalle view Django async (rides/async_views.py,
+chat/views.py), che non passano dal rendering di DRF.
+"""
+
+from django.http import HttpResponse
+from rest_framework.renderers import JSONRenderer
+
+
+def json_response(data, status=200):
+    """Risposta JSON con lo stesso renderer delle view DRF: byte identici alla versione sincrona"""
+    return HttpResponse(JSONRenderer().render(data), content_type="application/json", status=status)
@@ -0,0 +1,238 @@
+"""
+Metriche per endpoint: tempo totale, numero di query e tempo DB.
+
+MetricsMiddleware misura ogni richiesta (o una frazione, vedi
+METRICS_SAMPLE_RATE) e la registra in istogrammi in memoria per nome della
+URL risolta. metrics_view li espone in formato testo Prometheus su
+/api/metrics/ (solo admin). Le metriche sono per processo: con più worker
+ognuno espone le proprie e l'aggregazione la fa Prometheus.
+"""
+
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse
+from drf_spectacular.utils import extend_schema
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
+
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Histogram:
+    """Istogramma a bucket fissi (non cumulativi in memoria, cumulativi in output)"""
+
+    __slots__ = ("buckets", "counts", "total", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # l'ultimo è +Inf
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip((*self.buckets, "+Inf"), self.counts):
+            cumulative += bucket_count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f"{name}_sum{{{labels}}} {self.total}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Istogrammi per endpoint, condivisi da tutti i thread del processo"""
+
+    METRICS = (
+        ("skipool_http_request_duration_seconds", "Tempo totale della richiesta", DURATION_BUCKETS),
+        ("skipool_db_queries_per_request", "Numero di query DB per richiesta", QUERY_COUNT_BUCKETS),
+        ("skipool_db_duration_seconds", "Tempo speso nel DB per richiesta", DURATION_BUCKETS),
+    )
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+        self._collectors = []
+
+    def observe(self, endpoint, duration, query_count, db_duration):
+        with self._lock:
+            histograms = self._endpoints.get(endpoint)
+            if histograms is None:
+                histograms = self._endpoints[endpoint] = tuple(
+                    Histogram(buckets) for _, _, buckets in self.METRICS
+                )
+            histograms[0].observe(duration)
+            histograms[1].observe(query_count)
+            histograms[2].observe(db_duration)
+
+    def register_collector(self, collector):
+        """Aggiunge una funzione che restituisce righe Prometheus già formattate"""
+        self._collectors.append(collector)
+
+    def render(self):
+        with self._lock:
+            endpoints = sorted(self._endpoints.items())
+            lines = []
+            for position, (name, description, _) in enumerate(self.METRICS):
+                lines.append(f"# HELP {name} {description}")
+                lines.append(f"# TYPE {name} histogram")
+                for endpoint, histograms in endpoints:
+                    lines.extend(histograms[position].render(name, f'endpoint="{endpoint}"'))
+
+        lines.append("# HELP skipool_metrics_sample_rate Frazione di richieste misurate")
+        lines.append("# TYPE skipool_metrics_sample_rate gauge")
+        lines.append(f"skipool_metrics_sample_rate {get_sample_rate()}")
+        for collector in self._collectors:
+            lines.extend(collector())
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+
+
+registry = MetricsRegistry()
+
+
+def get_sample_rate():
+    return getattr(settings, "METRICS_SAMPLE_RATE", 1.0)
+
+
+class _QueryTimer:
+    """Execute wrapper che conta le query e ne somma la durata"""
+
+    __slots__ = ("count", "duration")
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+
+
+# Timer della richiesta in corso. È una variabile di contesto e non un attributo
+# delle connessioni: connections è per thread, e con ASGI le query girano nei
+# thread di sync_to_async, che ricevono una copia del contesto della richiesta.
+_current_timer = ContextVar("metrics_query_timer", default=None)
+
+
+def _timed_execute(execute, sql, params, many, context):
+    """Execute wrapper fisso delle connessioni: misura solo dentro una richiesta campionata"""
+    timer = _current_timer.get()
+    if timer is None:
+        return execute(sql, params, many, context)
+    return timer(execute, sql, params, many, context)
+
+
+def install_query_timer(connection, **kwargs):
+    """Aggiunge _timed_execute alla connessione (una sola volta, anche dopo le riconnessioni)"""
+    if _timed_execute not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _timed_execute)
+
+
+connection_created.connect(install_query_timer)
+
+
+class MetricsMiddleware:
+    """
+    Registra tempo, query e tempo DB per nome della URL risolta.
+    Va messo in cima a MIDDLEWARE per misurare anche gli altri middleware.
+    Supporta anche la catena async (ASGI), così le view async non vengono
+    spostate in un thread.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    @staticmethod
+    def sampled():
+        sample_rate = get_sample_rate()
+        return sample_rate > 0 and (sample_rate >= 1 or random.random() < sample_rate)
+
+    @staticmethod
+    def install_on_open_connections():
+        # Connessioni del thread aperte prima dell'import di questo modulo
+        for connection in connections.all(initialized_only=True):
+            install_query_timer(connection)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not self.sampled():
+            return self.get_response(request)
+
+        self.install_on_open_connections()
+        timer = _QueryTimer()
+        token = _current_timer.set(timer)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_timer.reset(token)
+        duration = time.perf_counter() - started
+
+        registry.observe(self.endpoint_name(request), duration, timer.count, timer.duration)
+        return response
+
+    async def __acall__(self, request):
+        if not self.sampled():
+            return await self.get_response(request)
+
+        timer = _QueryTimer()
+        # Le query girano nei thread di sync_to_async, con connessioni diverse da
+        # quelle di questo thread: le misura _timed_execute, che legge il timer
+        # dal contesto copiato nel thread
+        token = _current_timer.set(timer)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_timer.reset(token)
+        duration = time.perf_counter() - started
+
+        registry.observe(self.endpoint_name(request), duration, timer.count, timer.duration)
+        return response
+
+    @staticmethod
+    def endpoint_name(request):
+        match = getattr(request, "resolver_match", None)
+        if match is None:
+            return "unresolved"
+        return match.url_name or match.route or match.view_name
+
+
+@extend_schema(exclude=True)
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def metrics_view(request):
+    """Espone le metriche del processo in formato testo Prometheus"""
+    return HttpResponse(registry.render(), content_type=PROMETHEUS_CONTENT_TYPE)
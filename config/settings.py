@@ -43,6 +43,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     "rest_framework",
     "users.apps.UsersConfig",
     "rides",
@@ -54,7 +55,7 @@ INSTALLED_APPS = [
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "users.authentication.CachedJWTAuthentication",
     ),
     "DEFAULT_PERMISSION_CLASSES": (
         "rest_framework.permissions.IsAuthenticated",
@@ -70,6 +71,7 @@ SPECTACULAR_SETTINGS = {
 }
 
 MIDDLEWARE = [
+    'config.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     "corsheaders.middleware.CorsMiddleware",
@@ -80,6 +82,9 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Frazione di richieste misurate da MetricsMiddleware (0 = disattivato, 1 = tutte)
+METRICS_SAMPLE_RATE = float(os.getenv("METRICS_SAMPLE_RATE", "1.0"))
+
 CORS_ALLOW_ALL_ORIGINS = True  # solo per development, in produzione specificare gli host permessi
 
 ROOT_URLCONF = 'config.urls'
@@ -108,16 +113,79 @@ WSGI_APPLICATION = 'config.wsgi.application'
 
 DATABASES = {
     "default": {
-        "ENGINE": "django.db.backends.postgresql",
+        "ENGINE": os.getenv("DB_ENGINE", "django.db.backends.postgresql"),
         "NAME": os.getenv("DB_NAME"),
         "USER": os.getenv("DB_USER"),
         "PASSWORD": os.getenv("DB_PASSWORD"),
         "HOST": os.getenv("DB_HOST"),
         "PORT": os.getenv("DB_PORT"),
+        # Con SQLite il database di test è in memoria se DB_TEST_NAME è vuoto:
+        # i test con scritture concorrenti da più thread richiedono un file
+        "TEST": {"NAME": os.getenv("DB_TEST_NAME") or None},
     }
 }
 
 
+# Cache di Django: versione del catalogo (rides/catalog.py), utente autenticato
+# e profili pubblici (users/). Le invalidazioni sono cancellazioni o nuove
+# versioni in questa cache, quindi con più processi o più host deve essere
+# condivisa: con REDIS_URL si usa Redis. Senza, ogni processo ha la sua cache
+# locale e vede le modifiche fatte dagli altri solo alla scadenza delle voci
+# (check rides.W001 con manage.py check --deploy).
+REDIS_URL = os.getenv("REDIS_URL")
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+
+# Ricerca impianti sciistici
+# "python": indice a trigrammi in memoria (default, funziona con qualsiasi database)
+# "postgres": similarità pg_trgm lato database con indici GIN (solo PostgreSQL)
+SKI_RESORT_SEARCH_ENGINE = os.getenv("SKI_RESORT_SEARCH_ENGINE", "python")
+# Numero massimo di impianti restituiti da /api/ski-resorts/search/
+SKI_RESORT_SEARCH_LIMIT = int(os.getenv("SKI_RESORT_SEARCH_LIMIT", "20"))
+# Secondi per cui i client possono riusare il catalogo impianti/destinazioni
+# senza rivalidarlo con If-None-Match
+CATALOG_CACHE_MAX_AGE = int(os.getenv("CATALOG_CACHE_MAX_AGE", "300"))
+# Cartella dei file precompressi del catalogo impianti (build_catalog_snapshot).
+# Vuota: lo snapshot resta solo in memoria e le richieste non scrivono su disco
+# (filesystem in sola lettura, più host senza una cartella condivisa)
+CATALOG_SNAPSHOT_DIR = os.getenv("CATALOG_SNAPSHOT_DIR") or None
+
+# Secondi di validità del profilo pubblico in cache (users/cache.py); dopo la
+# scadenza la copia precedente resta servibile per altri GRACE secondi mentre
+# una sola richiesta la ricalcola
+PUBLIC_PROFILE_CACHE_TIMEOUT = int(os.getenv("PUBLIC_PROFILE_CACHE_TIMEOUT", "300"))
+PUBLIC_PROFILE_CACHE_GRACE = int(os.getenv("PUBLIC_PROFILE_CACHE_GRACE", "300"))
+
+# Secondi per cui l'utente autenticato resta in cache (users/authentication.py)
+AUTH_USER_CACHE_TIMEOUT = int(os.getenv("AUTH_USER_CACHE_TIMEOUT", "60"))
+
+# Filtro di Bloom delle email registrate (users/bloom.py): ogni quanti secondi
+# legge i nuovi utenti degli altri processi e ogni quanti lo ricostruisce da zero
+# (anche il ritardo massimo per le email cambiate da altri processi)
+EMAIL_BLOOM_REFRESH_SECONDS = int(os.getenv("EMAIL_BLOOM_REFRESH_SECONDS", "10"))
+EMAIL_BLOOM_REBUILD_SECONDS = int(os.getenv("EMAIL_BLOOM_REBUILD_SECONDS", "600"))
+
+# Chat: messaggi salvati a lotti da un buffer in memoria (vedi chat/ingest.py)
+CHAT_WRITE_BEHIND = os.getenv("CHAT_WRITE_BEHIND") == "1"
+# Il lotto viene scritto quando raggiunge questa dimensione...
+CHAT_WRITE_BEHIND_BATCH_SIZE = int(os.getenv("CHAT_WRITE_BEHIND_BATCH_SIZE", "200"))
+# ...o quando il primo messaggio in attesa ha questi millisecondi
+CHAT_WRITE_BEHIND_FLUSH_MS = int(os.getenv("CHAT_WRITE_BEHIND_FLUSH_MS", "50"))
+# Oltre questo numero di messaggi in attesa si salva in modo sincrono
+CHAT_WRITE_BEHIND_MAX_PENDING = int(os.getenv("CHAT_WRITE_BEHIND_MAX_PENDING", "5000"))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
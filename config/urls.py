@@ -23,8 +23,19 @@ from rides.views import (
     RideOfferListView, 
     SkiResortListView,
     search_ski_resorts,
-    search_rides_by_date_range
+    search_rides_by_date_range,
+    autocomplete_ski_resorts,
+    create_booking,
+    accept_booking,
+    cancel_booking,
+    rate_booking,
 )
+from rides.async_views import (
+    search_ski_resorts_async,
+    search_rides_by_date_range_async,
+    ski_resort_list_async,
+)
+from chat.views import chat_inbox, mark_thread_read, thread_messages, poll_thread_messages
 from users.views import (
     register_user,
     get_current_user,
@@ -33,6 +44,7 @@ from users.views import (
     get_public_profile,
     check_email_availability,
 )
+from config.metrics import metrics_view
 from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView
 
 
@@ -52,16 +64,37 @@ urlpatterns = [
     path("api/users/check-email/", check_email_availability, name="check-email"),
 
     # api
-    path("api/destinations/", DestinationListView.as_view()),
-    path("api/rides/", RideOfferListView.as_view()),
+    path("api/destinations/", DestinationListView.as_view(), name="destinations-list"),
+    path("api/rides/", RideOfferListView.as_view(), name="rides-list"),
     
     # Impianti sciistici
     path("api/ski-resorts/", SkiResortListView.as_view(), name="ski-resorts-list"),
     path("api/ski-resorts/search/", search_ski_resorts, name="ski-resorts-search"),
+    path("api/ski-resorts/autocomplete/", autocomplete_ski_resorts, name="ski-resorts-autocomplete"),
     
     # Ricerca partenze per date
     path("api/rides/search/", search_rides_by_date_range, name="rides-search"),
 
+    # Versioni async (ASGI) di ricerca e catalogo
+    path("api/async/ski-resorts/", ski_resort_list_async, name="ski-resorts-list-async"),
+    path("api/async/ski-resorts/search/", search_ski_resorts_async, name="ski-resorts-search-async"),
+    path("api/async/rides/search/", search_rides_by_date_range_async, name="rides-search-async"),
+
+    # Prenotazioni
+    path("api/rides/<uuid:ride_id>/bookings/", create_booking, name="booking-create"),
+    path("api/bookings/<uuid:booking_id>/accept/", accept_booking, name="booking-accept"),
+    path("api/bookings/<uuid:booking_id>/cancel/", cancel_booking, name="booking-cancel"),
+    path("api/bookings/<uuid:booking_id>/rating/", rate_booking, name="booking-rating"),
+
+    # Chat
+    path("api/chat/inbox/", chat_inbox, name="chat-inbox"),
+    path("api/chat/threads/<uuid:thread_id>/read/", mark_thread_read, name="chat-thread-read"),
+    path("api/chat/threads/<uuid:thread_id>/messages/", thread_messages, name="chat-messages"),
+    path("api/chat/threads/<uuid:thread_id>/messages/poll/", poll_thread_messages, name="chat-messages-poll"),
+
+    # Metriche (formato Prometheus, solo admin)
+    path("api/metrics/", metrics_view, name="metrics"),
+
     #swagger
     path('api/schema/', SpectacularAPIView.as_view(), name='schema'),
     path('api/docs/', SpectacularSwaggerView.as_view(url_name='schema'), name='swagger-ui'),
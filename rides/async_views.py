@@ -0,0 +1,74 @@
+"""
+Versioni async (ASGI) degli endpoint di ricerca e del catalogo impianti.
+
+Producono lo stesso JSON delle view DRF in rides/views.py (la logica è in
+rides/queries.py) ma usano l'ORM async, così sotto ASGI una richiesta in
+attesa del database non occupa un thread. Sono view Django semplici: DRF non
+supporta view async, e questi endpoint sono pubblici.
+
+Le query di una richiesta non sono eseguite in parallelo: nella ricerca
+impianti le partenze dipendono dagli impianti trovati e arrivano già con una
+sola query (RideOffer.aupcoming_by_resort). Il vantaggio è solo la
+concorrenza tra richieste diverse sotto un server ASGI.
+"""
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+from django.views.decorators.http import require_GET
+from rest_framework.exceptions import APIException
+
+from config.http import json_response
+
+from .catalog import aget_catalog_version, catalog_etag, etag_matches, patch_catalog_headers
+from .models import RideOffer
+from .queries import ResortSearch, RideSearch, SearchParamError
+from .snapshot import get_catalog_snapshot, peek_catalog_snapshot, snapshot_response
+
+
+@require_GET
+async def search_ski_resorts_async(request):
+    """Versione async di search_ski_resorts"""
+    try:
+        search = ResortSearch(request.GET)
+    except SearchParamError as e:
+        return json_response({"error": str(e)}, status=400)
+
+    # Il matching usa l'indice in memoria (o pg_trgm): le partenze dipendono
+    # dagli impianti trovati, quindi le due fasi restano in sequenza
+    resorts = await sync_to_async(search.match)()
+    available_rides = await RideOffer.aupcoming_by_resort([resort.id for resort in resorts])
+    return json_response(search.payload(resorts, available_rides))
+
+
+@require_GET
+async def search_rides_by_date_range_async(request):
+    """Versione async di search_rides_by_date_range"""
+    try:
+        search = RideSearch(request.GET)
+        rides = [ride async for ride in search.queryset()]
+        return json_response(search.payload(rides))
+    except SearchParamError as e:
+        return json_response({"error": str(e)}, status=400)
+    except APIException as e:
+        # Cursore non valido: stessa risposta di DRF
+        return json_response({"detail": e.detail}, status=e.status_code)
+
+
+@require_GET
+async def ski_resort_list_async(request):
+    """Versione async di SkiResortListView (solo JSON, dallo snapshot precompresso)"""
+    version = await aget_catalog_version()
+    snapshot = peek_catalog_snapshot(version)
+    if snapshot is None:
+        snapshot = await sync_to_async(get_catalog_snapshot)(version)
+
+    accept_encoding = request.headers.get("Accept-Encoding")
+    etag = catalog_etag("ski-resorts", version, f"json-{snapshot.choose_encoding(accept_encoding)}")
+    if etag_matches(request.headers.get("If-None-Match"), etag):
+        response = HttpResponse(status=304)
+    else:
+        response = snapshot_response(snapshot, accept_encoding)
+    patch_catalog_headers(response, etag)
+    patch_vary_headers(response, ["Accept-Encoding"])
+    return response
@@ -0,0 +1,112 @@
+"""
+Trie dei prefissi per l'autocompletamento degli impianti sciistici.
+
+Il trie contiene le chiavi normalizzate (senza accenti né punteggiatura) del
+nome e dei nomi alternativi di ogni impianto, a partire da ogni inizio di
+parola ("piani di bobbio", "di bobbio", "bobbio"). Ogni nodo conserva già pronti i primi
+AUTOCOMPLETE_MAX_RESULTS impianti per popolarità (km di piste), quindi una
+richiesta si riduce a scorrere il prefisso e restituire la tupla del nodo.
+
+Come l'indice di ricerca (rides/search.py), il trie di ogni processo è legato
+alla versione del catalogo (rides/catalog.py) e viene ricostruito quando
+cambia, anche per modifiche senza segnali o fatte da un altro processo.
+"""
+
+import threading
+
+
+AUTOCOMPLETE_MAX_RESULTS = 10
+
+
+class _Node:
+    __slots__ = ("children", "top")
+
+    def __init__(self):
+        self.children = {}
+        self.top = []
+
+
+class ResortTrie:
+    """Trie immutabile dopo la costruzione: può essere letto da più thread"""
+
+    def __init__(self, resorts, max_results=AUTOCOMPLETE_MAX_RESULTS, version=None):
+        # Versione del catalogo da cui è stato costruito il trie
+        self.version = version
+        self.root = _Node()
+        # Inserimento in ordine di popolarità: i primi impianti che raggiungono
+        # un nodo sono già i suoi top-k, senza riordinare.
+        ranked = sorted(resorts, key=lambda r: (-(r.km_slopes or 0), r.name))
+        for resort in ranked:
+            entry = {
+                "id": str(resort.id),
+                "name": resort.name,
+                "region": resort.region,
+                "region_display": resort.get_region_display(),
+                "km_slopes": resort.km_slopes,
+            }
+            for key in self._keys(resort):
+                self._insert(key, entry, max_results)
+        self._freeze(self.root)
+
+    @staticmethod
+    def _keys(resort):
+        keys = set()
+        # Nomi già normalizzati al salvataggio (vedi rides/normalization.py)
+        for name in resort.all_searchable_names:
+            words = name.split()
+            for i in range(len(words)):
+                keys.add(" ".join(words[i:]))
+        return keys
+
+    def _insert(self, key, entry, max_results):
+        node = self.root
+        for char in key:
+            node = node.children.setdefault(char, _Node())
+            top = node.top
+            # Le chiavi di uno stesso impianto sono inserite di seguito: se è
+            # già nel nodo, è l'ultimo aggiunto.
+            if len(top) < max_results and (not top or top[-1] is not entry):
+                top.append(entry)
+
+    def _freeze(self, root):
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            node.top = tuple(node.top)
+            stack.extend(node.children.values())
+
+    def lookup(self, prefix):
+        """Restituisce la tupla precalcolata dei migliori impianti per il prefisso"""
+        node = self.root
+        for char in prefix:
+            node = node.children.get(char)
+            if node is None:
+                return ()
+        return node.top
+
+
+_trie = None
+_trie_lock = threading.Lock()
+
+
+def get_resort_trie():
+    """Restituisce il trie del processo, ricostruendolo se il catalogo è cambiato"""
+    from .catalog import get_catalog_version
+    from .models import SkiResort
+
+    global _trie
+    version = get_catalog_version()
+    trie = _trie
+    if trie is None or trie.version != version:
+        with _trie_lock:
+            if _trie is None or _trie.version != version:
+                _trie = ResortTrie(SkiResort.objects.filter(is_active=True), version=version)
+            trie = _trie
+    return trie
+
+
+def invalidate_resort_trie():
+    """Scarta il trie: verrà ricostruito alla prossima richiesta"""
+    global _trie
+    with _trie_lock:
+        _trie = None
@@ -0,0 +1,84 @@
+"""
+Versione del catalogo (impianti e destinazioni) per le GET condizionali.
+
+La versione è un hash di max(updated_at) e numero di righe di SkiResort e
+Destination, conservato nella cache di Django. Salvataggi e cancellazioni
+(segnali) e populate_ski_resorts la scartano dopo il commit: la richiesta
+successiva la ricalcola con due aggregate leggere.
+
+L'invalidazione raggiunge tutti i processi solo con una cache condivisa
+(REDIS_URL, vedi CACHES nei settings); con la cache locale gli altri processi
+vedono la nuova versione dopo CATALOG_VERSION_TIMEOUT secondi. Lo stesso
+timeout limita l'obsolescenza per le modifiche che non passano dai segnali
+(queryset.update, bulk_create).
+"""
+
+import hashlib
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Max
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags
+
+
+CATALOG_VERSION_CACHE_KEY = "rides:catalog_version"
+CATALOG_VERSION_TIMEOUT = 60
+
+
+def _compute_catalog_version():
+    from .models import Destination, SkiResort
+
+    resorts = SkiResort.objects.aggregate(count=Count("id"), updated=Max("updated_at"))
+    destinations = Destination.objects.aggregate(count=Count("id"), updated=Max("updated_at"))
+    fingerprint = "|".join(
+        str(value) for value in (
+            resorts["count"], resorts["updated"], destinations["count"], destinations["updated"],
+        )
+    )
+    return hashlib.sha1(fingerprint.encode()).hexdigest()[:16]
+
+
+def get_catalog_version():
+    """Restituisce la versione corrente del catalogo, calcolandola se non è in cache"""
+    version = cache.get(CATALOG_VERSION_CACHE_KEY)
+    if version is None:
+        version = _compute_catalog_version()
+        cache.set(CATALOG_VERSION_CACHE_KEY, version, CATALOG_VERSION_TIMEOUT)
+    return version
+
+
+async def aget_catalog_version():
+    """Versione asincrona di get_catalog_version"""
+    version = await cache.aget(CATALOG_VERSION_CACHE_KEY)
+    if version is None:
+        version = await sync_to_async(_compute_catalog_version)()
+        await cache.aset(CATALOG_VERSION_CACHE_KEY, version, CATALOG_VERSION_TIMEOUT)
+    return version
+
+
+def bump_catalog_version():
+    """Scarta la versione in cache dopo il commit: verrà ricalcolata alla prossima richiesta"""
+    transaction.on_commit(lambda: cache.delete(CATALOG_VERSION_CACHE_KEY))
+
+
+def catalog_etag(name, version, variant=""):
+    """ETag forte di un endpoint del catalogo, es. "ski-resorts-<versione>-json" """
+    parts = [name, version]
+    if variant:
+        parts.append(variant)
+    return '"%s"' % "-".join(parts)
+
+
+def etag_matches(if_none_match, etag):
+    """True se l'header If-None-Match del client include l'ETag corrente"""
+    if not if_none_match:
+        return False
+    return if_none_match.strip() == "*" or etag in parse_etags(if_none_match)
+
+
+def patch_catalog_headers(response, etag):
+    response["ETag"] = etag
+    patch_cache_control(response, public=True, max_age=settings.CATALOG_CACHE_MAX_AGE)
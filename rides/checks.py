@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+
+# Backend con una cache per processo: le invalidazioni non arrivano agli altri
+LOCAL_CACHE_BACKENDS = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """In produzione versione del catalogo e utenti in cache richiedono una cache condivisa"""
+    backend = settings.CACHES.get("default", {}).get("BACKEND")
+    if backend not in LOCAL_CACHE_BACKENDS:
+        return []
+    return [
+        Warning(
+            "La cache di default è locale al processo: con più worker le invalidazioni "
+            "di catalogo, utenti e profili non raggiungono gli altri processi.",
+            hint="Impostare REDIS_URL per usare una cache condivisa.",
+            id="rides.W001",
+        )
+    ]
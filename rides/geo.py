@@ -0,0 +1,139 @@
+"""
+Utility geografiche per la ricerca per distanza.
+
+haversine_distance calcola la distanza tra due punti; haversine_distances e
+argsort_by_distance lavorano su migliaia di punti in una sola chiamata
+vettoriale con NumPy, se installato, altrimenti ricadono sul calcolo scalare.
+
+Le coordinate di pickup vengono discretizzate in una griglia di celle da
+GRID_CELL_DEG gradi (circa 11 km in latitudine). La cella è salvata su
+RideOffer.pickup_cell ed è indicizzata, così un raggio di ricerca diventa un
+filtro SQL su un insieme di celle più un bounding box sulle coordinate.
+"""
+
+from math import atan2, cos, floor, radians, sin, sqrt
+
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.functions import ATan2, Cos, Greatest, Power, Radians, Sin, Sqrt
+
+try:
+    import numpy as np
+except ImportError:  # NumPy è opzionale: si usa il calcolo scalare
+    np = None
+
+
+EARTH_RADIUS_KM = 6371
+GRID_CELL_DEG = 0.1
+# Oltre questo numero di celle la lista IN diventa più costosa del solo
+# bounding box sulle coordinate, che resta comunque un prefiltro corretto.
+MAX_GRID_CELLS = 400
+
+
+def haversine_distance(lat1, lng1, lat2, lng2):
+    """Calcola la distanza in km tra due punti usando la formula di Haversine"""
+    lat1_rad = radians(lat1)
+    lat2_rad = radians(lat2)
+    delta_lat = radians(lat2 - lat1)
+    delta_lng = radians(lng2 - lng1)
+    
+    a = sin(delta_lat / 2) ** 2 + cos(lat1_rad) * cos(lat2_rad) * sin(delta_lng / 2) ** 2
+    c = 2 * atan2(sqrt(a), sqrt(1 - a))
+    
+    return EARTH_RADIUS_KM * c
+
+
+def haversine_distances(lat, lng, lats, lngs):
+    """
+    Distanze in km dal punto (lat, lng) a ogni punto (lats[i], lngs[i]).
+    Restituisce un array NumPy, o una lista se NumPy non è disponibile.
+    """
+    if np is None:
+        return [haversine_distance(lat, lng, lat2, lng2) for lat2, lng2 in zip(lats, lngs)]
+
+    lat_rad = np.radians(lat)
+    lats_rad = np.radians(np.asarray(lats, dtype=np.float64))
+    delta_lat = lats_rad - lat_rad
+    delta_lng = np.radians(np.asarray(lngs, dtype=np.float64) - lng)
+
+    a = np.sin(delta_lat / 2) ** 2 + np.cos(lat_rad) * np.cos(lats_rad) * np.sin(delta_lng / 2) ** 2
+    return EARTH_RADIUS_KM * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+def distance_expression(lat, lng, prefix="pickup"):
+    """
+    Espressione SQL della distanza haversine in km dal punto (lat, lng) a
+    (<prefix>_lat, <prefix>_lng), con la stessa formula di haversine_distance.
+    Le funzioni trigonometriche esistono su PostgreSQL e, registrate da
+    Django, su SQLite.
+    """
+    lat_rad = radians(lat)
+    lats_rad = Radians(F(f"{prefix}_lat"))
+    delta_lat = lats_rad - Value(lat_rad)
+    delta_lng = Radians(F(f"{prefix}_lng") - Value(float(lng)))
+    a = (
+        Power(Sin(delta_lat / Value(2.0)), Value(2.0))
+        + Value(cos(lat_rad)) * Cos(lats_rad) * Power(Sin(delta_lng / Value(2.0)), Value(2.0))
+    )
+    # Greatest: per punti quasi agli antipodi l'arrotondamento può portare a sopra 1
+    return Value(EARTH_RADIUS_KM * 2.0) * ATan2(
+        Sqrt(a), Sqrt(Greatest(Value(0.0), Value(1.0) - a)), output_field=FloatField(),
+    )
+
+
+def argsort_by_distance(lat, lng, lats, lngs):
+    """
+    Restituisce (indici ordinati per distanza crescente, distanze).
+    L'ordinamento è stabile: a parità di distanza resta l'ordine di ingresso.
+    """
+    distances = haversine_distances(lat, lng, lats, lngs)
+    if np is None:
+        order = sorted(range(len(distances)), key=distances.__getitem__)
+        return order, distances
+    return np.argsort(distances, kind="stable"), distances
+
+
+def grid_cell(lat, lng):
+    """Restituisce l'identificativo della cella di griglia che contiene il punto"""
+    return f"{floor(lat / GRID_CELL_DEG)}:{floor(lng / GRID_CELL_DEG)}"
+
+
+def bounding_box(lat, lng, radius_km):
+    """
+    Bounding box (min_lat, max_lat, min_lng, max_lng) che contiene tutti i
+    punti entro radius_km dal centro. Non gestisce l'antimeridiano.
+    """
+    delta_lat = radius_km / (EARTH_RADIUS_KM * radians(1))
+    lat_cos = cos(radians(min(abs(lat) + delta_lat, 89.9)))
+    delta_lng = radius_km / (EARTH_RADIUS_KM * radians(1) * lat_cos)
+    return (
+        max(lat - delta_lat, -90),
+        min(lat + delta_lat, 90),
+        max(lng - delta_lng, -180),
+        min(lng + delta_lng, 180),
+    )
+
+
+def grid_cells_in_box(min_lat, max_lat, min_lng, max_lng):
+    """Celle che coprono il bounding box, o None se sono più di MAX_GRID_CELLS"""
+    lat_range = range(floor(min_lat / GRID_CELL_DEG), floor(max_lat / GRID_CELL_DEG) + 1)
+    lng_range = range(floor(min_lng / GRID_CELL_DEG), floor(max_lng / GRID_CELL_DEG) + 1)
+    if len(lat_range) * len(lng_range) > MAX_GRID_CELLS:
+        return None
+    return [f"{lat_index}:{lng_index}" for lat_index in lat_range for lng_index in lng_range]
+
+
+def within_radius_q(lat, lng, radius_km, prefix="pickup"):
+    """
+    Prefiltro SQL per i punti entro radius_km: celle di griglia indicizzate più
+    bounding box sulle coordinate. Può includere punti negli angoli del box,
+    quindi va seguito dal calcolo esatto della distanza.
+    """
+    min_lat, max_lat, min_lng, max_lng = bounding_box(lat, lng, radius_km)
+    condition = Q(**{
+        f"{prefix}_lat__range": (min_lat, max_lat),
+        f"{prefix}_lng__range": (min_lng, max_lng),
+    })
+    cells = grid_cells_in_box(min_lat, max_lat, min_lng, max_lng)
+    if cells is not None:
+        condition &= Q(**{f"{prefix}_cell__in": cells})
+    return condition
@@ -0,0 +1,66 @@
+"""
+Micro-benchmark del calcolo distanze: ciclo scalare vs calcolo vettoriale NumPy.
+Esegui con: python manage.py bench_haversine --sizes 1000 10000 100000
+"""
+
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rides import geo
+
+
+class Command(BaseCommand):
+    help = 'Confronta il throughput di haversine_distance in ciclo con argsort_by_distance vettoriale'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes',
+            nargs='+',
+            type=int,
+            default=[1_000, 10_000, 100_000],
+            help='Numero di punti per ogni misura',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=5,
+            help='Ripetizioni per misura (si tiene la migliore)',
+        )
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        if geo.np is None:
+            raise CommandError('NumPy non è installato: il percorso vettoriale non è disponibile')
+
+        rng = random.Random(options['seed'])
+        # Utente a Milano, punti sparsi sull'arco alpino
+        user_lat, user_lng = 45.4642, 9.1900
+
+        self.stdout.write(f"{'punti':>10} {'ciclo (ms)':>12} {'numpy (ms)':>12} {'punti/s numpy':>16} {'speedup':>9}")
+        for size in options['sizes']:
+            lats = [rng.uniform(43.5, 47.5) for _ in range(size)]
+            lngs = [rng.uniform(6.0, 14.0) for _ in range(size)]
+
+            loop_time = self._best_time(options['repeat'], lambda: sorted(
+                range(size),
+                key=[geo.haversine_distance(user_lat, user_lng, lat, lng) for lat, lng in zip(lats, lngs)].__getitem__,
+            ))
+            numpy_time = self._best_time(options['repeat'], lambda: geo.argsort_by_distance(
+                user_lat, user_lng, lats, lngs,
+            ))
+
+            self.stdout.write(
+                f"{size:>10} {loop_time * 1000:>12.2f} {numpy_time * 1000:>12.2f} "
+                f"{size / numpy_time:>16,.0f} {loop_time / numpy_time:>8.1f}x"
+            )
+
+    @staticmethod
+    def _best_time(repeat, func):
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            best = min(best, time.perf_counter() - start)
+        return best
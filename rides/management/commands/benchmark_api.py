@@ -0,0 +1,326 @@
+"""
+Benchmark ripetibile degli endpoint di ricerca e lista su dati sintetici.
+
+Genera impianti, destinazioni, utenti/profili, partenze, prenotazioni e chat
+nelle quantità richieste, misura tempi e numero di query degli endpoint e
+stampa il risultato in JSON per confrontare esecuzioni diverse.
+Tutti i dati generati vengono annullati (rollback) alla fine.
+
+Esempi:
+    python manage.py benchmark_api --resorts 10000 --rides 1000000
+    python manage.py benchmark_api --repeat 20 --output bench.json
+"""
+
+import json
+import random
+import statistics
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.template.response import SimpleTemplateResponse
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from chat.models import ChatMessage, ChatParticipant, ChatThread
+from chat.views import chat_inbox
+from rides.autocomplete import invalidate_resort_trie
+from rides.geo import grid_cell
+from rides.models import Destination, RideBooking, RideOffer, SkiResort
+from rides.normalization import search_keys
+from rides.search import invalidate_resort_index
+from rides.views import (
+    RideOfferListView,
+    SkiResortListView,
+    search_rides_by_date_range,
+    search_ski_resorts,
+)
+from users.models import Profile
+
+User = get_user_model()
+
+BATCH_SIZE = 5000
+SYLLABLES = ["bo", "bi", "val", "mon", "ter", "ca", "ro", "sa", "pi", "la", "ni", "do", "ne", "ve", "ra", "sol"]
+SEARCH_QUERIES = ["bobio", "val", "monte", "sestrier", "cervinia"]
+# Centro dei pickup: Milano
+PICKUP_CENTER = (45.4642, 9.1900)
+
+
+class Rollback(Exception):
+    """Usata per annullare la transazione con i dati sintetici"""
+
+
+class Command(BaseCommand):
+    help = 'Genera dati sintetici e misura tempi e query degli endpoint di ricerca e lista (output JSON)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--resorts', type=int, default=1000, help='Numero di impianti')
+        parser.add_argument('--users', type=int, default=1000, help='Numero di utenti (con profilo)')
+        parser.add_argument('--rides', type=int, default=10000, help='Numero di partenze')
+        parser.add_argument('--bookings', type=int, default=10000, help='Numero di prenotazioni')
+        parser.add_argument('--threads', type=int, default=1000, help='Numero di thread di chat')
+        parser.add_argument('--messages', type=int, default=10000, help='Numero di messaggi di chat')
+        parser.add_argument('--inbox-threads', type=int, default=250,
+                            help='Thread aggiuntivi di un solo utente per il benchmark dell\'inbox')
+        parser.add_argument('--repeat', type=int, default=10, help='Ripetizioni per ogni benchmark')
+        parser.add_argument('--seed', type=int, default=42, help='Seed per dati ripetibili')
+        parser.add_argument('--output', help='File JSON di output (default: stdout)')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        # Le view costruiscono URL assoluti (paginazione): serve un host valido
+        self.factory = APIRequestFactory(HTTP_HOST='localhost')
+
+        report = {}
+        try:
+            with transaction.atomic():
+                started = time.perf_counter()
+                self.generate(options)
+                generation_seconds = time.perf_counter() - started
+                report = {
+                    'meta': {
+                        'vendor': connection.vendor,
+                        'seed': options['seed'],
+                        'repeat': options['repeat'],
+                        'sizes': {
+                            name: options[name]
+                            for name in ('resorts', 'users', 'rides', 'bookings', 'threads', 'messages',
+                                         'inbox_threads')
+                        },
+                        'generation_seconds': round(generation_seconds, 3),
+                        'timestamp': timezone.now().isoformat(),
+                    },
+                    'benchmarks': self.run_benchmarks(options['repeat']),
+                }
+                raise Rollback
+        except Rollback:
+            pass
+        finally:
+            # I dati sintetici sono stati annullati: gli indici in memoria vanno ricostruiti
+            invalidate_resort_index()
+            invalidate_resort_trie()
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+            self.stderr.write(f"Risultati scritti in {options['output']}")
+        else:
+            self.stdout.write(output)
+
+    # Generazione dati
+
+    def bulk_create(self, model, objects):
+        created = []
+        batch = []
+        for obj in objects:
+            batch.append(obj)
+            if len(batch) >= BATCH_SIZE:
+                created.extend(model.objects.bulk_create(batch))
+                batch = []
+        if batch:
+            created.extend(model.objects.bulk_create(batch))
+        return created
+
+    def random_name(self, words=2):
+        return " ".join(
+            "".join(self.rng.choice(SYLLABLES) for _ in range(self.rng.randint(2, 4))).title()
+            for _ in range(words)
+        )
+
+    def generate(self, options):
+        rng = self.rng
+        now = timezone.now()
+        self.stderr.write('Generazione dati sintetici...')
+
+        def resort():
+            name = self.random_name(rng.randint(1, 3))
+            alternative_names = ", ".join(self.random_name(1) for _ in range(rng.randint(0, 4)))
+            # bulk_create non chiama save(): le chiavi di ricerca vanno calcolate qui
+            search_name, search_aliases = search_keys(name, alternative_names)
+            return SkiResort(
+                name=name,
+                alternative_names=alternative_names,
+                search_name=search_name,
+                search_aliases=search_aliases,
+                region=rng.choice(SkiResort.Region.values),
+                lat=rng.uniform(44.0, 47.5),
+                lng=rng.uniform(6.5, 14.0),
+                km_slopes=rng.randint(5, 400),
+            )
+
+        resorts = self.bulk_create(SkiResort, (resort() for _ in range(options['resorts'])))
+        destinations = self.bulk_create(Destination, (
+            Destination(name=resort.name, lat=resort.lat, lng=resort.lng, ski_resort=resort)
+            for resort in resorts
+        ))
+        invalidate_resort_index()
+        invalidate_resort_trie()
+
+        users = self.bulk_create(User, (
+            User(username=f"bench-{i}@example.com", email=f"bench-{i}@example.com",
+                 first_name=self.random_name(1), last_name=self.random_name(1))
+            for i in range(options['users'])
+        ))
+        # bulk_create non invia i segnali: i profili vanno creati esplicitamente
+        self.bulk_create(Profile, (
+            Profile(user=user, display_name=f"{user.first_name} {user.last_name}")
+            for user in users
+        ))
+        self.users = users
+
+        def ride(i):
+            lat = PICKUP_CENTER[0] + rng.uniform(-1.0, 1.0)
+            lng = PICKUP_CENTER[1] + rng.uniform(-1.5, 1.5)
+            seats = rng.randint(1, 4)
+            return RideOffer(
+                driver=rng.choice(users),
+                destination=rng.choice(destinations),
+                departure_time=now + timedelta(minutes=rng.randint(-60 * 24 * 30, 60 * 24 * 120)),
+                pickup_label=f"Pickup {i}",
+                pickup_lat=lat,
+                pickup_lng=lng,
+                pickup_cell=grid_cell(lat, lng),
+                price_per_seat=Decimal(rng.randint(500, 4000)) / 100,
+                seats_total=seats,
+                seats_available=rng.randint(0, seats),
+                status=rng.choices(RideOffer.Status.values, weights=[8, 1, 1])[0],
+            )
+
+        rides = self.bulk_create(RideOffer, (ride(i) for i in range(options['rides'])))
+
+        booked = set()
+
+        def bookings():
+            for _ in range(options['bookings']):
+                ride = rng.choice(rides)
+                passenger = rng.choice(users)
+                if (ride.pk, passenger.pk) in booked:
+                    continue
+                booked.add((ride.pk, passenger.pk))
+                yield RideBooking(ride=ride, passenger=passenger, status=rng.choice(RideBooking.Status.values))
+
+        self.bulk_create(RideBooking, bookings())
+
+        threads = self.bulk_create(ChatThread, (
+            ChatThread(ride=rng.choice(rides) if rides else None) for _ in range(options['threads'])
+        ))
+        participants = {}
+
+        def chat_participants():
+            for thread in threads:
+                for user in rng.sample(users, min(len(users), rng.randint(2, 4))):
+                    participants.setdefault(thread.pk, []).append(user)
+                    yield ChatParticipant(thread=thread, user=user)
+
+        self.bulk_create(ChatParticipant, chat_participants())
+
+        def messages():
+            for i in range(options['messages']):
+                thread = rng.choice(threads)
+                yield ChatMessage(thread=thread, sender=rng.choice(participants[thread.pk]), body=f"Messaggio {i}")
+
+        if threads:
+            self.bulk_create(ChatMessage, messages())
+
+        self.generate_inbox(options['inbox_threads'], now)
+
+    def generate_inbox(self, count, now):
+        """Un utente con molti thread, alcuni già letti, per misurare l'inbox"""
+        rng = self.rng
+        self.inbox_user = User.objects.create(username="bench-inbox@example.com", email="bench-inbox@example.com")
+        if not count or not self.users:
+            return
+        threads = self.bulk_create(ChatThread, (ChatThread() for _ in range(count)))
+        participants = []
+        for thread in threads:
+            # Metà dei thread letta in passato: i messaggi successivi restano non letti
+            last_read_at = now - timedelta(hours=rng.randint(1, 48)) if rng.random() < 0.5 else None
+            participants.append(ChatParticipant(thread=thread, user=self.inbox_user, last_read_at=last_read_at))
+            participants.append(ChatParticipant(thread=thread, user=rng.choice(self.users)))
+        self.bulk_create(ChatParticipant, participants)
+
+        def messages():
+            for thread, (owner, other) in zip(threads, zip(participants[::2], participants[1::2])):
+                for i in range(rng.randint(0, 20)):
+                    sender = owner.user if rng.random() < 0.3 else other.user
+                    yield ChatMessage(thread=thread, sender=sender, body=f"Messaggio {i}")
+
+        self.bulk_create(ChatMessage, messages())
+
+    # Benchmark
+
+    def measure(self, name, view, path, params=None, user=None, repeat=10):
+        def call():
+            request = self.factory.get(path, params or {})
+            if user is not None:
+                force_authenticate(request, user=user)
+            response = view(request)
+            # Lo snapshot del catalogo è già un HttpResponse pronto
+            if isinstance(response, SimpleTemplateResponse):
+                response.render()
+            return response
+
+        # Riscaldamento: costruzione indici in memoria, cache del planner, ecc.
+        call()
+
+        timings = []
+        query_counts = []
+        for _ in range(repeat):
+            with CaptureQueriesContext(connection) as ctx:
+                started = time.perf_counter()
+                response = call()
+                timings.append((time.perf_counter() - started) * 1000)
+            query_counts.append(len(ctx.captured_queries))
+
+        timings.sort()
+        result = {
+            'status': response.status_code,
+            'response_bytes': len(response.content),
+            'queries': max(query_counts),
+            'ms_min': round(timings[0], 3),
+            'ms_median': round(statistics.median(timings), 3),
+            'ms_p95': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+            'ms_mean': round(statistics.fmean(timings), 3),
+        }
+        self.stderr.write(f"{name}: {result['ms_median']} ms (mediana), {result['queries']} query")
+        return result
+
+    def run_benchmarks(self, repeat):
+        today = timezone.now().date()
+        date_range = {
+            'start_date': today.isoformat(),
+            'end_date': (today + timedelta(days=7)).isoformat(),
+        }
+        user = self.users[0] if self.users else None
+        results = {}
+
+        for query in SEARCH_QUERIES:
+            results[f'search_ski_resorts[q={query}]'] = self.measure(
+                'search_ski_resorts', search_ski_resorts, '/api/ski-resorts/search/',
+                {'q': query, 'lat': PICKUP_CENTER[0], 'lng': PICKUP_CENTER[1]}, repeat=repeat,
+            )
+
+        results['search_rides_by_date_range'] = self.measure(
+            'search_rides_by_date_range', search_rides_by_date_range, '/api/rides/search/',
+            date_range, repeat=repeat,
+        )
+        results['search_rides_by_date_range[max_distance=25]'] = self.measure(
+            'search_rides_by_date_range (distanza)', search_rides_by_date_range, '/api/rides/search/',
+            {**date_range, 'lat': PICKUP_CENTER[0], 'lng': PICKUP_CENTER[1], 'max_distance': 25},
+            repeat=repeat,
+        )
+        results['RideOfferListView'] = self.measure(
+            'RideOfferListView', RideOfferListView.as_view(), '/api/rides/', user=user, repeat=repeat,
+        )
+        results['SkiResortListView'] = self.measure(
+            'SkiResortListView', SkiResortListView.as_view(), '/api/ski-resorts/', repeat=repeat,
+        )
+        results['chat_inbox'] = self.measure(
+            'chat_inbox', chat_inbox, '/api/chat/inbox/', user=self.inbox_user, repeat=repeat,
+        )
+        return results
@@ -0,0 +1,246 @@
+"""
+Confronto WSGI (view DRF sincrone) e ASGI (view async) a diversi livelli di concorrenza.
+
+Il generatore di carico gira nello stesso processo: per WSGI le richieste
+vengono eseguite da un pool di N thread (come un server WSGI con N worker
+thread), per ASGI da N task concorrenti sull'event loop che chiamano
+direttamente l'ASGIHandler di Django. Misura throughput e latenze sui dati
+già presenti nel database (es. dopo populate_ski_resorts): le view async
+usano connessioni separate, quindi non si possono usare dati in una
+transazione non confermata come fa benchmark_api.
+
+Generatore e server condividono CPU e GIL: i numeri servono a confrontare
+i due percorsi tra loro, non come capacità assoluta.
+
+Esempi:
+    python manage.py benchmark_asgi
+    python manage.py benchmark_asgi --concurrency 1,16,64 --requests 500 --output asgi.json
+"""
+
+import asyncio
+import io
+import json
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from urllib.parse import urlencode
+
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+
+SEARCH_QUERIES = ["bobio", "val", "monte", "sestrier", "cervinia"]
+# Milano, come in benchmark_api
+PICKUP_CENTER = (45.4642, 9.1900)
+
+
+def endpoints():
+    """nome -> (path WSGI, path ASGI, funzione che restituisce la query string dell'i-esima richiesta)"""
+    today = timezone.now().date()
+    date_range = {'start_date': today.isoformat(), 'end_date': (today + timedelta(days=7)).isoformat()}
+    return {
+        'ski-resorts-search': (
+            '/api/ski-resorts/search/', '/api/async/ski-resorts/search/',
+            lambda i: urlencode({'q': SEARCH_QUERIES[i % len(SEARCH_QUERIES)],
+                                 'lat': PICKUP_CENTER[0], 'lng': PICKUP_CENTER[1]}),
+        ),
+        'rides-search': (
+            '/api/rides/search/', '/api/async/rides/search/',
+            lambda i: urlencode({**date_range, 'lat': PICKUP_CENTER[0], 'lng': PICKUP_CENTER[1],
+                                 'max_distance': 25}),
+        ),
+        'ski-resorts': (
+            '/api/ski-resorts/', '/api/async/ski-resorts/',
+            lambda i: '',
+        ),
+    }
+
+
+def summarize(latencies, errors, elapsed):
+    latencies.sort()
+    ms = [latency * 1000 for latency in latencies]
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'seconds': round(elapsed, 3),
+        'rps': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'ms_median': round(statistics.median(ms), 3) if ms else None,
+        'ms_p95': round(ms[min(len(ms) - 1, int(len(ms) * 0.95))], 3) if ms else None,
+        'ms_max': round(ms[-1], 3) if ms else None,
+    }
+
+
+class WSGILoad:
+    """Esegue richieste GET sull'applicazione WSGI da un pool di thread"""
+
+    def __init__(self):
+        self.handler = WSGIHandler()
+
+    def request(self, path, query_string):
+        environ = {
+            'REQUEST_METHOD': 'GET',
+            'PATH_INFO': path,
+            'QUERY_STRING': query_string,
+            'SERVER_NAME': 'localhost',
+            'SERVER_PORT': '80',
+            'HTTP_HOST': 'localhost',
+            'HTTP_ACCEPT': 'application/json',
+            'HTTP_ACCEPT_ENCODING': 'gzip',
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'wsgi.input': io.BytesIO(),
+            'wsgi.errors': sys.stderr,
+            'wsgi.url_scheme': 'http',
+            'wsgi.version': (1, 0),
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        status = []
+        started = time.perf_counter()
+        body = self.handler(environ, lambda status_line, headers, exc_info=None: status.append(status_line))
+        try:
+            for _ in body:
+                pass
+        finally:
+            body.close()
+        return time.perf_counter() - started, int(status[0].split()[0])
+
+    def run(self, path, query_string, total, concurrency):
+        latencies, errors = [], 0
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for latency, status in executor.map(
+                lambda i: self.request(path, query_string(i)), range(total)
+            ):
+                latencies.append(latency)
+                errors += status >= 400
+        return summarize(latencies, errors, time.perf_counter() - started)
+
+
+class ASGILoad:
+    """Esegue richieste GET sull'applicazione ASGI con N task concorrenti"""
+
+    def __init__(self):
+        self.application = ASGIHandler()
+
+    async def request(self, path, query_string):
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': 'GET',
+            'scheme': 'http',
+            'path': path,
+            'raw_path': path.encode(),
+            'root_path': '',
+            'query_string': query_string.encode(),
+            'headers': [
+                (b'host', b'localhost'),
+                (b'accept', b'application/json'),
+                (b'accept-encoding', b'gzip'),
+            ],
+            'server': ('localhost', 80),
+            'client': ('127.0.0.1', 50000),
+        }
+        sent_request = False
+        disconnected = asyncio.Event()
+
+        async def receive():
+            nonlocal sent_request
+            if not sent_request:
+                sent_request = True
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            # Django resta in ascolto di http.disconnect: il client non si disconnette mai
+            await disconnected.wait()
+            return {'type': 'http.disconnect'}
+
+        status = []
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                status.append(message['status'])
+
+        started = time.perf_counter()
+        await self.application(scope, receive, send)
+        return time.perf_counter() - started, status[0]
+
+    async def _run(self, path, query_string, total, concurrency):
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def limited(i):
+            async with semaphore:
+                return await self.request(path, query_string(i))
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(limited(i) for i in range(total)))
+        elapsed = time.perf_counter() - started
+        latencies = [latency for latency, _ in results]
+        errors = sum(status >= 400 for _, status in results)
+        return summarize(latencies, errors, elapsed)
+
+    def run(self, path, query_string, total, concurrency):
+        return asyncio.run(self._run(path, query_string, total, concurrency))
+
+
+class Command(BaseCommand):
+    help = 'Confronta throughput e latenze delle view WSGI sincrone e ASGI async a vari livelli di concorrenza (output JSON)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', default='1,8,32,64',
+                            help='Livelli di concorrenza separati da virgola (default: 1,8,32,64)')
+        parser.add_argument('--requests', type=int, default=200, help='Richieste per endpoint e livello')
+        parser.add_argument('--endpoint', action='append', choices=sorted(endpoints()),
+                            help='Endpoint da misurare (ripetibile, default: tutti)')
+        parser.add_argument('--output', help='File JSON di output (default: stdout)')
+
+    def handle(self, *args, **options):
+        try:
+            levels = [int(level) for level in options['concurrency'].split(',')]
+        except ValueError:
+            raise CommandError('--concurrency deve essere una lista di interi, es: 1,8,32')
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            raise CommandError('Serve un database su file o PostgreSQL: le view async usano altre connessioni')
+
+        wsgi, asgi = WSGILoad(), ASGILoad()
+        available = endpoints()
+        selected = options['endpoint'] or sorted(available)
+        results = {}
+
+        for name in selected:
+            wsgi_path, asgi_path, query_string = available[name]
+            # Riscaldamento: indici in memoria, snapshot del catalogo, versione in cache
+            wsgi.run(wsgi_path, query_string, 5, 1)
+            asgi.run(asgi_path, query_string, 5, 1)
+
+            results[name] = {}
+            for level in levels:
+                results[name][level] = {
+                    'wsgi': wsgi.run(wsgi_path, query_string, options['requests'], level),
+                    'asgi': asgi.run(asgi_path, query_string, options['requests'], level),
+                }
+                self.stderr.write(
+                    f"{name} c={level}: WSGI {results[name][level]['wsgi']['rps']} req/s, "
+                    f"ASGI {results[name][level]['asgi']['rps']} req/s"
+                )
+
+        report = {
+            'meta': {
+                'vendor': connection.vendor,
+                'requests': options['requests'],
+                'concurrency': levels,
+                'timestamp': timezone.now().isoformat(),
+            },
+            'benchmarks': results,
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+            self.stderr.write(f"Risultati scritti in {options['output']}")
+        else:
+            self.stdout.write(output)
@@ -0,0 +1,31 @@
+"""
+Genera lo snapshot precompresso del catalogo impianti (vedi rides/snapshot.py).
+Esegui con: python manage.py build_catalog_snapshot
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rides.catalog import get_catalog_version
+from rides.snapshot import build_snapshot, snapshot_dir, write_snapshot
+
+
+class Command(BaseCommand):
+    help = 'Genera i file precompressi (gzip, brotli o deflate) del catalogo impianti servito da /api/ski-resorts/'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output-dir', help='Cartella di destinazione (default: CATALOG_SNAPSHOT_DIR)')
+
+    def handle(self, *args, **options):
+        directory = options['output_dir'] or snapshot_dir()
+        if directory is None:
+            raise CommandError('Indicare --output-dir o impostare CATALOG_SNAPSHOT_DIR')
+        snapshot = build_snapshot(get_catalog_version())
+        try:
+            write_snapshot(snapshot, directory)
+        except OSError as e:
+            raise CommandError(f'Impossibile scrivere lo snapshot in {directory}: {e}') from e
+
+        sizes = ", ".join(f"{encoding}: {len(content)} B" for encoding, content in sorted(snapshot.encoded.items()))
+        self.stdout.write(self.style.SUCCESS(
+            f'Snapshot versione {snapshot.version} scritto in {directory} ({sizes})'
+        ))
@@ -4,6 +4,7 @@ Esegui con: python manage.py populate_ski_resorts
 """
 
 from django.core.management.base import BaseCommand
+from rides.catalog import bump_catalog_version
 from rides.models import SkiResort
 
 
@@ -660,6 +661,9 @@ class Command(BaseCommand):
             else:
                 updated_count += 1
 
+        # Il catalogo è cambiato: i client lo riscaricheranno alla prossima GET condizionale
+        bump_catalog_version()
+
         self.stdout.write(self.style.SUCCESS(
             f'Completato! Creati: {created_count}, Aggiornati: {updated_count}'
         ))
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.10 on 2026-10-17 23:50
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rides', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SkiResort',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('name', models.CharField(db_index=True, max_length=120)),
+                ('alternative_names', models.TextField(blank=True, help_text='Nomi alternativi separati da virgola')),
+                ('region', models.CharField(choices=[('lombardia', 'Lombardia'), ('piemonte', 'Piemonte'), ('valle_aosta', "Valle d'Aosta"), ('trentino', 'Trentino-Alto Adige'), ('veneto', 'Veneto'), ('friuli', 'Friuli-Venezia Giulia'), ('emilia', 'Emilia-Romagna'), ('toscana', 'Toscana'), ('abruzzo', 'Abruzzo'), ('svizzera', 'Svizzera'), ('francia', 'Francia'), ('austria', 'Austria'), ('slovenia', 'Slovenia')], max_length=20)),
+                ('province', models.CharField(blank=True, max_length=50)),
+                ('lat', models.FloatField()),
+                ('lng', models.FloatField()),
+                ('altitude_min', models.PositiveIntegerField(blank=True, help_text='Altitudine minima in metri', null=True)),
+                ('altitude_max', models.PositiveIntegerField(blank=True, help_text='Altitudine massima in metri', null=True)),
+                ('km_slopes', models.PositiveIntegerField(blank=True, help_text='Km di piste', null=True)),
+                ('lifts_count', models.PositiveIntegerField(blank=True, help_text='Numero di impianti di risalita', null=True)),
+                ('website', models.URLField(blank=True)),
+                ('is_active', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Impianto Sciistico',
+                'verbose_name_plural': 'Impianti Sciistici',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.AddField(
+            model_name='destination',
+            name='ski_resort',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='rides.skiresort'),
+        ),
+    ]
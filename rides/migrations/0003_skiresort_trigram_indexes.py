@@ -0,0 +1,39 @@
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+TRIGRAM_INDEXES = [
+    ("rides_skiresort_name_trgm", "name"),
+    ("rides_skiresort_alt_names_trgm", "alternative_names"),
+]
+
+
+def create_trigram_indexes(apps, schema_editor):
+    # Gli indici GIN trigram esistono solo su PostgreSQL: su SQLite (test)
+    # la ricerca usa l'indice in memoria e non servono.
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for index_name, column in TRIGRAM_INDEXES:
+        schema_editor.execute(
+            f"CREATE INDEX IF NOT EXISTS {index_name} "
+            f"ON rides_skiresort USING gin ({column} gin_trgm_ops)"
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for index_name, _ in TRIGRAM_INDEXES:
+        schema_editor.execute(f"DROP INDEX IF EXISTS {index_name}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rides', '0002_skiresort_destination_ski_resort'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
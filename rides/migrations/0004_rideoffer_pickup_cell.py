@@ -0,0 +1,51 @@
+# Generated by Django 5.2.10 on 2026-10-17 23:51
+
+from math import floor
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+BACKFILL_BATCH_SIZE = 1000
+# Copia di rides.geo.GRID_CELL_DEG e grid_cell al momento della migrazione:
+# le migrazioni non devono dipendere dal codice corrente dell'app
+GRID_CELL_DEG = 0.1
+
+
+def grid_cell(lat, lng):
+    return f"{floor(lat / GRID_CELL_DEG)}:{floor(lng / GRID_CELL_DEG)}"
+
+
+def backfill_pickup_cell(apps, schema_editor):
+    RideOffer = apps.get_model('rides', 'RideOffer')
+    batch = []
+    rides = RideOffer.objects.only('id', 'pickup_lat', 'pickup_lng').order_by('pk')
+    for ride in rides.iterator(chunk_size=BACKFILL_BATCH_SIZE):
+        ride.pickup_cell = grid_cell(ride.pickup_lat, ride.pickup_lng)
+        batch.append(ride)
+        if len(batch) >= BACKFILL_BATCH_SIZE:
+            RideOffer.objects.bulk_update(batch, ['pickup_cell'])
+            batch = []
+    if batch:
+        RideOffer.objects.bulk_update(batch, ['pickup_cell'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rides', '0003_skiresort_trigram_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rideoffer',
+            name='pickup_cell',
+            field=models.CharField(blank=True, editable=False, max_length=16),
+        ),
+        migrations.RunPython(backfill_pickup_cell, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='rideoffer',
+            index=models.Index(fields=['pickup_cell', 'departure_time'], name='rides_ride_pickup_cell_idx'),
+        ),
+    ]
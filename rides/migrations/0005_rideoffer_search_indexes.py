@@ -0,0 +1,23 @@
+# Generated by Django 5.2.10 on 2026-10-17 23:54
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rides', '0004_rideoffer_pickup_cell'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='rideoffer',
+            index=models.Index(condition=models.Q(('seats_available__gt', 0), ('status', 'published')), fields=['departure_time'], name='rides_ride_published_dep_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rideoffer',
+            index=models.Index(fields=['destination', 'departure_time'], name='rides_ride_dest_dep_idx'),
+        ),
+    ]
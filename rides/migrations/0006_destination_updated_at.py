@@ -0,0 +1,18 @@
+# Generated by Django 5.2.10 on 2026-10-18 00:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rides', '0005_rideoffer_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='destination',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
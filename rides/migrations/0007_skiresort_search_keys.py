@@ -0,0 +1,90 @@
+# Generated by Django 5.2.10 on 2026-10-18 00:05
+
+import unicodedata
+
+from django.db import migrations, models
+
+
+BACKFILL_BATCH_SIZE = 1000
+
+OLD_TRIGRAM_INDEXES = [
+    ("rides_skiresort_name_trgm", "name"),
+    ("rides_skiresort_alt_names_trgm", "alternative_names"),
+]
+NEW_TRIGRAM_INDEXES = [
+    ("rides_skiresort_search_name_trgm", "search_name"),
+    ("rides_skiresort_search_aliases_trgm", "search_aliases"),
+]
+
+
+# Copia di rides.normalization al momento della migrazione: le migrazioni
+# non devono dipendere dal codice corrente dell'app
+def normalize_search_key(text):
+    decomposed = unicodedata.normalize("NFKD", text)
+    folded = "".join(c for c in decomposed if not unicodedata.combining(c)).casefold().strip()
+    return " ".join("".join(c if c.isalnum() else " " for c in folded).split())
+
+
+def search_keys(name, alternative_names):
+    name_key = normalize_search_key(name)
+    aliases = []
+    for alias in (alternative_names or "").split(","):
+        key = normalize_search_key(alias)
+        if key and key != name_key and key not in aliases:
+            aliases.append(key)
+    return name_key, "\n".join(aliases)
+
+
+def backfill_search_keys(apps, schema_editor):
+    SkiResort = apps.get_model('rides', 'SkiResort')
+    batch = []
+    resorts = SkiResort.objects.only('id', 'name', 'alternative_names').order_by('pk')
+    for resort in resorts.iterator(chunk_size=BACKFILL_BATCH_SIZE):
+        resort.search_name, resort.search_aliases = search_keys(resort.name, resort.alternative_names)
+        batch.append(resort)
+        if len(batch) >= BACKFILL_BATCH_SIZE:
+            SkiResort.objects.bulk_update(batch, ['search_name', 'search_aliases'])
+            batch = []
+    if batch:
+        SkiResort.objects.bulk_update(batch, ['search_name', 'search_aliases'])
+
+
+def swap_trigram_indexes(create, drop):
+    def operation(apps, schema_editor):
+        # Come in 0003: gli indici GIN trigram esistono solo su PostgreSQL
+        if schema_editor.connection.vendor != "postgresql":
+            return
+        for index_name, column in create:
+            schema_editor.execute(
+                f"CREATE INDEX IF NOT EXISTS {index_name} "
+                f"ON rides_skiresort USING gin ({column} gin_trgm_ops)"
+            )
+        for index_name, _ in drop:
+            schema_editor.execute(f"DROP INDEX IF EXISTS {index_name}")
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rides', '0006_destination_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='skiresort',
+            name='search_aliases',
+            field=models.TextField(blank=True, editable=False, help_text='Nomi alternativi normalizzati, uno per riga'),
+        ),
+        migrations.AddField(
+            model_name='skiresort',
+            name='search_name',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=255),
+        ),
+        migrations.RunPython(backfill_search_keys, migrations.RunPython.noop),
+        # trigram_search ora lavora sulle chiavi normalizzate
+        migrations.RunPython(
+            swap_trigram_indexes(NEW_TRIGRAM_INDEXES, OLD_TRIGRAM_INDEXES),
+            swap_trigram_indexes(OLD_TRIGRAM_INDEXES, NEW_TRIGRAM_INDEXES),
+        ),
+    ]
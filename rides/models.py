@@ -1,7 +1,12 @@
 import uuid
 from django.conf import settings
-from django.db import models
-from difflib import SequenceMatcher
+from django.contrib.postgres.search import TrigramWordSimilarity
+from django.db import connection, models, transaction
+from django.db.models import DEFERRED, F, Q, Window
+from django.db.models.functions import Greatest, RowNumber
+from django.utils import timezone
+from .geo import grid_cell
+from .normalization import normalize_search_key, search_keys
 
 
 class SkiResort(models.Model):
@@ -38,6 +43,9 @@ class SkiResort(models.Model):
     lifts_count = models.PositiveIntegerField(null=True, blank=True, help_text="Numero di impianti di risalita")
     website = models.URLField(blank=True)
     is_active = models.BooleanField(default=True)
+    # Chiavi di ricerca normalizzate (vedi rides/normalization.py), calcolate al salvataggio
+    search_name = models.CharField(max_length=255, blank=True, editable=False, db_index=True)
+    search_aliases = models.TextField(blank=True, editable=False, help_text="Nomi alternativi normalizzati, uno per riga")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -49,49 +57,65 @@ class SkiResort(models.Model):
     def __str__(self):
         return f"{self.name} ({self.get_region_display()})"
 
+    def save(self, *args, **kwargs):
+        self.search_name, self.search_aliases = search_keys(self.name, self.alternative_names)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and {"name", "alternative_names"} & set(update_fields):
+            kwargs["update_fields"] = {*update_fields, "search_name", "search_aliases"}
+        super().save(*args, **kwargs)
+
     @property
     def all_searchable_names(self):
-        """Restituisce tutti i nomi ricercabili (nome principale + alternativi)"""
-        names = [self.name.lower()]
-        if self.alternative_names:
-            names.extend([n.strip().lower() for n in self.alternative_names.split(",")])
+        """Restituisce tutti i nomi ricercabili normalizzati (nome principale + alternativi)"""
+        names = [self.search_name]
+        if self.search_aliases:
+            names.extend(self.search_aliases.split("\n"))
         return names
 
     @classmethod
-    def fuzzy_search(cls, query, threshold=0.5):
+    def fuzzy_search(cls, query, threshold=0.5, limit=None):
         """
         Ricerca fuzzy che trova le piste anche con errori di ortografia.
         Es: "bobio" -> "Piani di Bobbio"
+
+        Usa l'indice a trigrammi del processo (vedi rides/search.py), che viene
+        ricostruito automaticamente quando un impianto cambia.
+        """
+        from .search import get_resort_index
+
+        return get_resort_index().search(query, threshold=threshold, limit=limit)
+
+    @classmethod
+    def trigram_search(cls, query, threshold=0.4, limit=None):
         """
-        query_lower = query.lower().strip()
-        results = []
-        
-        for resort in cls.objects.filter(is_active=True):
-            best_score = 0
-            for searchable_name in resort.all_searchable_names:
-                # Calcola similarità con SequenceMatcher
-                score = SequenceMatcher(None, query_lower, searchable_name).ratio()
-                
-                # Bonus se la query è contenuta nel nome o viceversa
-                if query_lower in searchable_name or searchable_name in query_lower:
-                    score = max(score, 0.8)
-                
-                # Bonus per match parziale delle parole
-                query_words = set(query_lower.split())
-                name_words = set(searchable_name.split())
-                common_words = query_words & name_words
-                if common_words:
-                    word_score = len(common_words) / max(len(query_words), len(name_words))
-                    score = max(score, word_score * 0.9)
-                
-                best_score = max(best_score, score)
-            
-            if best_score >= threshold:
-                results.append((resort, best_score))
-        
-        # Ordina per score decrescente
-        results.sort(key=lambda x: x[1], reverse=True)
-        return [r[0] for r in results]
+        Ricerca fuzzy lato database con pg_trgm (solo PostgreSQL).
+        Usa gli indici GIN trigram su search_name e search_aliases e restituisce
+        solo i primi `limit` risultati ordinati per similarità.
+        """
+        query_key = normalize_search_key(query)
+        resorts = cls.objects.filter(
+            Q(search_name__trigram_word_similar=query_key)
+            | Q(search_aliases__trigram_word_similar=query_key),
+            is_active=True,
+        ).annotate(
+            similarity=Greatest(
+                TrigramWordSimilarity(query_key, "search_name"),
+                TrigramWordSimilarity(query_key, "search_aliases"),
+            )
+        ).filter(similarity__gte=threshold).order_by("-similarity", "name")
+
+        if limit is not None:
+            resorts = resorts[:limit]
+
+        with transaction.atomic():
+            # L'operatore %> usa la soglia di sessione: la allineiamo a quella
+            # richiesta solo per questa transazione.
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT set_config('pg_trgm.word_similarity_threshold', %s, true)",
+                    [str(threshold)],
+                )
+            return list(resorts)
 
 
 class Destination(models.Model):
@@ -103,11 +127,43 @@ class Destination(models.Model):
     lng = models.FloatField()
     # Collegamento opzionale a SkiResort
     ski_resort = models.ForeignKey(SkiResort, on_delete=models.SET_NULL, null=True, blank=True)
+    # Usato per la versione del catalogo (vedi rides/catalog.py)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.name
 
-class RideOffer(models.Model):
+class CompletionTrackingMixin:
+    """
+    Ricorda lo status letto dal database, così il segnale post_save riconosce
+    i passaggi da e verso COMPLETED che aggiornano i contatori del profilo
+    (rides_as_driver / rides_as_passenger, vedi rides/signals.py).
+    """
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._saved_status = instance.__dict__.get("status", DEFERRED)
+        return instance
+
+    def save(self, *args, **kwargs):
+        # Status e contatori (aggiornati da post_save) nello stesso commit
+        with transaction.atomic(savepoint=False):
+            super().save(*args, **kwargs)
+
+    def completed_delta(self, created, update_fields=None):
+        """+1 se il salvataggio porta lo status a COMPLETED, -1 se lo lascia, 0 altrimenti"""
+        if update_fields is not None and "status" not in update_fields:
+            return 0
+        previous = None if created else getattr(self, "_saved_status", DEFERRED)
+        self._saved_status = self.status
+        if previous is DEFERRED:
+            # Status precedente sconosciuto: ci pensa reconcile_ride_counters
+            return 0
+        return (self.status == self.Status.COMPLETED) - (previous == self.Status.COMPLETED)
+
+
+class RideOffer(CompletionTrackingMixin, models.Model):
     class Status(models.TextChoices):
         PUBLISHED = "published"
         CANCELLED = "cancelled"
@@ -120,13 +176,98 @@ class RideOffer(models.Model):
     pickup_label = models.CharField(max_length=120)
     pickup_lat = models.FloatField()
     pickup_lng = models.FloatField()
+    # Cella della griglia geografica del pickup (vedi rides/geo.py), calcolata al salvataggio
+    pickup_cell = models.CharField(max_length=16, blank=True, editable=False)
     price_per_seat = models.DecimalField(max_digits=8, decimal_places=2)
     seats_total = models.PositiveIntegerField(default=3)
     seats_available = models.PositiveIntegerField(default=3)
     status = models.CharField(max_length=20, choices=Status.choices, default=Status.PUBLISHED)
     created_at = models.DateTimeField(auto_now_add=True)
 
-class RideBooking(models.Model):
+    class Meta:
+        indexes = [
+            models.Index(fields=["pickup_cell", "departure_time"], name="rides_ride_pickup_cell_idx"),
+            # Hot path della ricerca: solo partenze pubblicate con posti liberi
+            models.Index(
+                fields=["departure_time"],
+                condition=Q(status="published", seats_available__gt=0),
+                name="rides_ride_published_dep_idx",
+            ),
+            models.Index(fields=["destination", "departure_time"], name="rides_ride_dest_dep_idx"),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.pickup_cell = grid_cell(self.pickup_lat, self.pickup_lng)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and {"pickup_lat", "pickup_lng"} & set(update_fields):
+            kwargs["update_fields"] = {*update_fields, "pickup_cell"}
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def upcoming_by_resort_queryset(cls, resort_ids, per_resort=5):
+        """
+        Le prossime `per_resort` partenze disponibili per ogni impianto, con una
+        sola query (ROW_NUMBER partizionato per impianto), in ordine di partenza.
+        """
+        return cls.objects.filter(
+            destination__ski_resort_id__in=resort_ids,
+            status=cls.Status.PUBLISHED,
+            departure_time__gte=timezone.now(),
+            seats_available__gt=0,
+        ).annotate(
+            resort_id=F("destination__ski_resort_id"),
+            resort_rank=Window(
+                RowNumber(),
+                partition_by=F("destination__ski_resort_id"),
+                order_by=[F("departure_time").asc(), F("id").asc()],
+            ),
+        ).filter(resort_rank__lte=per_resort).select_related("driver").order_by("departure_time", "id")
+
+    @staticmethod
+    def group_by_resort(rides, resort_ids):
+        rides_by_resort = {resort_id: [] for resort_id in resort_ids}
+        for ride in rides:
+            rides_by_resort[ride.resort_id].append(ride)
+        return rides_by_resort
+
+    @classmethod
+    def upcoming_by_resort(cls, resort_ids, per_resort=5):
+        """
+        Restituisce le prossime `per_resort` partenze disponibili per ogni
+        impianto, con una sola query (ROW_NUMBER partizionato per impianto).
+        Risultato: {ski_resort_id: [RideOffer, ...]} in ordine di partenza.
+        """
+        return cls.group_by_resort(cls.upcoming_by_resort_queryset(resort_ids, per_resort), resort_ids)
+
+    @classmethod
+    async def aupcoming_by_resort(cls, resort_ids, per_resort=5):
+        """Versione asincrona di upcoming_by_resort (ORM async)"""
+        rides = [ride async for ride in cls.upcoming_by_resort_queryset(resort_ids, per_resort)]
+        return cls.group_by_resort(rides, resort_ids)
+
+    @classmethod
+    def reserve_seats(cls, ride_id, seats):
+        """
+        Scala `seats` posti con un UPDATE condizionale (seats_available >= seats):
+        il controllo e la modifica avvengono nella stessa istruzione, quindi
+        richieste concorrenti non possono mai vendere più posti di quelli liberi.
+        Restituisce True se i posti sono stati riservati.
+        """
+        return cls.objects.filter(
+            pk=ride_id,
+            status=cls.Status.PUBLISHED,
+            seats_available__gte=seats,
+        ).update(seats_available=F("seats_available") - seats) == 1
+
+    @classmethod
+    def release_seats(cls, ride_id, seats):
+        """Restituisce `seats` posti alla partenza (senza superare seats_total)"""
+        return cls.objects.filter(
+            pk=ride_id,
+            seats_available__lte=F("seats_total") - seats,
+        ).update(seats_available=F("seats_available") + seats) == 1
+
+class RideBooking(CompletionTrackingMixin, models.Model):
     class Status(models.TextChoices):
         REQUESTED = "requested"
         ACCEPTED = "accepted"
@@ -145,3 +286,22 @@ class RideBooking(models.Model):
         constraints = [
             models.UniqueConstraint(fields=["ride", "passenger"], name="unique_booking_per_user"),
         ]
+
+
+class RideRating(models.Model):
+    """Valutazione dell'autista da parte del passeggero, una per prenotazione"""
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    booking = models.OneToOneField(RideBooking, on_delete=models.CASCADE, related_name="rating")
+    rater = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="ratings_given")
+    driver = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="ratings_received")
+    score = models.PositiveSmallIntegerField()
+    comment = models.TextField(blank=True, max_length=500)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.CheckConstraint(
+                condition=Q(score__gte=1, score__lte=5), name="ride_rating_score_range",
+            ),
+        ]
@@ -0,0 +1,37 @@
+"""
+Normalizzazione dei testi per ricerca e autocompletamento degli impianti.
+
+Le chiavi normalizzate del catalogo sono salvate su SkiResort al salvataggio
+(search_name, search_aliases): a ogni richiesta si normalizza solo la query.
+"""
+
+import unicodedata
+
+
+def fold(text):
+    """Rimuove accenti e maiuscole: "Sölden" -> "solden" """
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).casefold().strip()
+
+
+def normalize_search_key(text):
+    """
+    Chiave di ricerca: senza accenti, minuscola, punteggiatura sostituita da
+    spazi e spazi compattati. "Piani di Bobbio - Valsassina" -> "piani di bobbio valsassina"
+    """
+    folded = fold(text)
+    return " ".join("".join(c if c.isalnum() else " " for c in folded).split())
+
+
+def search_keys(name, alternative_names):
+    """
+    Restituisce (chiave del nome, chiavi dei nomi alternativi separate da a capo),
+    senza duplicati né voci vuote.
+    """
+    name_key = normalize_search_key(name)
+    aliases = []
+    for alias in (alternative_names or "").split(","):
+        key = normalize_search_key(alias)
+        if key and key != name_key and key not in aliases:
+            aliases.append(key)
+    return name_key, "\n".join(aliases)
@@ -0,0 +1,146 @@
+"""
+Paginazione keyset (a cursore) per le partenze.
+
+Il cursore è opaco per il client: contiene l'ultima chiave vista
+(departure_time, id), più la distanza nella modalità ordinata per distanza,
+codificata in base64. Ogni pagina filtra "dopo la chiave" invece di usare
+OFFSET, quindi il costo resta costante a qualsiasi profondità di scroll.
+Un cursore malformato o di un'altra modalità è un errore del client (400).
+"""
+
+import base64
+import json
+import uuid
+from datetime import datetime
+
+from django.db.models import Q
+from rest_framework.exceptions import ParseError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+CURSOR_QUERY_PARAM = "cursor"
+PAGE_SIZE_QUERY_PARAM = "page_size"
+INVALID_CURSOR_MESSAGE = "Cursore non valido"
+
+
+def encode_cursor(ride, mode="time", distance=None):
+    """Codifica la chiave dell'ultima partenza di una pagina"""
+    position = {"m": mode, "t": ride.departure_time.isoformat(), "id": str(ride.id)}
+    if distance is not None:
+        position["d"] = float(distance)
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+
+def decode_cursor(cursor, mode="time"):
+    """
+    Decodifica un cursore e restituisce (departure_time, id, distanza).
+    Solleva ParseError (400) se il cursore è malformato o di un'altra modalità.
+    """
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if position["m"] != mode:
+            raise ValueError(mode)
+        departure_time = datetime.fromisoformat(position["t"])
+        ride_id = uuid.UUID(position["id"])
+        distance = float(position["d"]) if mode == "distance" else None
+    except (TypeError, ValueError, KeyError, UnicodeDecodeError):
+        raise ParseError(INVALID_CURSOR_MESSAGE)
+    return departure_time, ride_id, distance
+
+
+def after_key_q(departure_time, ride_id):
+    """Condizione keyset: partenze successive a (departure_time, id)"""
+    return Q(departure_time__gt=departure_time) | Q(departure_time=departure_time, id__gt=ride_id)
+
+
+def after_distance_key_q(distance, departure_time, ride_id, field="pickup_distance"):
+    """Condizione keyset della modalità per distanza: dopo (distanza, departure_time, id)"""
+    return (
+        Q(**{f"{field}__gt": distance})
+        | Q(**{field: distance}, departure_time__gt=departure_time)
+        | Q(**{field: distance}, departure_time=departure_time, id__gt=ride_id)
+    )
+
+
+def parse_page_size(value, default, maximum):
+    """Converte il valore di page_size, limitandolo a [1, maximum]"""
+    if value is None:
+        return default
+    try:
+        page_size = int(value)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(page_size, maximum))
+
+
+def get_page_size(request, default, maximum):
+    """Legge page_size dalla query string, limitandolo a [1, maximum]"""
+    return parse_page_size(request.query_params.get(PAGE_SIZE_QUERY_PARAM), default, maximum)
+
+
+def next_page_url(request, cursor):
+    if cursor is None:
+        return None
+    return replace_query_param(request.build_absolute_uri(), CURSOR_QUERY_PARAM, cursor)
+
+
+class RideKeysetPagination(BasePagination):
+    """Paginazione keyset su (departure_time, id) per le liste di RideOffer"""
+
+    page_size = 20
+    max_page_size = 100
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = get_page_size(request, self.page_size, self.max_page_size)
+
+        queryset = queryset.order_by("departure_time", "id")
+        cursor = request.query_params.get(CURSOR_QUERY_PARAM)
+        if cursor:
+            departure_time, ride_id, _ = decode_cursor(cursor)
+            queryset = queryset.filter(after_key_q(departure_time, ride_id))
+
+        # Una riga in più per sapere se esiste la pagina successiva
+        rides = list(queryset[:page_size + 1])
+        has_next = len(rides) > page_size
+        rides = rides[:page_size]
+        self.next_cursor = encode_cursor(rides[-1]) if has_next else None
+        return rides
+
+    def get_paginated_response(self, data):
+        return Response({
+            "next": next_page_url(self.request, self.next_cursor),
+            "next_cursor": self.next_cursor,
+            "results": data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "next_cursor": {"type": "string", "nullable": True},
+                "results": schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                "name": CURSOR_QUERY_PARAM,
+                "required": False,
+                "in": "query",
+                "description": "Cursore opaco restituito come next_cursor dalla pagina precedente",
+                "schema": {"type": "string"},
+            },
+            {
+                "name": PAGE_SIZE_QUERY_PARAM,
+                "required": False,
+                "in": "query",
+                "description": f"Numero di risultati per pagina (max {self.max_page_size})",
+                "schema": {"type": "integer"},
+            },
+        ]
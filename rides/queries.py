@@ -0,0 +1,248 @@
+"""
+Logica delle ricerche condivisa tra le view sincrone (DRF) e quelle async.
+
+Ogni ricerca è divisa in tre fasi: lettura dei parametri, queryset da
+eseguire e costruzione della risposta a partire dalle righe lette. Solo la
+seconda tocca il database, così la view sync la esegue con list() e quella
+async con l'ORM asincrono, producendo lo stesso JSON.
+"""
+
+from datetime import datetime
+
+from django.conf import settings
+from django.utils import timezone
+
+from .geo import argsort_by_distance, distance_expression, within_radius_q
+from .models import RideOffer
+from .pagination import (
+    CURSOR_QUERY_PARAM,
+    PAGE_SIZE_QUERY_PARAM,
+    after_distance_key_q,
+    after_key_q,
+    decode_cursor,
+    encode_cursor,
+    parse_page_size,
+)
+from .search import search_resorts
+from .serializers import SkiResortSearchResultSerializer
+
+
+class SearchParamError(Exception):
+    """Parametro di ricerca mancante o non valido (risposta 400)"""
+
+
+def parse_position(query_params):
+    """Restituisce (lat, lng) dai parametri, o None se assenti o non validi"""
+    lat = query_params.get('lat')
+    lng = query_params.get('lng')
+    if not (lat and lng):
+        return None
+    try:
+        return float(lat), float(lng)
+    except (ValueError, TypeError):
+        return None  # Ignora errori di conversione, non calcolare distanza
+
+
+class ResortSearch:
+    """Ricerca fuzzy degli impianti con distanza e partenze disponibili"""
+
+    def __init__(self, query_params):
+        self.query = query_params.get('q', '').strip()
+        if not self.query or len(self.query) < 2:
+            raise SearchParamError("Il parametro 'q' deve contenere almeno 2 caratteri")
+
+        self.position = parse_position(query_params)
+        try:
+            self.threshold = float(query_params.get('threshold', 0.4))
+        except (ValueError, TypeError):
+            raise SearchParamError("Il parametro 'threshold' deve essere un numero tra 0 e 1")
+        # Il confronto esclude anche NaN
+        if not 0 <= self.threshold <= 1:
+            raise SearchParamError("Il parametro 'threshold' deve essere un numero tra 0 e 1")
+        try:
+            limit = int(query_params.get('limit', settings.SKI_RESORT_SEARCH_LIMIT))
+        except (ValueError, TypeError):
+            raise SearchParamError("Il parametro 'limit' deve essere un intero")
+        self.limit = max(1, min(limit, settings.SKI_RESORT_SEARCH_LIMIT))
+
+    def match(self):
+        """Impianti trovati (in memoria o pg_trgm, vedi SKI_RESORT_SEARCH_ENGINE), ordinati per distanza se nota"""
+        resorts = search_resorts(self.query, threshold=self.threshold, limit=self.limit)
+        if self.position:
+            # Aggiungi distanza a ogni resort (calcolo vettoriale su tutti i risultati)
+            order, distances = argsort_by_distance(
+                *self.position,
+                [resort.lat for resort in resorts],
+                [resort.lng for resort in resorts],
+            )
+            for resort, distance in zip(resorts, distances):
+                resort.distance_km = round(float(distance), 1)
+            resorts = [resorts[i] for i in order]
+        return resorts
+
+    def payload(self, resorts, available_rides):
+        serializer = SkiResortSearchResultSerializer(
+            resorts, many=True, context={'available_rides': available_rides}
+        )
+        return {
+            "query": self.query,
+            "count": len(resorts),
+            "results": serializer.data,
+        }
+
+
+class RideSearch:
+    """
+    Ricerca partenze in un range di date con paginazione keyset.
+
+    Con lat, lng e max_distance le partenze sono ordinate per distanza pickup
+    su tutto il raggio; altrimenti per orario, e con la sola posizione ogni
+    pagina viene riordinata per distanza.
+
+    In entrambe le modalità ordinamento, cursore e LIMIT sono nella query: la
+    distanza è calcolata dal database sulle righe del prefiltro indicizzato
+    (celle + bounding box) e ogni pagina legge page_size + 1 righe.
+    """
+
+    DEFAULT_PAGE_SIZE = 50
+    MAX_PAGE_SIZE = 100
+
+    def __init__(self, query_params):
+        start_date_str = query_params.get('start_date')
+        end_date_str = query_params.get('end_date')
+        if not start_date_str or not end_date_str:
+            raise SearchParamError("Parametri 'start_date' e 'end_date' sono obbligatori")
+
+        try:
+            self.start_date = datetime.fromisoformat(start_date_str.replace('Z', '+00:00'))
+            self.end_date = datetime.fromisoformat(end_date_str.replace('Z', '+00:00'))
+
+            # Se sono date senza timezone, aggiungi il timezone corrente
+            if self.start_date.tzinfo is None:
+                self.start_date = timezone.make_aware(self.start_date)
+            if self.end_date.tzinfo is None:
+                self.end_date = timezone.make_aware(self.end_date)
+        except ValueError:
+            raise SearchParamError("Formato data non valido. Usa ISO 8601 (es: 2026-01-22)")
+
+        self.ski_resort_id = query_params.get('ski_resort_id')
+        self.position = parse_position(query_params)
+        self.max_distance = None
+        max_distance = query_params.get('max_distance')
+        if self.position and max_distance:
+            try:
+                self.max_distance = float(max_distance)
+            except (ValueError, TypeError):
+                self.position = None
+
+        self.page_size = parse_page_size(
+            query_params.get(PAGE_SIZE_QUERY_PARAM), self.DEFAULT_PAGE_SIZE, self.MAX_PAGE_SIZE,
+        )
+        self.cursor = query_params.get(CURSOR_QUERY_PARAM)
+
+    @property
+    def by_distance(self):
+        return self.position is not None and self.max_distance is not None
+
+    def queryset(self):
+        """Unico queryset da eseguire: la pagina per distanza o per orario"""
+        rides = RideOffer.objects.filter(
+            status=RideOffer.Status.PUBLISHED,
+            departure_time__gte=self.start_date,
+            departure_time__lt=self.end_date,
+            seats_available__gt=0
+        ).select_related('driver', 'destination', 'destination__ski_resort').order_by('departure_time', 'id')
+
+        # Filtro opzionale per impianto sciistico
+        if self.ski_resort_id:
+            rides = rides.filter(destination__ski_resort_id=self.ski_resort_id)
+
+        if self.by_distance:
+            # Prefiltro indicizzato (celle di griglia + bounding box), poi
+            # distanza esatta e keyset su (distanza, departure_time, id)
+            rides = rides.filter(within_radius_q(*self.position, self.max_distance)).annotate(
+                pickup_distance=distance_expression(*self.position),
+            ).filter(pickup_distance__lte=self.max_distance)
+            if self.cursor:
+                departure_time, ride_id, distance = decode_cursor(self.cursor, mode="distance")
+                rides = rides.filter(after_distance_key_q(distance, departure_time, ride_id))
+            return rides.order_by('pickup_distance', 'departure_time', 'id')[:self.page_size + 1]
+
+        # Modalità per orario: keyset su (departure_time, id)
+        if self.cursor:
+            departure_time, ride_id, _ = decode_cursor(self.cursor)
+            rides = rides.filter(after_key_q(departure_time, ride_id))
+        return rides[:self.page_size + 1]
+
+    def payload(self, rides):
+        if self.by_distance:
+            rides_list, next_cursor = self._distance_page(rides)
+        else:
+            rides_list, next_cursor = self._time_page(rides)
+
+        return {
+            "start_date": self.start_date.isoformat(),
+            "end_date": self.end_date.isoformat(),
+            "count": len(rides_list),
+            "next_cursor": next_cursor,
+            "results": [self._ride_data(ride) for ride in rides_list],
+        }
+
+    def _distance_page(self, rides_list):
+        next_cursor = None
+        if len(rides_list) > self.page_size:
+            rides_list = rides_list[:self.page_size]
+            last = rides_list[-1]
+            next_cursor = encode_cursor(last, mode="distance", distance=last.pickup_distance)
+        for ride in rides_list:
+            ride.pickup_distance_km = round(ride.pickup_distance, 1)
+        return rides_list, next_cursor
+
+    def _time_page(self, rides_list):
+        next_cursor = None
+        if len(rides_list) > self.page_size:
+            rides_list = rides_list[:self.page_size]
+            next_cursor = encode_cursor(rides_list[-1])
+
+        # Con la sola posizione, la pagina viene ordinata per distanza pickup
+        if self.position:
+            order, distances = argsort_by_distance(
+                *self.position,
+                [ride.pickup_lat for ride in rides_list],
+                [ride.pickup_lng for ride in rides_list],
+            )
+            for ride, distance in zip(rides_list, distances):
+                ride.pickup_distance_km = round(float(distance), 1)
+            rides_list = [rides_list[i] for i in order]
+        return rides_list, next_cursor
+
+    @staticmethod
+    def _ride_data(ride):
+        ride_data = {
+            'id': str(ride.id),
+            'departure_time': ride.departure_time.isoformat(),
+            'price_per_seat': float(ride.price_per_seat),
+            'seats_available': ride.seats_available,
+            'pickup_label': ride.pickup_label,
+            'pickup_lat': ride.pickup_lat,
+            'pickup_lng': ride.pickup_lng,
+            'driver_name': f"{ride.driver.first_name} {ride.driver.last_name}".strip() or ride.driver.username,
+            'destination': {
+                'id': str(ride.destination.id),
+                'name': ride.destination.name,
+            }
+        }
+
+        # Aggiungi info ski resort se presente
+        if ride.destination.ski_resort:
+            ride_data['ski_resort'] = {
+                'id': str(ride.destination.ski_resort.id),
+                'name': ride.destination.ski_resort.name,
+                'region': ride.destination.ski_resort.get_region_display(),
+            }
+
+        # Aggiungi distanza pickup se calcolata
+        if hasattr(ride, 'pickup_distance_km'):
+            ride_data['pickup_distance_km'] = ride.pickup_distance_km
+
+        return ride_data
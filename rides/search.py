@@ -0,0 +1,269 @@
+"""
+Indice in memoria per la ricerca fuzzy degli impianti sciistici.
+
+Ogni ricerca valuta con SequenceMatcher (score_name) solo pochi candidati,
+scelti con un indice invertito dei trigrammi: quelli della stringa intera e
+quelli delle parole con uno spazio di padding (vedi trigrams).
+- Filtro sui trigrammi: un nome senza trigrammi in comune con la query non è
+  candidato. Si leggono le liste dei trigrammi della query dalle più corte,
+  fino a SEARCH_POSTINGS_BUDGET voci.
+- Limite ai candidati: restano i SEARCH_MAX_CANDIDATES impianti con più
+  trigrammi in comune (a parità, indice di Jaccard più alto), con il loro nome
+  più simile. Così il costo di una ricerca non cresce con il catalogo.
+
+I punteggi sono quelli della scansione completa, ma possono mancare i
+risultati deboli (rapporto di SequenceMatcher vicino alla soglia senza
+trigrammi in comune). Il primo risultato e i nomi che contengono la query
+restano quelli della scansione completa (rides/tests.py).
+
+Su un catalogo sintetico di 10.000 impianti (40.000 nomi) la mediana di una
+ricerca è 0,45-0,8 ms con NumPy (p95 0,7-1,2 ms) e 1,1-1,7 ms senza. La
+scansione completa richiede 0,8-1,4 s.
+
+L'indice di ogni processo è legato alla versione del catalogo
+(rides/catalog.py): quando la versione cambia, per modifiche fatte da
+qualunque processo o anche senza segnali (bulk_create, update() che aggiorna
+updated_at), viene ricostruito alla ricerca successiva. I segnali di
+SkiResort lo scartano subito nel processo che ha fatto la modifica.
+"""
+
+import copy
+import threading
+from collections import Counter, defaultdict
+from difflib import SequenceMatcher
+
+from django.conf import settings
+from django.db import connection
+
+from .normalization import normalize_search_key
+
+try:
+    import numpy as np
+except ImportError:  # NumPy è opzionale: i candidati si contano con un Counter
+    np = None
+
+
+# Impianti valutati con SequenceMatcher per ogni ricerca (come SKI_RESORT_SEARCH_LIMIT)
+SEARCH_MAX_CANDIDATES = 20
+# Voci delle liste dei trigrammi lette per ogni ricerca (vedi TrigramIndex.rare_postings)
+SEARCH_POSTINGS_BUDGET = 4000
+# Nomi ordinati per ogni candidato prima di tenerne uno per impianto
+CANDIDATE_POOL = 4
+
+
+def trigrams(text):
+    """
+    Restituisce i trigrammi di una stringa: quelli della stringa intera più
+    quelli di ogni parola con uno spazio di padding, così prefissi e suffissi
+    delle parole contano anche quando il resto è scritto male.
+    """
+    grams = {text[i:i + 3] for i in range(len(text) - 2)}
+    for word in text.split():
+        padded = f" {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def score_name(query_lower, query_words, searchable_name, threshold=0):
+    """
+    Punteggio di similarità tra la query e un singolo nome ricercabile.
+    È lo stesso calcolo usato storicamente da SkiResort.fuzzy_search.
+
+    Se il limite superiore di SequenceMatcher (2 * min(len) / somma len) non
+    raggiunge la soglia né supera i bonus, il rapporto non viene calcolato:
+    il punteggio restituito può quindi differire solo quando è comunque
+    sotto soglia, e l'ordinamento dei risultati non cambia.
+    """
+    score = 0
+
+    # Bonus se la query è contenuta nel nome o viceversa
+    if query_lower in searchable_name or searchable_name in query_lower:
+        score = 0.8
+
+    # Bonus per match parziale delle parole
+    name_words = set(searchable_name.split())
+    common_words = query_words & name_words
+    if common_words:
+        word_score = len(common_words) / max(len(query_words), len(name_words))
+        score = max(score, word_score * 0.9)
+
+    # Calcola similarità con SequenceMatcher solo se può cambiare il risultato
+    total_length = len(query_lower) + len(searchable_name)
+    if total_length:
+        upper_bound = 2.0 * min(len(query_lower), len(searchable_name)) / total_length
+    else:
+        upper_bound = 1.0
+    if upper_bound > score and upper_bound >= threshold:
+        score = max(score, SequenceMatcher(None, query_lower, searchable_name).ratio())
+
+    return score
+
+
+class TrigramIndex:
+    """
+    Indice invertito trigramma -> nomi ricercabili.
+
+    Per ogni ricerca conta i trigrammi in comune tra la query e ogni nome che
+    ne condivide almeno uno e valuta il nome più simile dei primi
+    SEARCH_MAX_CANDIDATES impianti (vedi il docstring del modulo).
+    """
+
+    def __init__(self, resorts, version=None, max_candidates=SEARCH_MAX_CANDIDATES):
+        # Versione del catalogo da cui è stato costruito l'indice
+        self.version = version
+        self.max_candidates = max_candidates
+        # Gli impianti sono mantenuti nell'ordine originale (Meta.ordering)
+        # così l'ordinamento stabile per punteggio resta quello di prima.
+        self.resorts = list(resorts)
+        self.names = []  # (posizione impianto, nome ricercabile)
+        by_trigram = defaultdict(list)
+        gram_counts = []
+
+        for position, resort in enumerate(self.resorts):
+            for searchable_name in resort.all_searchable_names:
+                name_id = len(self.names)
+                self.names.append((position, searchable_name))
+                grams = trigrams(searchable_name)
+                gram_counts.append(len(grams))
+                for gram in grams:
+                    by_trigram[gram].append(name_id)
+
+        if np is not None:
+            self.by_trigram = {gram: np.array(ids, dtype=np.int32) for gram, ids in by_trigram.items()}
+            self.gram_counts = np.array(gram_counts, dtype=np.int32)
+            self.name_positions = np.array([position for position, _ in self.names], dtype=np.int32)
+        else:
+            self.by_trigram = dict(by_trigram)
+            self.gram_counts = gram_counts
+
+    def candidates(self, query_lower):
+        """
+        Id dei nomi da valutare, al più uno per impianto: quelli con più
+        trigrammi della query (contenimento), a parità i più simili per indice
+        di Jaccard.
+        """
+        query_grams = trigrams(query_lower)
+        postings = self.rare_postings(query_grams)
+        if not postings:
+            return []
+        if np is not None:
+            name_ids, shared = np.unique(np.concatenate(postings), return_counts=True)
+            similarity = shared + shared / (len(query_grams) + self.gram_counts[name_ids] - shared)
+            # Si ordinano solo i migliori CANDIDATE_POOL nomi per candidato, tutti se
+            # non bastano a coprire max_candidates impianti diversi
+            pool = self.max_candidates * CANDIDATE_POOL
+            while True:
+                if pool < len(name_ids):
+                    top = np.argpartition(-similarity, pool - 1)[:pool]
+                else:
+                    top = np.arange(len(name_ids))
+                ranked = name_ids[top[np.argsort(-similarity[top], kind="stable")]]
+                # Primo nome di ogni impianto nell'ordine per similarità
+                _, first = np.unique(self.name_positions[ranked], return_index=True)
+                if len(first) >= self.max_candidates or len(top) == len(name_ids):
+                    return ranked[np.sort(first)[:self.max_candidates]].tolist()
+                pool = len(name_ids)
+
+        shared = Counter()
+        for name_ids in postings:
+            shared.update(name_ids)
+        similarity = {
+            name_id: count + count / (len(query_grams) + self.gram_counts[name_id] - count)
+            for name_id, count in shared.items()
+        }
+        best = {}
+        for name_id in sorted(similarity, key=similarity.__getitem__, reverse=True):
+            best.setdefault(self.names[name_id][0], name_id)
+            if len(best) == self.max_candidates:
+                break
+        return list(best.values())
+
+    def rare_postings(self, query_grams):
+        """
+        Liste dei trigrammi della query, dai più rari, fino a SEARCH_POSTINGS_BUDGET
+        voci (almeno la prima lista): i trigrammi comuni a migliaia di nomi
+        (" va", "val") costano molto e distinguono poco.
+        """
+        postings = sorted(
+            (self.by_trigram[gram] for gram in query_grams if gram in self.by_trigram), key=len,
+        )
+        budget = SEARCH_POSTINGS_BUDGET
+        for count, name_ids in enumerate(postings):
+            budget -= len(name_ids)
+            if budget < 0:
+                return postings[:max(count, 1)]
+        return postings
+
+    def search(self, query, threshold=0.5, limit=None):
+        """Restituisce gli impianti che superano la soglia, ordinati per punteggio"""
+        # I nomi del catalogo sono già normalizzati (SkiResort.search_name/search_aliases)
+        query_lower = normalize_search_key(query)
+        query_words = set(query_lower.split())
+
+        if threshold <= 0:
+            # Con soglia nulla ogni impianto è un risultato valido
+            name_ids = range(len(self.names))
+        else:
+            name_ids = self.candidates(query_lower)
+
+        best_scores = {}
+        for name_id in name_ids:
+            position, searchable_name = self.names[name_id]
+            score = score_name(query_lower, query_words, searchable_name, threshold)
+            if score > best_scores.get(position, -1):
+                best_scores[position] = score
+
+        results = sorted(
+            (position, score) for position, score in best_scores.items()
+            if score >= threshold
+        )
+        # Ordina per score decrescente (stabile rispetto all'ordine per nome)
+        results.sort(key=lambda x: x[1], reverse=True)
+        if limit is not None:
+            results = results[:limit]
+        # Copie superficiali: le view aggiungono attributi (es. distance_km)
+        # e non devono sporcare le istanze condivise dall'indice.
+        return [copy.copy(self.resorts[position]) for position, _ in results]
+
+
+def search_resorts(query, threshold=0.4, limit=None):
+    """
+    Punto d'ingresso della ricerca impianti usato dalle view.
+
+    Con SKI_RESORT_SEARCH_ENGINE = "postgres" la ricerca avviene nel database
+    con pg_trgm (SkiResort.trigram_search); con qualsiasi altro valore, o se il
+    database non è PostgreSQL (es. SQLite nei test), si usa l'indice in memoria.
+    """
+    from .models import SkiResort
+
+    engine = getattr(settings, "SKI_RESORT_SEARCH_ENGINE", "python")
+    if engine == "postgres" and connection.vendor == "postgresql":
+        return SkiResort.trigram_search(query, threshold=threshold, limit=limit)
+    return SkiResort.fuzzy_search(query, threshold=threshold, limit=limit)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_resort_index():
+    """Restituisce l'indice del processo, ricostruendolo se il catalogo è cambiato"""
+    from .catalog import get_catalog_version
+    from .models import SkiResort
+
+    global _index
+    version = get_catalog_version()
+    index = _index
+    if index is None or index.version != version:
+        with _index_lock:
+            if _index is None or _index.version != version:
+                _index = TrigramIndex(SkiResort.objects.filter(is_active=True), version=version)
+            index = _index
+    return index
+
+
+def invalidate_resort_index():
+    """Scarta l'indice: verrà ricostruito alla prossima ricerca"""
+    global _index
+    with _index_lock:
+        _index = None
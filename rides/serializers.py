@@ -1,6 +1,18 @@
-from rest_framework import serializers
+import inspect
+from datetime import timezone as dt_timezone
+from decimal import Decimal, getcontext as decimal_context
+from operator import attrgetter, methodcaller
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.utils import timezone
+from django.utils.encoding import force_str
+from django.utils.hashable import make_hashable
+from rest_framework import ISO_8601, serializers
+from rest_framework.fields import get_attribute
+from rest_framework.settings import api_settings
 from drf_spectacular.utils import extend_schema_field
-from .models import Destination, RideOffer, SkiResort
+from .models import Destination, RideBooking, RideOffer, RideRating, SkiResort
 
 
 class SkiResortSerializer(serializers.ModelSerializer):
@@ -27,6 +39,21 @@ class AvailableRideSerializer(serializers.Serializer):
     driver_name = serializers.CharField()
 
 
+class SkiResortSuggestionSerializer(serializers.Serializer):
+    """Suggerimento dell'autocompletamento (voce precalcolata del trie)"""
+    id = serializers.CharField()
+    name = serializers.CharField()
+    region = serializers.CharField()
+    region_display = serializers.CharField()
+    km_slopes = serializers.IntegerField(allow_null=True)
+
+
+class SkiResortAutocompleteSerializer(serializers.Serializer):
+    """Risposta dell'autocompletamento impianti"""
+    query = serializers.CharField()
+    results = SkiResortSuggestionSerializer(many=True)
+
+
 class SkiResortSearchResultSerializer(serializers.ModelSerializer):
     """Serializer per i risultati di ricerca con distanza e partenze"""
     region_display = serializers.CharField(source='get_region_display', read_only=True)
@@ -43,16 +70,16 @@ class SkiResortSearchResultSerializer(serializers.ModelSerializer):
     
     @extend_schema_field(AvailableRideSerializer(many=True))
     def get_available_rides(self, obj):
-        """Restituisce le partenze disponibili per questo impianto"""
-        from django.utils import timezone
-        
-        # Prende le partenze future per questa destinazione
-        rides = RideOffer.objects.filter(
-            destination__ski_resort=obj,
-            status=RideOffer.Status.PUBLISHED,
-            departure_time__gte=timezone.now(),
-            seats_available__gt=0
-        ).select_related('driver', 'destination').order_by('departure_time')[:5]
+        """
+        Restituisce le partenze disponibili per questo impianto.
+
+        La view precarica le partenze di tutti gli impianti con una sola query
+        (RideOffer.upcoming_by_resort) e le passa nel context come
+        "available_rides"; senza context si ricade su una query per impianto.
+        """
+        rides_by_resort = self.context.get('available_rides')
+        if rides_by_resort is None:
+            rides_by_resort = RideOffer.upcoming_by_resort([obj.id])
         
         return [{
             'id': str(ride.id),
@@ -63,7 +90,7 @@ class SkiResortSearchResultSerializer(serializers.ModelSerializer):
             'pickup_lat': ride.pickup_lat,
             'pickup_lng': ride.pickup_lng,
             'driver_name': f"{ride.driver.first_name} {ride.driver.last_name}".strip() or ride.driver.username
-        } for ride in rides]
+        } for ride in rides_by_resort.get(obj.id, [])]
 
 
 class DestinationSerializer(serializers.ModelSerializer):
@@ -89,3 +116,249 @@ class RideOfferSerializer(serializers.ModelSerializer):
     @extend_schema_field(serializers.CharField())
     def get_driver_name(self, obj) -> str:
         return f"{obj.driver.first_name} {obj.driver.last_name}".strip() or obj.driver.username
+
+
+class RideBookingSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = RideBooking
+        fields = ["id", "ride", "passenger", "seats_reserved", "status", "created_at"]
+        read_only_fields = fields
+
+
+class RideBookingCreateSerializer(serializers.Serializer):
+    """Richiesta di prenotazione: i posti vengono scalati solo quando l'autista accetta"""
+    seats_reserved = serializers.IntegerField(min_value=1, default=1)
+
+
+class RideRatingSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = RideRating
+        fields = ["id", "booking", "rater", "driver", "score", "comment", "created_at"]
+        read_only_fields = fields
+
+
+class RideRatingCreateSerializer(serializers.Serializer):
+    score = serializers.IntegerField(min_value=1, max_value=5)
+    comment = serializers.CharField(max_length=500, required=False, allow_blank=True, default='')
+
+
+class FastSerializerPlan:
+    """
+    Percorso veloce in sola lettura per un ModelSerializer.
+
+    Alla prima chiamata il serializer viene "compilato" in una lista di passi
+    (chiave, getter, conversione) ricavati dai suoi campi; poi ogni istanza
+    viene trasformata in dict senza passare dalla macchina di DRF (bind dei
+    campi, SkipField, OrderedDict/ReturnDict). L'output è identico a
+    serializer.data: i campi semplici, UUID, date e decimali hanno una
+    conversione equivalente precalcolata, gli altri usano to_representation
+    del campo DRF.
+
+    Quello che non si può compilare resta a DRF: i serializer annidati con
+    many=True, senza modello o con un proprio to_representation usano il
+    campo DRF per quel campo; se è il serializer stesso a non essere
+    compilabile, serialize e serialize_many usano direttamente DRF.
+
+    Le relazioni annidate vanno precaricate con select_related.
+    """
+
+    # Tipi di passo
+    VALUE, DATETIME, NESTED = range(3)
+
+    # Conversioni equivalenti a to_representation per i campi semplici
+    SIMPLE_CONVERSIONS = (
+        (serializers.CharField, str),
+        (serializers.IntegerField, int),
+        (serializers.FloatField, float),
+    )
+
+    def __init__(self, serializer_class):
+        self.serializer_class = serializer_class
+        self._steps = None
+        self._compiled = False
+
+    def get_steps(self):
+        """Passi compilati, None se il serializer va lasciato a DRF"""
+        if not self._compiled:
+            serializer = self.serializer_class()
+            self._steps = self._compile(serializer) if self._compilable(serializer) else None
+            self._compiled = True
+        return self._steps
+
+    def serialize(self, instance):
+        steps = self.get_steps()
+        if steps is None:
+            return self.serializer_class(instance).data
+        return self._apply(steps, instance, self._current_timezone())
+
+    def serialize_many(self, instances):
+        steps = self.get_steps()
+        if steps is None:
+            return self.serializer_class(instances, many=True).data
+        # Il fuso corrente si legge una volta sola, non per ogni data
+        tz = self._current_timezone()
+        return [self._apply(steps, instance, tz) for instance in instances]
+
+    @staticmethod
+    def _current_timezone():
+        return timezone.get_current_timezone() if settings.USE_TZ else None
+
+    def _apply(self, steps, instance, tz):
+        data = {}
+        for key, getter, convert, kind in steps:
+            value = getter(instance)
+            if value is None:
+                data[key] = None
+            elif kind == self.VALUE:
+                data[key] = convert(value)
+            elif kind == self.DATETIME:
+                data[key] = convert(value, tz)
+            else:
+                data[key] = self._apply(convert, value, tz)
+        return data
+
+    def _compile(self, serializer):
+        model = serializer.Meta.model
+        steps = []
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+
+            if isinstance(field, serializers.SerializerMethodField):
+                method = getattr(serializer, field.method_name)
+                steps.append((name, lambda obj: obj, method, self.VALUE))
+                continue
+
+            getter = self._getter(model, field)
+            kind = self.VALUE
+            if isinstance(field, serializers.BaseSerializer) and self._compilable(field):
+                convert = self._compile(field)
+                kind = self.NESTED
+            elif isinstance(field, serializers.BaseSerializer):
+                # many=True, serializer senza modello o con to_representation propria:
+                # lettura e conversione del campo DRF, come in Serializer.to_representation
+                getter = field.get_attribute
+                convert = field.to_representation
+            elif isinstance(field, serializers.RelatedField) and field.use_pk_only_optimization():
+                # Come PKOnlyObject in DRF: si legge direttamente la colonna <campo>_id
+                getter = attrgetter(model._meta.get_field(field.source).attname)
+                convert = self._pk_conversion(field)
+            elif self._is_iso_datetime(field):
+                convert = self._datetime_conversion
+                kind = self.DATETIME
+            else:
+                convert = self._conversion(field)
+            steps.append((name, getter, convert, kind))
+        return steps
+
+    @staticmethod
+    def _compilable(serializer):
+        return (
+            isinstance(serializer, serializers.ModelSerializer)
+            and type(serializer).to_representation is serializers.Serializer.to_representation
+        )
+
+    @staticmethod
+    def _getter(model, field):
+        if field.source == '*':
+            return lambda obj: obj
+        if len(field.source_attrs) == 1:
+            try:
+                model_field = model._meta.get_field(field.source)
+            except FieldDoesNotExist:
+                model_field = None
+            if model_field is not None and model_field.concrete and not model_field.is_relation:
+                return attrgetter(model_field.attname)
+            display_getter = FastSerializerPlan._display_getter(model, field.source)
+            if display_getter is not None:
+                return display_getter
+            # Metodi senza argomenti (es. get_region_display): DRF li chiama
+            # dopo averne ispezionato la firma a ogni accesso, qui una volta sola
+            method = getattr(model, field.source, None)
+            if inspect.isfunction(method) and FastSerializerPlan._takes_no_arguments(method):
+                return methodcaller(field.source)
+        source_attrs = field.source_attrs
+        return lambda obj: get_attribute(obj, source_attrs)
+
+    @staticmethod
+    def _display_getter(model, source):
+        """get_<campo>_display con la tabella delle scelte calcolata una volta sola"""
+        for model_field in model._meta.concrete_fields:
+            if model_field.choices and source == f"get_{model_field.name}_display":
+                choices = dict(make_hashable(model_field.flatchoices))
+                attname = model_field.attname
+
+                def getter(obj):
+                    value = getattr(obj, attname)
+                    return force_str(choices.get(make_hashable(value), value), strings_only=True)
+                return getter
+        return None
+
+    @staticmethod
+    def _takes_no_arguments(method):
+        parameters = list(inspect.signature(method).parameters.values())[1:]
+        return all(
+            param.default is not inspect.Parameter.empty
+            or param.kind in (inspect.Parameter.VAR_POSITIONAL, inspect.Parameter.VAR_KEYWORD)
+            for param in parameters
+        )
+
+    def _conversion(self, field):
+        field_class = type(field)
+        for simple_class, conversion in self.SIMPLE_CONVERSIONS:
+            if field_class is simple_class:
+                return conversion
+        if field_class is serializers.UUIDField and field.uuid_format == 'hex_verbose':
+            return str
+        if field_class is serializers.DecimalField:
+            return self._decimal_conversion(field)
+        return field.to_representation
+
+    @staticmethod
+    def _pk_conversion(field):
+        if field.pk_field is not None:
+            return field.pk_field.to_representation
+        return lambda pk: pk
+
+    @staticmethod
+    def _is_iso_datetime(field):
+        if type(field) is not serializers.DateTimeField or hasattr(field, 'timezone'):
+            return False
+        output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+        return isinstance(output_format, str) and output_format.lower() == ISO_8601
+
+    @staticmethod
+    def _datetime_conversion(value, tz):
+        # Equivalente a DateTimeField.to_representation con formato ISO 8601
+        if isinstance(value, str):
+            return value
+        if tz is not None:
+            value = value.astimezone(tz) if timezone.is_aware(value) else timezone.make_aware(value, tz)
+        elif timezone.is_aware(value):
+            value = timezone.make_naive(value, dt_timezone.utc)
+        value = value.isoformat()
+        if value.endswith('+00:00'):
+            value = value[:-6] + 'Z'
+        return value
+
+    @staticmethod
+    def _decimal_conversion(field):
+        coerce_to_string = getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING)
+        if not coerce_to_string or field.localize or field.normalize_output or field.decimal_places is None:
+            return field.to_representation
+
+        quantum = Decimal('.1') ** field.decimal_places
+        context = decimal_context().copy()
+        if field.max_digits is not None:
+            context.prec = field.max_digits
+        rounding = field.rounding
+
+        def convert(value):
+            if not isinstance(value, Decimal):
+                value = Decimal(str(value).strip())
+            return f'{value.quantize(quantum, rounding=rounding, context=context):f}'
+        return convert
+
+
+ride_offer_plan = FastSerializerPlan(RideOfferSerializer)
+destination_plan = FastSerializerPlan(DestinationSerializer)
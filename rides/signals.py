@@ -0,0 +1,37 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from users.models import Profile
+from .models import Destination, RideBooking, RideOffer, SkiResort
+from .autocomplete import invalidate_resort_trie
+from .catalog import bump_catalog_version
+from .search import invalidate_resort_index
+
+
+@receiver([post_save, post_delete], sender=SkiResort)
+def ski_resort_changed(sender, instance, **kwargs):
+    """Invalida indice di ricerca, trie e versione del catalogo quando un impianto viene modificato o cancellato"""
+    invalidate_resort_index()
+    invalidate_resort_trie()
+    bump_catalog_version()
+
+
+@receiver([post_save, post_delete], sender=Destination)
+def destination_changed(sender, instance, **kwargs):
+    """Aggiorna la versione del catalogo quando una destinazione viene modificata o cancellata"""
+    bump_catalog_version()
+
+
+@receiver(post_save, sender=RideOffer)
+def ride_offer_saved(sender, instance, created, update_fields=None, **kwargs):
+    """Aggiorna rides_as_driver quando la partenza diventa (o smette di essere) completata"""
+    delta = instance.completed_delta(created, update_fields)
+    if delta:
+        Profile.adjust_ride_counter(instance.driver_id, 'rides_as_driver', delta)
+
+
+@receiver(post_save, sender=RideBooking)
+def ride_booking_saved(sender, instance, created, update_fields=None, **kwargs):
+    """Aggiorna rides_as_passenger quando la prenotazione diventa (o smette di essere) completata"""
+    delta = instance.completed_delta(created, update_fields)
+    if delta:
+        Profile.adjust_ride_counter(instance.passenger_id, 'rides_as_passenger', delta)
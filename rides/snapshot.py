@@ -0,0 +1,188 @@
+"""
+Snapshot precompresso del catalogo impianti per SkiResortListView.
+
+Il catalogo cambia poche volte a stagione: il JSON di SkiResortSerializer
+viene generato una volta per versione del catalogo (vedi rides/catalog.py),
+compresso in gzip e in brotli (se installato) o deflate e tenuto in memoria.
+La view serve i byte già pronti nella codifica accettata dal client, senza
+ORM né serializer; quando la versione cambia lo snapshot viene rigenerato
+alla prima richiesta.
+
+Con CATALOG_SNAPSHOT_DIR impostata lo snapshot è anche letto e scritto su
+file, così un nuovo processo non lo rigenera. Se la cartella non è
+scrivibile lo snapshot resta solo in memoria; senza la setting le richieste
+non toccano il disco.
+
+Generazione esplicita (es. dopo il deploy): python manage.py build_catalog_snapshot
+"""
+
+import gzip
+import json
+import logging
+import os
+import tempfile
+import threading
+import zlib
+from pathlib import Path
+
+from django.conf import settings
+from django.http import HttpResponse
+
+try:
+    import brotli
+except ImportError:  # brotli è opzionale: si ricade su deflate (zlib)
+    brotli = None
+
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_NAME = "ski-resorts"
+IDENTITY = "identity"
+# Ordine di preferenza delle codifiche, dalla più compatta
+ENCODING_PREFERENCE = ("br", "gzip", "deflate", IDENTITY)
+FILE_SUFFIXES = {IDENTITY: ".json", "gzip": ".json.gz", "br": ".json.br", "deflate": ".json.zz"}
+
+
+def compress(content):
+    """Restituisce {codifica: byte} per le codifiche disponibili"""
+    encoded = {IDENTITY: content, "gzip": gzip.compress(content, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        encoded["br"] = brotli.compress(content, quality=11)
+    else:
+        encoded["deflate"] = zlib.compress(content, 9)
+    return encoded
+
+
+class CatalogSnapshot:
+    """Catalogo serializzato per una versione, in tutte le codifiche disponibili"""
+
+    __slots__ = ("version", "encoded")
+
+    def __init__(self, version, encoded):
+        self.version = version
+        self.encoded = encoded
+
+    def choose_encoding(self, accept_encoding):
+        """Sceglie la codifica migliore tra quelle accettate (q=0 esclude)"""
+        accepted = {}
+        for item in (accept_encoding or "").split(","):
+            name, _, params = item.strip().partition(";")
+            quality = 1.0
+            params = params.strip()
+            if params.startswith("q="):
+                try:
+                    quality = float(params[2:])
+                except ValueError:
+                    quality = 0.0
+            accepted[name.strip().lower()] = quality
+        for encoding in ENCODING_PREFERENCE[:-1]:
+            if encoding in self.encoded and accepted.get(encoding, accepted.get("*", 0)) > 0:
+                return encoding
+        return IDENTITY
+
+
+def render_catalog():
+    """JSON del catalogo attivo, identico a quello di SkiResortListView"""
+    from rest_framework.renderers import JSONRenderer
+
+    from .models import SkiResort
+    from .serializers import SkiResortSerializer
+
+    resorts = SkiResort.objects.filter(is_active=True).order_by("name")
+    return JSONRenderer().render(SkiResortSerializer(resorts, many=True).data)
+
+
+def build_snapshot(version):
+    return CatalogSnapshot(version, compress(render_catalog()))
+
+
+def snapshot_dir():
+    """Cartella dei file dello snapshot, None se resta solo in memoria"""
+    directory = settings.CATALOG_SNAPSHOT_DIR
+    return Path(directory) if directory else None
+
+
+def _atomic_write(path, content):
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def write_snapshot(snapshot, directory):
+    """Scrive i file dello snapshot; il manifest per ultimo, così un lettore non vede file a metà"""
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    for encoding, content in snapshot.encoded.items():
+        _atomic_write(directory / f"{SNAPSHOT_NAME}{FILE_SUFFIXES[encoding]}", content)
+    manifest = {"version": snapshot.version, "encodings": sorted(snapshot.encoded)}
+    _atomic_write(directory / f"{SNAPSHOT_NAME}.manifest.json", json.dumps(manifest).encode())
+
+
+def read_snapshot(version, directory):
+    """Carica lo snapshot da file se corrisponde alla versione, altrimenti None"""
+    directory = Path(directory)
+    try:
+        manifest = json.loads((directory / f"{SNAPSHOT_NAME}.manifest.json").read_bytes())
+        if manifest["version"] != version:
+            return None
+        encoded = {
+            encoding: (directory / f"{SNAPSHOT_NAME}{FILE_SUFFIXES[encoding]}").read_bytes()
+            for encoding in manifest["encodings"]
+        }
+    except (OSError, ValueError, KeyError):
+        return None
+    return CatalogSnapshot(version, encoded)
+
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def peek_catalog_snapshot(version):
+    """Snapshot in memoria se è della versione indicata, senza I/O né lock"""
+    snapshot = _snapshot
+    if snapshot is not None and snapshot.version == version:
+        return snapshot
+    return None
+
+
+def snapshot_response(snapshot, accept_encoding):
+    """Risposta con il JSON già compresso nella codifica migliore accettata dal client"""
+    encoding = snapshot.choose_encoding(accept_encoding)
+    response = HttpResponse(snapshot.encoded[encoding], content_type="application/json")
+    if encoding != IDENTITY:
+        response["Content-Encoding"] = encoding
+    return response
+
+
+def get_catalog_snapshot(version):
+    """
+    Restituisce lo snapshot in memoria per la versione indicata: se la
+    versione è cambiata lo carica da file o lo rigenera (e riscrive i file,
+    se CATALOG_SNAPSHOT_DIR è impostata).
+    """
+    global _snapshot
+    snapshot = peek_catalog_snapshot(version)
+    if snapshot is not None:
+        return snapshot
+    with _snapshot_lock:
+        if _snapshot is None or _snapshot.version != version:
+            directory = snapshot_dir()
+            snapshot = read_snapshot(version, directory) if directory is not None else None
+            if snapshot is None:
+                snapshot = build_snapshot(version)
+                if directory is not None:
+                    try:
+                        write_snapshot(snapshot, directory)
+                    except OSError:
+                        # Cartella in sola lettura o mancante: lo snapshot resta in memoria
+                        logger.warning(
+                            "Impossibile scrivere lo snapshot del catalogo in %s", directory, exc_info=True,
+                        )
+            _snapshot = snapshot
+        return _snapshot
@@ -1,3 +1,1165 @@
-from django.test import TestCase
+import gzip
+import json
+import random
+import statistics
+import zlib
+from io import StringIO
+from pathlib import Path
+from types import SimpleNamespace
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock, skipIf
+from difflib import SequenceMatcher
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.db.models import Sum
+from django.test import AsyncClient, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from drf_spectacular.generators import SchemaGenerator
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from config.metrics import registry
+
+from .catalog import CATALOG_VERSION_CACHE_KEY, get_catalog_version
+from .management.commands.populate_ski_resorts import SKI_RESORTS_DATA
+from .geo import grid_cell, haversine_distance
+from .models import Destination, RideBooking, RideOffer, RideRating, SkiResort
+from . import geo, search, snapshot
+from .pagination import INVALID_CURSOR_MESSAGE
+from .autocomplete import invalidate_resort_trie
+from .normalization import normalize_search_key
+from .search import get_resort_index, invalidate_resort_index
+from users.models import Profile
+from .serializers import (
+    DestinationSerializer,
+    FastSerializerPlan,
+    RideOfferSerializer,
+    SkiResortSerializer,
+    destination_plan,
+    ride_offer_plan,
+)
+
+User = get_user_model()
+
+
+def baseline_scores(resorts, query):
+    """Punteggi della scansione completa con il calcolo originale di SkiResort.fuzzy_search"""
+    query_lower = query.lower().strip()
+    scores = {}
+    for resort in resorts:
+        best_score = 0
+        for searchable_name in resort.all_searchable_names:
+            score = SequenceMatcher(None, query_lower, searchable_name).ratio()
+            if query_lower in searchable_name or searchable_name in query_lower:
+                score = max(score, 0.8)
+            query_words = set(query_lower.split())
+            name_words = set(searchable_name.split())
+            common_words = query_words & name_words
+            if common_words:
+                word_score = len(common_words) / max(len(query_words), len(name_words))
+                score = max(score, word_score * 0.9)
+            best_score = max(best_score, score)
+        scores[resort.pk] = best_score
+    return scores
+
+
+class ResortSearchIndexTests(TestCase):
+    """L'indice a trigrammi trova i migliori risultati della scansione completa"""
+
+    QUERIES = [
+        "bobio", "piani bobbio", "cervinia", "cervina", "sestriere", "sestrier", "val gardena",
+        "madonna campiglio", "livigno", "bormio", "cortina", "aprica", "monte rosa", "tonale",
+        "val", "ski", "xyz", "courmayer", "plan", "la thuile", "pila",
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        SkiResort.objects.bulk_create([SkiResort(**data) for data in SKI_RESORTS_DATA])
+        # bulk_create non chiama save(): chiavi normalizzate come in populate_ski_resorts
+        for resort in SkiResort.objects.all():
+            resort.save()
+
+    def setUp(self):
+        # Versione e indice sono del processo: non devono sopravvivere al rollback di un altro test
+        cache.delete(CATALOG_VERSION_CACHE_KEY)
+        invalidate_resort_index()
+
+    def assertBestMatches(self, found, scores, threshold):
+        """
+        Risultati sopra soglia ed entro il limite ai candidati, con il miglior
+        punteggio e tutti i nomi che contengono la query (punteggio >= 0.8)
+        """
+        self.assertLessEqual(len(found), search.SEARCH_MAX_CANDIDATES)
+        self.assertTrue(all(scores[resort.pk] >= threshold for resort in found))
+        best = max(scores.values())
+        if best >= threshold:
+            self.assertEqual(scores[found[0].pk], best)
+        strong = {pk for pk, score in scores.items() if score >= 0.8}
+        if len(strong) <= search.SEARCH_MAX_CANDIDATES:
+            self.assertTrue(strong <= {resort.pk for resort in found})
+
+    def test_ranking_matches_baseline_scorer(self):
+        resorts = list(SkiResort.objects.filter(is_active=True))
+        for threshold in (0.4, 0.5):
+            for query in self.QUERIES:
+                with self.subTest(query=query, threshold=threshold):
+                    found = SkiResort.fuzzy_search(query, threshold=threshold)
+                    self.assertBestMatches(found, baseline_scores(resorts, query), threshold)
+
+    def test_ranking_without_numpy(self):
+        resorts = list(SkiResort.objects.filter(is_active=True))
+        with mock.patch.object(search, "np", None):
+            index = search.TrigramIndex(resorts)
+            for query in self.QUERIES:
+                with self.subTest(query=query):
+                    found = index.search(query, threshold=0.4)
+                    self.assertBestMatches(found, baseline_scores(resorts, query), 0.4)
+
+    def test_candidates_are_capped(self):
+        resorts = list(SkiResort.objects.filter(is_active=True))
+        index = search.TrigramIndex(resorts, max_candidates=3)
+        self.assertEqual(len(index.candidates("val")), 3)
+        # I nomi che contengono la query passano per primi
+        self.assertEqual([resort.name for resort in index.search("val gardena", threshold=0.5)][:1], ["Val Gardena"])
+
+    def test_search_latency_on_large_catalog(self):
+        # 10.000 impianti sintetici con 4 nomi ciascuno: mediana sotto il millisecondo
+        rng = random.Random(1)
+        syllables = ["ba", "ce", "di", "fo", "gar", "len", "mon", "na", "pi", "ro", "sel", "ta", "val", "vi", "zer"]
+
+        def name():
+            return " ".join(
+                "".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))) for _ in range(rng.randint(1, 3))
+            )
+
+        resorts = [SimpleNamespace(all_searchable_names=[name() for _ in range(4)]) for _ in range(10000)]
+        index = search.TrigramIndex(resorts)
+        timings = []
+        for query in ("bobio", "cervinia", "val gardena", "monteros", "selvata", "pila"):
+            for _ in range(5):
+                start = time.perf_counter()
+                index.search(query, threshold=0.4)
+                timings.append(time.perf_counter() - start)
+        limit = 0.001 if search.np is not None else 0.005
+        self.assertLess(statistics.median(timings), limit)
+
+    def test_invalid_parameters_return_400(self):
+        client = APIClient()
+        for params in ({"limit": "abc"}, {"threshold": "abc"}, {"threshold": "nan"}, {"threshold": "2"}):
+            with self.subTest(params=params):
+                response = client.get("/api/ski-resorts/search/", {"q": "bobbio", **params})
+                self.assertEqual(response.status_code, 400)
+                self.assertIn("error", response.data)
+        # limit viene limitato a [1, SKI_RESORT_SEARCH_LIMIT]
+        response = client.get("/api/ski-resorts/search/", {"q": "val", "limit": "-5", "threshold": "0"})
+        self.assertEqual(response.data["count"], 1)
+
+    def test_index_follows_catalog_version(self):
+        index = get_resort_index()
+        # Modifica senza segnali, come da un altro processo
+        SkiResort.objects.filter(name__startswith="Livigno").update(
+            is_active=False, updated_at=timezone.now() + timedelta(seconds=1),
+        )
+        cache.delete(CATALOG_VERSION_CACHE_KEY)
+        self.assertIsNot(get_resort_index(), index)
+        self.assertNotIn("Livigno", [resort.name for resort in SkiResort.fuzzy_search("livigno")])
+
+
+class SearchKeyNormalizationTests(TestCase):
+    """Chiavi di ricerca senza accenti né maiuscole, salvate sull'impianto e usate dalle query"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.resort = SkiResort.objects.create(
+            name="Sölden", alternative_names="SOLDEN, Ötztal,  ötztal , Sölden-Ötztal", region=SkiResort.Region.AUSTRIA,
+            lat=46.9667, lng=10.8667, km_slopes=144,
+        )
+        SkiResort.objects.create(name="Val d'Isère", region=SkiResort.Region.FRANCIA, lat=45.45, lng=6.98, km_slopes=300)
+
+    def setUp(self):
+        cache.delete(CATALOG_VERSION_CACHE_KEY)
+        invalidate_resort_index()
+        invalidate_resort_trie()
+        self.client = APIClient()
+
+    def test_normalize_search_key(self):
+        cases = (
+            ("Sölden", "solden"),
+            ("  PIANI di Bobbio - Valsassina ", "piani di bobbio valsassina"),
+            ("Val d'Isère", "val d isere"),
+            ("Straße", "strasse"),
+            ("Crans-Montana", "crans montana"),
+            ("ÀÉÎÕÜ", "aeiou"),
+            ("—", ""),
+        )
+        for text, key in cases:
+            with self.subTest(text=text):
+                self.assertEqual(normalize_search_key(text), key)
+
+    def test_keys_saved_on_resort(self):
+        self.assertEqual(self.resort.search_name, "solden")
+        # Alias uguali al nome o ripetuti (con accenti e maiuscole diverse) non sono duplicati
+        self.assertEqual(self.resort.search_aliases, "otztal\nsolden otztal")
+
+        self.resort.name = "SÖLDEN Giggijoch"
+        self.resort.alternative_names = "Ötztal"
+        self.resort.save(update_fields=["name", "alternative_names"])
+        self.resort.refresh_from_db()
+        self.assertEqual(self.resort.search_name, "solden giggijoch")
+        self.assertEqual(self.resort.search_aliases, "otztal")
+
+    def test_queries_ignore_accents_and_case(self):
+        for query in ("SOLDEN", "sölden", "Ötztal", "OTZTAL"):
+            with self.subTest(query=query):
+                response = self.client.get("/api/ski-resorts/search/", {"q": query, "threshold": "0.5"})
+                self.assertEqual(response.data["results"][0]["name"], "Sölden")
+        for prefix, name in (("SÖL", "Sölden"), ("otz", "Sölden"), ("ISÈ", "Val d'Isère"), ("d'is", "Val d'Isère")):
+            with self.subTest(prefix=prefix):
+                response = self.client.get("/api/ski-resorts/autocomplete/", {"q": prefix})
+                self.assertEqual([r["name"] for r in response.data["results"]], [name])
+
+
+class UpcomingByResortTests(TestCase):
+    """Le partenze di tutti gli impianti trovati arrivano con una sola query"""
+
+    @classmethod
+    def setUpTestData(cls):
+        driver = User.objects.create_user(username="autista@example.com")
+        departure = timezone.now() + timedelta(days=1)
+        for i in range(6):
+            resort = SkiResort.objects.create(name=f"Val Test {i}", region="lombardia", lat=46.0, lng=9.0 + i / 10)
+            destination = Destination.objects.create(name=f"Val Test {i}", lat=46.0, lng=9.0, ski_resort=resort)
+            RideOffer.objects.bulk_create([
+                RideOffer(
+                    driver=driver,
+                    destination=destination,
+                    departure_time=departure + timedelta(hours=hour),
+                    pickup_label="Milano",
+                    pickup_lat=45.46,
+                    pickup_lng=9.19,
+                    price_per_seat=10,
+                )
+                for hour in range(7)
+            ])
+
+    def search(self, query, limit=20):
+        return APIClient().get("/api/ski-resorts/search/", {"q": query, "threshold": "0.5", "limit": limit})
+
+    def test_query_count_does_not_depend_on_resorts(self):
+        # Riscaldamento: versione del catalogo e indice in memoria
+        self.search("val test")
+        with self.assertNumQueries(1):
+            response = self.search("val test", limit=1)
+        self.assertEqual(response.data["count"], 1)
+        with self.assertNumQueries(1):
+            response = self.search("val test")
+        self.assertEqual(response.data["count"], 6)
+        for result in response.data["results"]:
+            self.assertEqual(len(result["available_rides"]), 5)
+
+
+class AsyncSearchParityTests(TestCase):
+    """Gli endpoint /api/async/ rispondono con gli stessi byte e status delle view DRF"""
+
+    @classmethod
+    def setUpTestData(cls):
+        driver = User.objects.create_user(username="autista@example.com")
+        cls.departure = timezone.now().replace(microsecond=0) + timedelta(days=1)
+        for i in range(3):
+            resort = SkiResort.objects.create(name=f"Val Test {i}", region="lombardia", lat=46.0, lng=9.0 + i / 10)
+            destination = Destination.objects.create(name=f"Val Test {i}", lat=46.0, lng=9.0, ski_resort=resort)
+            RideOffer.objects.bulk_create([
+                RideOffer(
+                    driver=driver,
+                    destination=destination,
+                    departure_time=cls.departure + timedelta(hours=hour % 2),
+                    pickup_label=f"Pickup {hour}",
+                    pickup_lat=45.46 + hour * 0.02,
+                    pickup_lng=9.19,
+                    pickup_cell=grid_cell(45.46 + hour * 0.02, 9.19),
+                    price_per_seat=10,
+                )
+                for hour in range(4)
+            ])
+
+    def setUp(self):
+        cache.delete(CATALOG_VERSION_CACHE_KEY)
+        invalidate_resort_index()
+
+    async def assertSameResponse(self, path, params):
+        """Confronta le due risposte e restituisce il JSON della versione async"""
+        sync_response = await sync_to_async(APIClient().get)(f"/api/{path}", params)
+        async_response = await AsyncClient().get(f"/api/async/{path}", params)
+        self.assertEqual(async_response.status_code, sync_response.status_code)
+        self.assertEqual(async_response["Content-Type"], sync_response["Content-Type"])
+        self.assertEqual(async_response.content, sync_response.content)
+        return json.loads(async_response.content)
+
+    async def test_resort_search(self):
+        for params in (
+            {"q": "val test", "threshold": "0.5"},
+            {"q": "val test", "threshold": "0.5", "limit": "2"},
+            {"q": "val test", "lat": "46.0", "lng": "9.0"},
+            {"q": "xyz"},
+        ):
+            with self.subTest(params=params):
+                await self.assertSameResponse("ski-resorts/search/", params)
+
+    async def test_resort_search_errors(self):
+        for params in ({}, {"q": "v"}, {"q": "val", "threshold": "abc"}, {"q": "val", "limit": "abc"}):
+            with self.subTest(params=params):
+                data = await self.assertSameResponse("ski-resorts/search/", params)
+                self.assertIn("error", data)
+
+    async def test_ride_search_pages(self):
+        base = {
+            "start_date": self.departure.date().isoformat(),
+            "end_date": (self.departure + timedelta(days=2)).date().isoformat(),
+            "page_size": 5,
+        }
+        for params in (base, {**base, "lat": "45.46", "lng": "9.19"}, {**base, "lat": "45.46", "lng": "9.19", "max_distance": "5"}):
+            with self.subTest(params=params):
+                ids, cursor = [], None
+                while True:
+                    data = await self.assertSameResponse("rides/search/", {**params, **({"cursor": cursor} if cursor else {})})
+                    ids.extend(ride["id"] for ride in data["results"])
+                    cursor = data["next_cursor"]
+                    if cursor is None:
+                        break
+                self.assertEqual(len(ids), len(set(ids)))
+                self.assertEqual(len(ids), 12 if "max_distance" not in params else 9)
+
+    async def test_ride_search_errors(self):
+        dates = {
+            "start_date": self.departure.date().isoformat(),
+            "end_date": (self.departure + timedelta(days=2)).date().isoformat(),
+        }
+        for params in (
+            {},
+            {"start_date": "ieri", "end_date": "domani"},
+            {**dates, "cursor": "non-un-cursore"},
+        ):
+            with self.subTest(params=params):
+                data = await self.assertSameResponse("rides/search/", params)
+                self.assertTrue({"error", "detail"} & set(data))
+
+
+class RidePaginationTests(TestCase):
+    """Paginazione keyset di lista e ricerca partenze"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.driver = User.objects.create_user(username="autista@example.com")
+        destination = Destination.objects.create(name="Bormio", lat=46.47, lng=10.37)
+        cls.departure = timezone.now().replace(microsecond=0) + timedelta(days=1)
+        # Tre partenze per orario e per punto di pickup: pareggi su entrambe le chiavi
+        cls.rides = RideOffer.objects.bulk_create([
+            RideOffer(
+                driver=cls.driver,
+                destination=destination,
+                departure_time=cls.departure + timedelta(hours=i % 3),
+                pickup_label=f"Pickup {i}",
+                pickup_lat=45.46 + (i // 3) * 0.05,
+                pickup_lng=9.19,
+                pickup_cell=grid_cell(45.46 + (i // 3) * 0.05, 9.19),
+                price_per_seat=10,
+            )
+            for i in range(9)
+        ])
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.driver)
+
+    def walk(self, url, params, cursor_key="next_cursor"):
+        """Segue i cursori fino all'ultima pagina; restituisce gli id nell'ordine ricevuto"""
+        ids, cursor, pages = [], None, 0
+        while True:
+            response = self.client.get(url, {**params, **({"cursor": cursor} if cursor else {})})
+            self.assertEqual(response.status_code, 200)
+            ids.extend(ride["id"] for ride in response.data["results"])
+            pages += 1
+            cursor = response.data[cursor_key]
+            if cursor is None:
+                return ids, pages
+
+    def search_params(self, **params):
+        return {
+            "start_date": self.departure.date().isoformat(),
+            "end_date": (self.departure + timedelta(days=2)).date().isoformat(),
+            "page_size": 2,
+            **params,
+        }
+
+    def test_list_walks_all_pages_in_key_order(self):
+        ids, pages = self.walk("/api/rides/", {"page_size": 2})
+        expected = sorted(self.rides, key=lambda ride: (ride.departure_time, str(ride.id)))
+        self.assertEqual(ids, [str(ride.id) for ride in expected])
+        self.assertEqual(pages, 5)
+
+    def test_search_by_time_walks_ties(self):
+        ids, _ = self.walk("/api/rides/search/", self.search_params())
+        self.assertEqual(len(ids), 9)
+        self.assertEqual(len(set(ids)), 9)
+        times = [RideOffer.objects.get(pk=ride_id).departure_time for ride_id in ids]
+        self.assertEqual(times, sorted(times))
+
+    def test_search_by_distance_walks_ties(self):
+        params = self.search_params(lat=45.46, lng=9.19, max_distance=8)
+        ids, _ = self.walk("/api/rides/search/", params)
+        rides = {str(ride.id): ride for ride in self.rides}
+        # Entro 8 km solo i due punti di pickup più vicini
+        self.assertEqual(len(ids), 6)
+        self.assertEqual(len(set(ids)), 6)
+        keys = [(rides[ride_id].pickup_lat, rides[ride_id].departure_time, ride_id) for ride_id in ids]
+        self.assertEqual(keys, sorted(keys))
+
+        # Una pagina è una sola query con LIMIT, a qualsiasi profondità
+        with self.assertNumQueries(1):
+            response = self.client.get("/api/rides/search/", params)
+        with self.assertNumQueries(1):
+            self.client.get("/api/rides/search/", {**params, "cursor": response.data["next_cursor"]})
+
+    def test_invalid_cursor_returns_400(self):
+        time_cursor = self.client.get("/api/rides/search/", self.search_params()).data["next_cursor"]
+        for url, params in (
+            ("/api/rides/", {"cursor": "non-un-cursore"}),
+            ("/api/rides/search/", self.search_params(cursor="non-un-cursore")),
+            # Cursore della modalità per orario usato nella modalità per distanza
+            ("/api/rides/search/", self.search_params(lat=45.46, lng=9.19, max_distance=8, cursor=time_cursor)),
+        ):
+            with self.subTest(url=url, params=params):
+                response = self.client.get(url, params)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.data["detail"], INVALID_CURSOR_MESSAGE)
+
+
+class RideGridPrefilterTests(TestCase):
+    """Il prefiltro per celle di griglia trova le partenze vicine oltre le prime 50 per orario"""
+
+    @classmethod
+    def setUpTestData(cls):
+        driver = User.objects.create_user(username="autista@example.com")
+        destination = Destination.objects.create(name="Bormio", lat=46.47, lng=10.37)
+        cls.departure = timezone.now().replace(microsecond=0) + timedelta(days=1)
+
+        def ride(minutes, lat, lng):
+            return RideOffer(
+                driver=driver, destination=destination, departure_time=cls.departure + timedelta(minutes=minutes),
+                pickup_label="Pickup", pickup_lat=lat, pickup_lng=lng, pickup_cell=grid_cell(lat, lng),
+                price_per_seat=10,
+            )
+
+        # 60 partenze lontane (Torino) prima delle 8 vicine (Milano)
+        RideOffer.objects.bulk_create([ride(i, 45.07, 7.69) for i in range(60)])
+        cls.near = RideOffer.objects.bulk_create([ride(120 + i, 45.46 + i * 0.01, 9.19) for i in range(8)])
+
+    def test_near_rides_past_old_cutoff_are_found(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.get())
+        response = client.get("/api/rides/search/", {
+            "start_date": self.departure.date().isoformat(),
+            "end_date": (self.departure + timedelta(days=2)).date().isoformat(),
+            "lat": 45.46, "lng": 9.19, "max_distance": 20,
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({ride["id"] for ride in response.data["results"]}, {str(ride.id) for ride in self.near})
+
+
+class HaversineTests(SimpleTestCase):
+    """Il calcolo vettoriale con NumPy coincide con haversine_distance"""
+
+    def setUp(self):
+        rng = random.Random(5)
+        self.origin = (45.46, 9.19)
+        self.lats = [rng.uniform(-89, 89) for _ in range(500)]
+        self.lngs = [rng.uniform(-180, 180) for _ in range(500)]
+        # Due punti duplicati: l'ordinamento a parità di distanza è stabile
+        self.lats += [46.0, 46.0]
+        self.lngs += [10.0, 10.0]
+        self.expected = [haversine_distance(*self.origin, lat, lng) for lat, lng in zip(self.lats, self.lngs)]
+
+    @skipIf(geo.np is None, "NumPy non installato")
+    def test_numpy_matches_scalar(self):
+        distances = geo.haversine_distances(*self.origin, self.lats, self.lngs)
+        for distance, expected in zip(distances.tolist(), self.expected):
+            self.assertAlmostEqual(distance, expected, delta=1e-6)
+        order, _ = geo.argsort_by_distance(*self.origin, self.lats, self.lngs)
+        self.assertEqual(order.tolist(), sorted(range(len(self.expected)), key=self.expected.__getitem__))
+
+    def test_without_numpy(self):
+        with mock.patch.object(geo, "np", None):
+            distances = geo.haversine_distances(*self.origin, self.lats, self.lngs)
+            order, _ = geo.argsort_by_distance(*self.origin, self.lats, self.lngs)
+        self.assertEqual(distances, self.expected)
+        self.assertEqual(order, sorted(range(len(self.expected)), key=self.expected.__getitem__))
+        self.assertLess(order.index(len(self.lats) - 2), order.index(len(self.lats) - 1))
+
+
+class AutocompleteCatalogVersionTests(TestCase):
+    """Il trie segue la versione del catalogo anche per modifiche senza segnali"""
+
+    @classmethod
+    def setUpTestData(cls):
+        SkiResort.objects.create(name="Livigno", region=SkiResort.Region.LOMBARDIA, lat=46.53, lng=10.13, km_slopes=115)
+
+    def setUp(self):
+        cache.delete(CATALOG_VERSION_CACHE_KEY)
+        invalidate_resort_trie()
+        self.client = APIClient()
+
+    def names(self, prefix):
+        response = self.client.get("/api/ski-resorts/autocomplete/", {"q": prefix})
+        return [result["name"] for result in response.data["results"]]
+
+    def test_bulk_changes_show_up_after_version_bump(self):
+        self.assertEqual(self.names("liv"), ["Livigno"])
+        # bulk_create e update() non inviano segnali, come le modifiche di un altro processo
+        SkiResort.objects.bulk_create([SkiResort(
+            name="Livinallongo", search_name="livinallongo", region=SkiResort.Region.VENETO,
+            lat=46.48, lng=11.95, km_slopes=20,
+        )])
+        SkiResort.objects.filter(name="Livigno").update(
+            is_active=False, updated_at=timezone.now() + timedelta(seconds=1),
+        )
+        # Finché la versione in cache non cambia il trie resta quello di prima
+        self.assertEqual(self.names("liv"), ["Livigno"])
+        cache.delete(CATALOG_VERSION_CACHE_KEY)
+        self.assertEqual(self.names("liv"), ["Livinallongo"])
+
+
+class AutocompleteSchemaTests(TestCase):
+    def test_autocomplete_response_is_documented(self):
+        schema = SchemaGenerator().get_schema(request=None, public=True)
+        response = schema["paths"]["/api/ski-resorts/autocomplete/"]["get"]["responses"]["200"]
+        self.assertEqual(
+            response["content"]["application/json"]["schema"]["$ref"],
+            "#/components/schemas/SkiResortAutocomplete",
+        )
+
+
+class CatalogConditionalGetTests(TestCase):
+    """ETag dalla versione del catalogo: 304 finché non cambia, nuovo ETag dopo una modifica"""
+
+    URLS = ("/api/destinations/", "/api/ski-resorts/", "/api/async/ski-resorts/")
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.resort = SkiResort.objects.create(name="Cervinia", region=SkiResort.Region.VALLE_AOSTA, lat=45.93, lng=7.63)
+        Destination.objects.create(name="Cervinia", lat=45.93, lng=7.63, ski_resort=cls.resort)
+
+    def setUp(self):
+        cache.delete(CATALOG_VERSION_CACHE_KEY)
+        snapshot_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(snapshot_dir.cleanup)
+        settings_override = override_settings(CATALOG_SNAPSHOT_DIR=snapshot_dir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.client = APIClient()
+
+    def test_matching_etag_returns_304(self):
+        for url in self.URLS:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                etag = response["ETag"]
+
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response["ETag"], etag)
+                self.assertEqual(response.content, b"")
+
+    def test_resort_edit_changes_etag(self):
+        etags = {url: self.client.get(url)["ETag"] for url in self.URLS}
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.resort.name = "Breuil-Cervinia"
+            self.resort.save()
+
+        for url, etag in etags.items():
+            with self.subTest(url=url):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+                self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(self.client.get("/api/ski-resorts/").json()[0]["name"], "Breuil-Cervinia")
+
+
+class CatalogSnapshotTests(TestCase):
+    """Snapshot precompresso del catalogo: comando, codifiche e cartella non scrivibile"""
+
+    @classmethod
+    def setUpTestData(cls):
+        for i, name in enumerate(("Cervinia", "Sölden", "Bormio")):
+            SkiResort.objects.create(name=name, region=SkiResort.Region.LOMBARDIA, lat=46.0, lng=9.0 + i)
+
+    def setUp(self):
+        cache.delete(CATALOG_VERSION_CACHE_KEY)
+        patcher = mock.patch.object(snapshot, "_snapshot", None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        self.client = APIClient()
+        self.expected = snapshot.render_catalog()
+
+    def test_command_writes_snapshot(self):
+        output = StringIO()
+        call_command("build_catalog_snapshot", output_dir=str(self.directory), stdout=output)
+
+        written = snapshot.read_snapshot(get_catalog_version(), self.directory)
+        self.assertIsNotNone(written)
+        self.assertEqual(written.encoded["identity"], self.expected)
+        self.assertEqual(gzip.decompress(written.encoded["gzip"]), self.expected)
+        self.assertIn(written.version, output.getvalue())
+
+    @override_settings(CATALOG_SNAPSHOT_DIR=None)
+    def test_command_requires_directory(self):
+        with self.assertRaises(CommandError):
+            call_command("build_catalog_snapshot", stdout=StringIO())
+
+    def test_requests_reuse_written_snapshot(self):
+        with override_settings(CATALOG_SNAPSHOT_DIR=str(self.directory)):
+            self.client.get("/api/ski-resorts/")
+            self.assertTrue((self.directory / "ski-resorts.manifest.json").exists())
+            # Un nuovo processo carica i file invece di rigenerare lo snapshot
+            snapshot._snapshot = None
+            with mock.patch.object(snapshot, "render_catalog") as render:
+                self.assertEqual(self.client.get("/api/ski-resorts/").content, self.expected)
+            render.assert_not_called()
+
+    def test_encoding_negotiation(self):
+        decoders = {
+            "gzip": gzip.decompress,
+            "deflate": zlib.decompress,
+            None: lambda content: content,
+        }
+        cases = (
+            ("gzip, deflate", "gzip"),
+            ("deflate", "deflate"),
+            ("gzip;q=0, deflate;q=0.5", "deflate"),
+            ("*", "gzip"),
+            ("identity", None),
+            ("gzip;q=0, deflate;q=0", None),
+            ("", None),
+        )
+        with mock.patch.object(snapshot, "brotli", None):
+            for url in ("/api/ski-resorts/", "/api/async/ski-resorts/"):
+                for accept_encoding, encoding in cases:
+                    with self.subTest(url=url, accept_encoding=accept_encoding):
+                        response = self.client.get(url, HTTP_ACCEPT_ENCODING=accept_encoding)
+                        self.assertEqual(response.status_code, 200)
+                        self.assertEqual(response.get("Content-Encoding"), encoding)
+                        self.assertIn("Accept-Encoding", response["Vary"])
+                        self.assertEqual(decoders[encoding](response.content), self.expected)
+
+    def test_unwritable_directory_serves_from_memory(self):
+        # Un file al posto della cartella: la scrittura fallisce come su un filesystem in sola lettura
+        blocker = self.directory / "blocker"
+        blocker.write_bytes(b"")
+        with override_settings(CATALOG_SNAPSHOT_DIR=str(blocker / "snapshot")):
+            with self.assertLogs("rides.snapshot", "WARNING"):
+                response = self.client.get("/api/ski-resorts/")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.content, self.expected)
+            # Lo snapshot in memoria evita nuovi tentativi di scrittura
+            with self.assertNoLogs("rides.snapshot", "WARNING"):
+                self.client.get("/api/ski-resorts/")
+
+    @override_settings(CATALOG_SNAPSHOT_DIR=None)
+    def test_without_directory_requests_do_not_write(self):
+        with mock.patch.object(snapshot, "write_snapshot") as write:
+            self.assertEqual(self.client.get("/api/ski-resorts/").content, self.expected)
+        write.assert_not_called()
+
+
+class MetricsMiddlewareTests(TestCase):
+    """Le query delle view async (thread di sync_to_async) entrano nelle metriche"""
+
+    @classmethod
+    def setUpTestData(cls):
+        SkiResort.objects.create(name="Cervinia", region=SkiResort.Region.VALLE_AOSTA, lat=45.93, lng=7.63)
+
+    def setUp(self):
+        cache.delete(CATALOG_VERSION_CACHE_KEY)
+        registry.reset()
+
+    def query_count(self, endpoint):
+        prefix = f'skipool_db_queries_per_request_sum{{endpoint="{endpoint}"}} '
+        line = next(line for line in registry.render().splitlines() if line.startswith(prefix))
+        return float(line[len(prefix):])
+
+    async def test_async_view_queries_are_counted(self):
+        response = await AsyncClient().get("/api/async/ski-resorts/")
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(self.query_count("ski-resorts-list-async"), 0)
+
+    def test_sync_view_queries_are_counted(self):
+        self.assertEqual(APIClient().get("/api/ski-resorts/").status_code, 200)
+        self.assertGreater(self.query_count("ski-resorts-list"), 0)
+
+    def test_metrics_endpoint_is_staff_only(self):
+        client = APIClient()
+        self.assertEqual(client.get("/api/metrics/").status_code, 401)
+
+        client.force_authenticate(User.objects.create_user(username="utente@example.com"))
+        self.assertEqual(client.get("/api/metrics/").status_code, 403)
+
+        client.force_authenticate(User.objects.create_user(username="staff@example.com", is_staff=True))
+        response = client.get("/api/metrics/")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("skipool_db_queries_per_request", response.content.decode())
+
+
+class RideOfferIndexTests(TestCase):
+    """Verifica con EXPLAIN che le query della ricerca usino gli indici dedicati"""
+
+    @classmethod
+    def setUpTestData(cls):
+        driver = User.objects.create_user(username="driver@example.com", password="x")
+        resort = SkiResort.objects.create(name="Bormio", region=SkiResort.Region.LOMBARDIA, lat=46.47, lng=10.37)
+        cls.destination = Destination.objects.create(name="Bormio", lat=46.47, lng=10.37, ski_resort=resort)
+        now = timezone.now()
+        RideOffer.objects.bulk_create([
+            RideOffer(
+                driver=driver,
+                destination=cls.destination,
+                departure_time=now + timedelta(hours=i),
+                pickup_label="Milano",
+                pickup_lat=45.46,
+                pickup_lng=9.19,
+                price_per_seat=10,
+                seats_available=i % 4,
+                status=RideOffer.Status.PUBLISHED if i % 3 else RideOffer.Status.CANCELLED,
+            )
+            for i in range(200)
+        ])
+
+    def explain(self, queryset):
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                # Con poche righe il planner preferirebbe un seq scan
+                cursor.execute("SET LOCAL enable_seqscan = off")
+            elif connection.vendor == "sqlite":
+                cursor.execute("ANALYZE")
+        return queryset.explain()
+
+    def test_published_search_uses_partial_index(self):
+        now = timezone.now()
+        queryset = RideOffer.objects.filter(
+            status=RideOffer.Status.PUBLISHED,
+            departure_time__gte=now,
+            departure_time__lt=now + timedelta(days=2),
+            seats_available__gt=0,
+        ).order_by("departure_time")
+
+        self.assertIn("rides_ride_published_dep_idx", self.explain(queryset))
+
+    def test_destination_filter_uses_composite_index(self):
+        now = timezone.now()
+        queryset = RideOffer.objects.filter(
+            destination=self.destination,
+            departure_time__gte=now,
+        ).order_by("departure_time")
+
+        self.assertIn("rides_ride_dest_dep_idx", self.explain(queryset))
+
+
+class FastSerializerPlanTests(TestCase):
+    """Il percorso veloce deve produrre gli stessi byte dei serializer DRF"""
+
+    @classmethod
+    def setUpTestData(cls):
+        drivers = [
+            User.objects.create_user(username="mario@example.com", first_name="Mario", last_name="Rossi"),
+            User.objects.create_user(username="anonimo@example.com"),
+        ]
+        resort = SkiResort.objects.create(
+            name="Sölden", alternative_names="Solden, Ötztal", region=SkiResort.Region.AUSTRIA,
+            province="Tirolo", lat=46.9667, lng=10.8667, altitude_min=1350, km_slopes=144,
+            website="https://www.soelden.com",
+        )
+        destinations = [
+            Destination.objects.create(name="Sölden", subtitle="Tirolo", lat=46.9667, lng=10.8667, ski_resort=resort),
+            Destination.objects.create(name="Rifugio", lat=46, lng=10),
+        ]
+        now = timezone.now().replace(microsecond=123456)
+        for i in range(6):
+            RideOffer.objects.create(
+                driver=drivers[i % 2],
+                destination=destinations[i % 2],
+                departure_time=now + timedelta(hours=i),
+                pickup_label="Milano Centrale",
+                pickup_lat=45.4862,
+                pickup_lng=9 + i,
+                price_per_seat=Decimal("12.5") + i,
+                seats_available=i % 3,
+                status=RideOffer.Status.PUBLISHED if i % 2 else RideOffer.Status.COMPLETED,
+            )
+
+    def render(self, data):
+        return JSONRenderer().render(data)
+
+    def test_ride_offer_plan_matches_serializer(self):
+        rides = list(RideOffer.objects.select_related(
+            "driver", "destination", "destination__ski_resort"
+        ).order_by("departure_time", "id"))
+
+        self.assertEqual(
+            self.render(ride_offer_plan.serialize_many(rides)),
+            self.render(RideOfferSerializer(rides, many=True).data),
+        )
+
+    def test_destination_plan_matches_serializer(self):
+        destinations = list(Destination.objects.select_related("ski_resort").order_by("name"))
+
+        self.assertEqual(
+            self.render(destination_plan.serialize_many(destinations)),
+            self.render(DestinationSerializer(destinations, many=True).data),
+        )
+
+    def test_uncompilable_fields_fall_back_to_drf(self):
+        class ResortWithDestinationsSerializer(SkiResortSerializer):
+            destinations = DestinationSerializer(source="destination_set", many=True, read_only=True)
+
+            class Meta(SkiResortSerializer.Meta):
+                fields = [*SkiResortSerializer.Meta.fields, "destinations"]
+
+        class UpperNameSerializer(DestinationSerializer):
+            def to_representation(self, instance):
+                data = super().to_representation(instance)
+                data["name"] = data["name"].upper()
+                return data
+
+        class RideWithUpperDestinationSerializer(RideOfferSerializer):
+            destination = UpperNameSerializer(read_only=True)
+
+        resorts = list(SkiResort.objects.prefetch_related("destination_set"))
+        rides = list(RideOffer.objects.select_related(
+            "driver", "destination", "destination__ski_resort"
+        ).order_by("departure_time", "id"))
+        destinations = list(Destination.objects.select_related("ski_resort").order_by("name"))
+        cases = (
+            (ResortWithDestinationsSerializer, resorts),
+            (RideWithUpperDestinationSerializer, rides),
+            (UpperNameSerializer, destinations),
+        )
+        for serializer_class, instances in cases:
+            with self.subTest(serializer=serializer_class.__name__):
+                plan = FastSerializerPlan(serializer_class)
+                self.assertEqual(
+                    self.render(plan.serialize_many(instances)),
+                    self.render(serializer_class(instances, many=True).data),
+                )
+                self.assertEqual(plan.serialize(instances[0]), serializer_class(instances[0]).data)
+        # Solo il serializer con to_representation propria resta interamente a DRF
+        self.assertIsNotNone(FastSerializerPlan(RideWithUpperDestinationSerializer).get_steps())
+        self.assertIsNone(FastSerializerPlan(UpperNameSerializer).get_steps())
+
+    def test_ride_list_view_matches_serializer(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.get(username="mario@example.com"))
+        rides = RideOffer.objects.order_by("departure_time", "id")
+
+        response = client.get("/api/rides/")
+
+        self.assertEqual(
+            self.render(response.json()["results"]),
+            self.render(RideOfferSerializer(rides, many=True).data),
+        )
+
+
+class BookingFlowTests(TestCase):
+    """Richiesta, accettazione e annullamento di una prenotazione"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.driver = User.objects.create_user(username="autista@example.com")
+        cls.passenger = User.objects.create_user(username="passeggero@example.com")
+        destination = Destination.objects.create(name="Cervinia", lat=45.93, lng=7.63)
+        cls.ride = RideOffer.objects.create(
+            driver=cls.driver, destination=destination, departure_time=timezone.now() + timedelta(days=3),
+            pickup_label="Torino", pickup_lat=45.07, pickup_lng=7.69, price_per_seat=15,
+            seats_total=3, seats_available=3,
+        )
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def book(self, seats=1):
+        return self.client_for(self.passenger).post(
+            f"/api/rides/{self.ride.pk}/bookings/", {"seats_reserved": seats}, format="json",
+        )
+
+    def booking(self, status, seats=1):
+        return RideBooking.objects.create(ride=self.ride, passenger=self.passenger, seats_reserved=seats, status=status)
+
+    def seats_available(self):
+        self.ride.refresh_from_db()
+        return self.ride.seats_available
+
+    def test_create_booking(self):
+        response = self.book(seats=2)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["booking"]["status"], RideBooking.Status.REQUESTED)
+        self.assertEqual(response.data["booking"]["seats_reserved"], 2)
+        # I posti si scalano solo all'accettazione
+        self.assertEqual(self.seats_available(), 3)
+
+    def test_reopen_cancelled_or_rejected_booking(self):
+        for status in (RideBooking.Status.CANCELLED, RideBooking.Status.REJECTED):
+            with self.subTest(status=status):
+                booking = self.booking(status)
+                response = self.book(seats=2)
+                self.assertEqual(response.status_code, 201)
+                booking.refresh_from_db()
+                self.assertEqual(booking.status, RideBooking.Status.REQUESTED)
+                self.assertEqual(booking.seats_reserved, 2)
+                booking.delete()
+
+    def test_duplicate_booking_returns_409(self):
+        self.assertEqual(self.book().status_code, 201)
+        self.assertEqual(self.book().status_code, 409)
+        self.assertEqual(RideBooking.objects.filter(ride=self.ride).count(), 1)
+
+    def test_only_driver_can_accept(self):
+        booking = self.booking(RideBooking.Status.REQUESTED)
+        response = self.client_for(self.passenger).post(f"/api/bookings/{booking.pk}/accept/")
+        self.assertEqual(response.status_code, 403)
+        booking.refresh_from_db()
+        self.assertEqual(booking.status, RideBooking.Status.REQUESTED)
+
+    def test_accept_without_enough_seats_returns_409(self):
+        booking = self.booking(RideBooking.Status.REQUESTED, seats=2)
+        RideOffer.objects.filter(pk=self.ride.pk).update(seats_available=1)
+        response = self.client_for(self.driver).post(f"/api/bookings/{booking.pk}/accept/")
+        self.assertEqual(response.status_code, 409)
+        # Transizione annullata insieme ai posti
+        booking.refresh_from_db()
+        self.assertEqual(booking.status, RideBooking.Status.REQUESTED)
+        self.assertEqual(self.seats_available(), 1)
+
+    def test_cancel_accepted_booking_releases_seats(self):
+        booking = self.booking(RideBooking.Status.REQUESTED, seats=2)
+        self.assertEqual(self.client_for(self.driver).post(f"/api/bookings/{booking.pk}/accept/").status_code, 200)
+        self.assertEqual(self.seats_available(), 1)
+        response = self.client_for(self.passenger).post(f"/api/bookings/{booking.pk}/cancel/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["booking"]["status"], RideBooking.Status.CANCELLED)
+        self.assertEqual(self.seats_available(), 3)
+
+    def test_cancel_returns_409_when_seats_cannot_be_released(self):
+        # Contatore già al massimo: restituire i posti supererebbe seats_total
+        booking = self.booking(RideBooking.Status.ACCEPTED, seats=2)
+        response = self.client_for(self.passenger).post(f"/api/bookings/{booking.pk}/cancel/")
+        self.assertEqual(response.status_code, 409)
+        booking.refresh_from_db()
+        self.assertEqual(booking.status, RideBooking.Status.ACCEPTED)
+        self.assertEqual(self.seats_available(), 3)
+
+
+class BookingConcurrencyTests(TransactionTestCase):
+    """Molti thread accettano e annullano prenotazioni sulla stessa partenza"""
+
+    SEATS = 5
+    PASSENGERS = 40
+    WORKERS = 16
+
+    def setUp(self):
+        self.driver = User.objects.create_user(username="autista@example.com")
+        destination = Destination.objects.create(name="Cervinia", lat=45.93, lng=7.63)
+        self.ride = RideOffer.objects.create(
+            driver=self.driver,
+            destination=destination,
+            departure_time=timezone.now() + timedelta(days=3),
+            pickup_label="Torino",
+            pickup_lat=45.07,
+            pickup_lng=7.69,
+            price_per_seat=15,
+            seats_total=self.SEATS,
+            seats_available=self.SEATS,
+        )
+        self.bookings = [
+            RideBooking.objects.create(
+                ride=self.ride,
+                passenger=User.objects.create_user(username=f"passeggero{i}@example.com"),
+                seats_reserved=1 + i % 2,
+            )
+            for i in range(self.PASSENGERS)
+        ]
+
+    def run_concurrently(self, calls):
+        barrier = threading.Barrier(min(self.WORKERS, len(calls)))
+
+        def run(call):
+            try:
+                try:
+                    barrier.wait(timeout=5)
+                except threading.BrokenBarrierError:
+                    pass
+                return call()
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(max_workers=self.WORKERS) as executor:
+            return list(executor.map(run, calls))
+
+    def post_as(self, user, url):
+        def call():
+            client = APIClient()
+            client.force_authenticate(user)
+            return client.post(url).status_code
+        return call
+
+    def assert_invariants(self):
+        self.ride.refresh_from_db()
+        accepted_seats = RideBooking.objects.filter(
+            ride=self.ride, status=RideBooking.Status.ACCEPTED,
+        ).aggregate(total=Sum("seats_reserved"))["total"] or 0
+        self.assertGreaterEqual(self.ride.seats_available, 0)
+        self.assertEqual(self.ride.seats_available + accepted_seats, self.SEATS)
+
+    def test_concurrent_accept_and_cancel_never_oversell(self):
+        if connection.vendor == "sqlite" and connection.is_in_memory_db():
+            self.skipTest("SQLite in memoria non regge scritture concorrenti da più thread: impostare DB_TEST_NAME")
+
+        statuses = self.run_concurrently([
+            self.post_as(self.driver, f"/api/bookings/{booking.pk}/accept/")
+            for booking in self.bookings
+        ])
+        self.assertEqual(set(statuses) - {200, 409}, set())
+        self.assert_invariants()
+
+        # Annullamenti dei passeggeri accettati in parallelo a nuove accettazioni
+        accepted = list(RideBooking.objects.filter(ride=self.ride, status=RideBooking.Status.ACCEPTED))
+        pending = list(RideBooking.objects.filter(ride=self.ride, status=RideBooking.Status.REQUESTED))
+        calls = [self.post_as(booking.passenger, f"/api/bookings/{booking.pk}/cancel/") for booking in accepted]
+        calls += [self.post_as(self.driver, f"/api/bookings/{booking.pk}/accept/") for booking in pending]
+        statuses += self.run_concurrently(calls)
+
+        self.assertEqual(set(statuses) - {200, 409}, set())
+        self.assert_invariants()
+
+
+class RideRatingTests(TestCase):
+    """La media dell'autista si aggiorna a ogni valutazione, senza ricalcoli in lettura"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.driver = User.objects.create_user(username="autista@example.com")
+        destination = Destination.objects.create(name="Cervinia", lat=45.93, lng=7.63)
+        ride = RideOffer.objects.create(
+            driver=cls.driver,
+            destination=destination,
+            departure_time=timezone.now() - timedelta(days=1),
+            pickup_label="Torino",
+            pickup_lat=45.07,
+            pickup_lng=7.69,
+            price_per_seat=15,
+        )
+        cls.bookings = [
+            RideBooking.objects.create(
+                ride=ride,
+                passenger=User.objects.create_user(username=f"passeggero{i}@example.com"),
+                status=RideBooking.Status.ACCEPTED,
+            )
+            for i in range(3)
+        ]
+
+    def rate(self, booking, score):
+        client = APIClient()
+        client.force_authenticate(booking.passenger)
+        return client.post(f"/api/bookings/{booking.pk}/rating/", {"score": score}, format="json")
+
+    def test_ratings_update_driver_aggregates(self):
+        for booking, score in zip(self.bookings, [5, 4, 2]):
+            self.assertEqual(self.rate(booking, score).status_code, 201)
+
+        profile = Profile.objects.get(user=self.driver)
+        self.assertEqual(profile.rating_count, 3)
+        self.assertAlmostEqual(profile.rating_avg, 11 / 3)
+        # Una sola valutazione per prenotazione
+        self.assertEqual(self.rate(self.bookings[0], 1).status_code, 409)
+        self.assertEqual(Profile.objects.get(user=self.driver).rating_count, 3)
+
+    def test_recompute_repairs_drift(self):
+        for booking, score in zip(self.bookings, [5, 4, 2]):
+            self.rate(booking, score)
+        RideRating.objects.filter(booking=self.bookings[2]).delete()
+        # Aggregato corrotto su un profilo senza valutazioni
+        Profile.objects.filter(user=self.bookings[0].passenger).update(rating_avg=3, rating_count=1)
+
+        call_command("recompute_ratings", chunk_size=2, stdout=StringIO())
+
+        profiles = {profile.user_id: profile for profile in Profile.objects.all()}
+        self.assertEqual(profiles[self.driver.pk].rating_count, 2)
+        self.assertAlmostEqual(profiles[self.driver.pk].rating_avg, 4.5)
+        self.assertEqual(profiles[self.bookings[0].passenger_id].rating_count, 0)
+        self.assertEqual(profiles[self.bookings[0].passenger_id].rating_avg, 0)
+
+
+class RideCounterTests(TestCase):
+    """Contatori corse del profilo aggiornati ai passaggi a COMPLETED e riallineati dal comando"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.driver = User.objects.create_user(username="autista@example.com")
+        cls.passenger = User.objects.create_user(username="passeggero@example.com")
+        cls.destination = Destination.objects.create(name="Cervinia", lat=45.93, lng=7.63)
+
+    def create_ride(self):
+        return RideOffer.objects.create(
+            driver=self.driver,
+            destination=self.destination,
+            departure_time=timezone.now() - timedelta(days=1),
+            pickup_label="Torino",
+            pickup_lat=45.07,
+            pickup_lng=7.69,
+            price_per_seat=15,
+        )
+
+    def counters(self, user):
+        profile = Profile.objects.get(user=user)
+        return profile.rides_as_driver, profile.rides_as_passenger
+
+    def test_transitions_update_counters(self):
+        ride = self.create_ride()
+        booking = RideBooking.objects.create(ride=ride, passenger=self.passenger, status=RideBooking.Status.ACCEPTED)
+
+        ride.status = RideOffer.Status.COMPLETED
+        ride.save()
+        ride.save()  # Nessuna nuova transizione
+        booking = RideBooking.objects.get(pk=booking.pk)
+        booking.status = RideBooking.Status.COMPLETED
+        booking.save(update_fields=["status"])
+
+        self.assertEqual(self.counters(self.driver), (1, 0))
+        self.assertEqual(self.counters(self.passenger), (0, 1))
+
+        ride = RideOffer.objects.get(pk=ride.pk)
+        ride.status = RideOffer.Status.CANCELLED
+        ride.save()
+        self.assertEqual(self.counters(self.driver), (0, 0))
+
+    def test_reconcile_fixes_drift(self):
+        rides = [self.create_ride() for _ in range(3)]
+        # queryset.update non invia segnali: i contatori restano indietro
+        RideOffer.objects.filter(pk__in=[ride.pk for ride in rides]).update(status=RideOffer.Status.COMPLETED)
+        RideBooking.objects.create(ride=rides[0], passenger=self.passenger, status=RideBooking.Status.COMPLETED)
+        Profile.objects.filter(user=self.passenger).update(rides_as_driver=4, rides_as_passenger=3)
+
+        call_command("reconcile_ride_counters", chunk_size=1, stdout=StringIO())
+
+        self.assertEqual(self.counters(self.driver), (3, 0))
+        self.assertEqual(self.counters(self.passenger), (0, 1))
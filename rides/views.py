@@ -1,54 +1,108 @@
-from math import radians, sin, cos, sqrt, atan2
-from datetime import datetime, timedelta
-
+from django.db import IntegrityError, transaction
 from django.shortcuts import render
 from django.utils import timezone
+from django.utils.cache import patch_vary_headers
 from rest_framework import generics, permissions, status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from drf_spectacular.utils import extend_schema, OpenApiParameter
+from users.models import Profile
 
-from .models import Destination, RideOffer, SkiResort
+from .autocomplete import AUTOCOMPLETE_MAX_RESULTS, get_resort_trie
+from .catalog import catalog_etag, etag_matches, get_catalog_version, patch_catalog_headers
+from .models import Destination, RideBooking, RideOffer, RideRating, SkiResort
+from .normalization import normalize_search_key
+from .pagination import RideKeysetPagination
+from .queries import ResortSearch, RideSearch, SearchParamError
+from .snapshot import get_catalog_snapshot, snapshot_response
 from .serializers import (
     DestinationSerializer, 
+    RideBookingCreateSerializer,
+    RideBookingSerializer,
     RideOfferSerializer, 
+    RideRatingCreateSerializer,
+    RideRatingSerializer,
+    SkiResortAutocompleteSerializer,
     SkiResortSerializer,
-    SkiResortSearchResultSerializer
+    SkiResortSearchResultSerializer,
+    destination_plan,
+    ride_offer_plan,
 )
 
 
-def haversine_distance(lat1, lng1, lat2, lng2):
-    """Calcola la distanza in km tra due punti usando la formula di Haversine"""
-    R = 6371  # Raggio della Terra in km
-    
-    lat1_rad = radians(lat1)
-    lat2_rad = radians(lat2)
-    delta_lat = radians(lat2 - lat1)
-    delta_lng = radians(lng2 - lng1)
-    
-    a = sin(delta_lat / 2) ** 2 + cos(lat1_rad) * cos(lat2_rad) * sin(delta_lng / 2) ** 2
-    c = 2 * atan2(sqrt(a), sqrt(1 - a))
-    
-    return R * c
+class CatalogConditionalGetMixin:
+    """
+    GET condizionale per gli endpoint del catalogo: ETag forte dalla versione
+    del catalogo e 304 su If-None-Match senza eseguire la query principale.
+    """
+    catalog_name = None
+
+    def get_catalog_variant(self, request):
+        # Il formato negoziato fa parte dell'ETag: JSON e API navigabile hanno corpi diversi
+        return request.accepted_renderer.format
+
+    def get(self, request, *args, **kwargs):
+        self.catalog_version = get_catalog_version()
+        etag = catalog_etag(self.catalog_name, self.catalog_version, self.get_catalog_variant(request))
+        if etag_matches(request.headers.get("If-None-Match"), etag):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = super().get(request, *args, **kwargs)
+        patch_catalog_headers(response, etag)
+        return response
 
 
-class DestinationListView(generics.ListAPIView):
+class DestinationListView(CatalogConditionalGetMixin, generics.ListAPIView):
     permission_classes = [permissions.AllowAny]
-    queryset = Destination.objects.all().order_by("name")
+    queryset = Destination.objects.select_related("ski_resort").order_by("name")
     serializer_class = DestinationSerializer
+    catalog_name = "destinations"
+
+    def list(self, request, *args, **kwargs):
+        # Percorso veloce: stesso JSON di DestinationSerializer senza la macchina DRF
+        return Response(destination_plan.serialize_many(self.get_queryset()))
 
 
 class RideOfferListView(generics.ListAPIView):
     permission_classes = [permissions.IsAuthenticated]
-    queryset = RideOffer.objects.all().order_by("departure_time")
+    queryset = RideOffer.objects.select_related(
+        "driver", "destination", "destination__ski_resort"
+    ).order_by("departure_time", "id")
     serializer_class = RideOfferSerializer
+    pagination_class = RideKeysetPagination
+
+    def list(self, request, *args, **kwargs):
+        # Percorso veloce: stesso JSON di RideOfferSerializer senza la macchina DRF
+        page = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+        return self.get_paginated_response(ride_offer_plan.serialize_many(page))
 
 
-class SkiResortListView(generics.ListAPIView):
+class SkiResortListView(CatalogConditionalGetMixin, generics.ListAPIView):
     """Lista tutti gli impianti sciistici attivi"""
     permission_classes = [permissions.AllowAny]
     queryset = SkiResort.objects.filter(is_active=True).order_by("name")
     serializer_class = SkiResortSerializer
+    catalog_name = "ski-resorts"
+
+    def get_catalog_variant(self, request):
+        variant = super().get_catalog_variant(request)
+        if variant == "json":
+            # Ogni codifica è una rappresentazione diversa: serve un ETag distinto
+            snapshot = get_catalog_snapshot(self.catalog_version)
+            variant = f"{variant}-{snapshot.choose_encoding(request.headers.get('Accept-Encoding'))}"
+        return variant
+
+    def get(self, request, *args, **kwargs):
+        response = super().get(request, *args, **kwargs)
+        patch_vary_headers(response, ["Accept-Encoding"])
+        return response
+
+    def list(self, request, *args, **kwargs):
+        if request.accepted_renderer.format != "json":
+            return super().list(request, *args, **kwargs)
+        # JSON già serializzato e compresso: nessuna query né serializer
+        snapshot = get_catalog_snapshot(self.catalog_version)
+        return snapshot_response(snapshot, request.headers.get("Accept-Encoding"))
 
 
 @extend_schema(
@@ -57,6 +111,7 @@ class SkiResortListView(generics.ListAPIView):
         OpenApiParameter(name='lat', description='Latitudine utente per calcolare distanza', required=False, type=float),
         OpenApiParameter(name='lng', description='Longitudine utente per calcolare distanza', required=False, type=float),
         OpenApiParameter(name='threshold', description='Soglia di similarità (0-1, default 0.4)', required=False, type=float),
+        OpenApiParameter(name='limit', description='Numero massimo di risultati (default SKI_RESORT_SEARCH_LIMIT)', required=False, type=int),
     ],
     responses={200: SkiResortSearchResultSerializer(many=True)},
     description='Ricerca fuzzy degli impianti sciistici. Trova le piste anche con errori di ortografia.'
@@ -72,52 +127,55 @@ def search_ski_resorts(request):
     - lat: latitudine utente (per calcolare distanza)
     - lng: longitudine utente (per calcolare distanza)
     - threshold: soglia di similarità (default 0.4, range 0-1)
+    - limit: numero massimo di risultati (default SKI_RESORT_SEARCH_LIMIT)
     
     Restituisce gli impianti trovati con:
     - distanza dall'utente (se lat/lng forniti)
     - partenze disponibili nelle vicinanze
     """
-    query = request.query_params.get('q', '').strip()
-    
-    if not query or len(query) < 2:
-        return Response(
-            {"error": "Il parametro 'q' deve contenere almeno 2 caratteri"},
-            status=status.HTTP_400_BAD_REQUEST
-        )
-    
-    # Parametri opzionali per la posizione utente
-    user_lat = request.query_params.get('lat')
-    user_lng = request.query_params.get('lng')
-    threshold = float(request.query_params.get('threshold', 0.4))
-    
-    # Esegui ricerca fuzzy
-    resorts = SkiResort.fuzzy_search(query, threshold=threshold)
+    try:
+        search = ResortSearch(request.query_params)
+    except SearchParamError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    resorts = search.match()
+    # Partenze di tutti gli impianti trovati in una sola query
+    available_rides = RideOffer.upcoming_by_resort([resort.id for resort in resorts])
+    return Response(search.payload(resorts, available_rides))
+
+
+@extend_schema(
+    parameters=[
+        OpenApiParameter(name='q', description='Prefisso digitato (es: "bor" trova "Bormio")', required=True, type=str),
+        OpenApiParameter(name='limit', description=f'Numero massimo di suggerimenti (default e max {AUTOCOMPLETE_MAX_RESULTS})', required=False, type=int),
+    ],
+    responses={200: SkiResortAutocompleteSerializer},
+    description='Autocompletamento degli impianti per prefisso, ordinato per popolarità (km di piste).'
+)
+@api_view(['GET'])
+@permission_classes([permissions.AllowAny])
+def autocomplete_ski_resorts(request):
+    """
+    Suggerimenti per la typeahead degli impianti.
     
-    # Se l'utente ha fornito la posizione, calcola la distanza
-    if user_lat and user_lng:
-        try:
-            user_lat = float(user_lat)
-            user_lng = float(user_lng)
-            
-            # Aggiungi distanza a ogni resort
-            resorts_with_distance = []
-            for resort in resorts:
-                distance = haversine_distance(user_lat, user_lng, resort.lat, resort.lng)
-                resort.distance_km = round(distance, 1)
-                resorts_with_distance.append(resort)
-            
-            # Ordina per distanza
-            resorts = sorted(resorts_with_distance, key=lambda r: r.distance_km)
-        except (ValueError, TypeError):
-            pass  # Ignora errori di conversione, non calcolare distanza
+    Usa un trie precalcolato in memoria (vedi rides/autocomplete.py): non
+    interroga il database e non calcola punteggi fuzzy. Il prefisso viene
+    confrontato senza accenti e senza maiuscole con l'inizio di qualsiasi
+    parola del nome o dei nomi alternativi.
+    """
+    prefix = normalize_search_key(request.query_params.get('q', ''))
+    try:
+        limit = int(request.query_params.get('limit', AUTOCOMPLETE_MAX_RESULTS))
+    except ValueError:
+        limit = AUTOCOMPLETE_MAX_RESULTS
     
-    serializer = SkiResortSearchResultSerializer(resorts, many=True)
+    if not prefix:
+        return Response({"query": prefix, "results": []})
     
-    return Response({
-        "query": query,
-        "count": len(resorts),
-        "results": serializer.data
-    })
+    results = get_resort_trie().lookup(prefix)
+    if limit < len(results):
+        results = results[:max(limit, 1)]
+    return Response({"query": prefix, "results": results})
 
 
 @extend_schema(
@@ -128,6 +186,8 @@ def search_ski_resorts(request):
         OpenApiParameter(name='lng', description='Longitudine utente per calcolare distanza pickup', required=False, type=float),
         OpenApiParameter(name='ski_resort_id', description='ID impianto sciistico per filtrare', required=False, type=str),
         OpenApiParameter(name='max_distance', description='Distanza massima pickup in km', required=False, type=float),
+        OpenApiParameter(name='cursor', description='Cursore opaco restituito come next_cursor dalla pagina precedente', required=False, type=str),
+        OpenApiParameter(name='page_size', description='Risultati per pagina (default 50, max 100)', required=False, type=int),
     ],
     responses={200: RideOfferSerializer(many=True)},
     description='Cerca partenze disponibili in un range di date'
@@ -144,107 +204,173 @@ def search_rides_by_date_range(request):
     - lat, lng: posizione utente (opzionale)
     - ski_resort_id: filtra per impianto (opzionale)
     - max_distance: distanza massima dal pickup in km (opzionale)
-    """
-    start_date_str = request.query_params.get('start_date')
-    end_date_str = request.query_params.get('end_date')
-    
-    if not start_date_str or not end_date_str:
-        return Response(
-            {"error": "Parametri 'start_date' e 'end_date' sono obbligatori"},
-            status=status.HTTP_400_BAD_REQUEST
-        )
+    - cursor: cursore della pagina successiva (opzionale, vedi next_cursor)
+    - page_size: risultati per pagina (default 50, max 100)
     
+    Con lat, lng e max_distance le partenze sono ordinate per distanza pickup
+    su tutto il raggio; altrimenti per orario, e con la sola posizione ogni
+    pagina viene riordinata per distanza (vedi rides/queries.py).
+    """
     try:
-        start_date = datetime.fromisoformat(start_date_str.replace('Z', '+00:00'))
-        end_date = datetime.fromisoformat(end_date_str.replace('Z', '+00:00'))
-        
-        # Se sono date senza timezone, aggiungi il timezone corrente
-        if start_date.tzinfo is None:
-            start_date = timezone.make_aware(start_date)
-        if end_date.tzinfo is None:
-            end_date = timezone.make_aware(end_date)
-    except ValueError:
-        return Response(
-            {"error": "Formato data non valido. Usa ISO 8601 (es: 2026-01-22)"},
-            status=status.HTTP_400_BAD_REQUEST
-        )
-    
-    # Query base: partenze nel range di date
-    rides = RideOffer.objects.filter(
-        status=RideOffer.Status.PUBLISHED,
-        departure_time__gte=start_date,
-        departure_time__lt=end_date,
-        seats_available__gt=0
-    ).select_related('driver', 'destination', 'destination__ski_resort').order_by('departure_time')
-    
-    # Filtro opzionale per impianto sciistico
-    ski_resort_id = request.query_params.get('ski_resort_id')
-    if ski_resort_id:
-        rides = rides.filter(destination__ski_resort_id=ski_resort_id)
-    
-    # Parametri posizione utente
-    user_lat = request.query_params.get('lat')
-    user_lng = request.query_params.get('lng')
-    max_distance = request.query_params.get('max_distance')
-    
-    rides_list = list(rides[:50])  # Limita a 50 risultati
-    
-    # Se l'utente ha fornito la posizione, calcola la distanza dal pickup
-    if user_lat and user_lng:
-        try:
-            user_lat = float(user_lat)
-            user_lng = float(user_lng)
-            max_dist = float(max_distance) if max_distance else None
-            
-            rides_with_distance = []
-            for ride in rides_list:
-                distance = haversine_distance(user_lat, user_lng, ride.pickup_lat, ride.pickup_lng)
-                ride.pickup_distance_km = round(distance, 1)
-                
-                # Filtra per distanza massima se specificata
-                if max_dist is None or distance <= max_dist:
-                    rides_with_distance.append(ride)
-            
-            # Ordina per distanza pickup
-            rides_list = sorted(rides_with_distance, key=lambda r: r.pickup_distance_km)
-        except (ValueError, TypeError):
-            pass
-    
-    # Prepara la risposta
-    results = []
-    for ride in rides_list:
-        ride_data = {
-            'id': str(ride.id),
-            'departure_time': ride.departure_time.isoformat(),
-            'price_per_seat': float(ride.price_per_seat),
-            'seats_available': ride.seats_available,
-            'pickup_label': ride.pickup_label,
-            'pickup_lat': ride.pickup_lat,
-            'pickup_lng': ride.pickup_lng,
-            'driver_name': f"{ride.driver.first_name} {ride.driver.last_name}".strip() or ride.driver.username,
-            'destination': {
-                'id': str(ride.destination.id),
-                'name': ride.destination.name,
-            }
-        }
-        
-        # Aggiungi info ski resort se presente
-        if ride.destination.ski_resort:
-            ride_data['ski_resort'] = {
-                'id': str(ride.destination.ski_resort.id),
-                'name': ride.destination.ski_resort.name,
-                'region': ride.destination.ski_resort.get_region_display(),
-            }
-        
-        # Aggiungi distanza pickup se calcolata
-        if hasattr(ride, 'pickup_distance_km'):
-            ride_data['pickup_distance_km'] = ride.pickup_distance_km
-        
-        results.append(ride_data)
-    
+        search = RideSearch(request.query_params)
+    except SearchParamError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response(search.payload(list(search.queryset())))
+
+
+def _booking_response(booking, message, status_code=status.HTTP_200_OK):
     return Response({
-        "start_date": start_date.isoformat(),
-        "end_date": end_date.isoformat(),
-        "count": len(results),
-        "results": results
-    })
+        'message': message,
+        'booking': RideBookingSerializer(booking).data,
+    }, status=status_code)
+
+
+@extend_schema(
+    request=RideBookingCreateSerializer,
+    responses={201: RideBookingSerializer},
+    description='Richiede uno o più posti su una partenza. I posti vengono scalati quando l\'autista accetta.'
+)
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def create_booking(request, ride_id):
+    """Crea (o riapre, se annullata o rifiutata) la prenotazione dell'utente su una partenza"""
+    serializer = RideBookingCreateSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response({
+            'message': 'Dati non validi',
+            'errors': serializer.errors
+        }, status=status.HTTP_400_BAD_REQUEST)
+    seats = serializer.validated_data['seats_reserved']
+
+    try:
+        ride = RideOffer.objects.get(pk=ride_id)
+    except RideOffer.DoesNotExist:
+        return Response({'message': 'Partenza non trovata'}, status=status.HTTP_404_NOT_FOUND)
+
+    if ride.driver_id == request.user.id:
+        return Response({'message': 'Non puoi prenotare la tua partenza'}, status=status.HTTP_400_BAD_REQUEST)
+    if ride.status != RideOffer.Status.PUBLISHED or ride.departure_time <= timezone.now():
+        return Response({'message': 'Partenza non prenotabile'}, status=status.HTTP_409_CONFLICT)
+    # Controllo indicativo: la garanzia contro l'overbooking è in accept_booking
+    if seats > ride.seats_available:
+        return Response({'message': 'Posti insufficienti'}, status=status.HTTP_409_CONFLICT)
+
+    reopened = RideBooking.objects.filter(
+        ride=ride,
+        passenger=request.user,
+        status__in=[RideBooking.Status.CANCELLED, RideBooking.Status.REJECTED],
+    ).update(status=RideBooking.Status.REQUESTED, seats_reserved=seats)
+    if reopened:
+        booking = RideBooking.objects.get(ride=ride, passenger=request.user)
+    else:
+        try:
+            with transaction.atomic():
+                booking = RideBooking.objects.create(ride=ride, passenger=request.user, seats_reserved=seats)
+        except IntegrityError:
+            return Response({'message': 'Hai già una prenotazione per questa partenza'}, status=status.HTTP_409_CONFLICT)
+
+    return _booking_response(booking, 'Prenotazione richiesta', status.HTTP_201_CREATED)
+
+
+@extend_schema(
+    request=None,
+    responses={200: RideBookingSerializer},
+    description='L\'autista accetta una prenotazione: i posti vengono scalati in modo atomico, senza mai superare quelli disponibili.'
+)
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def accept_booking(request, booking_id):
+    """Accetta una prenotazione in attesa (solo l'autista della partenza)"""
+    try:
+        booking = RideBooking.objects.select_related('ride').get(pk=booking_id)
+    except RideBooking.DoesNotExist:
+        return Response({'message': 'Prenotazione non trovata'}, status=status.HTTP_404_NOT_FOUND)
+    if booking.ride.driver_id != request.user.id:
+        return Response({'message': 'Solo l\'autista può accettare la prenotazione'}, status=status.HTTP_403_FORBIDDEN)
+
+    with transaction.atomic():
+        # Transizioni e posti con UPDATE condizionali: nessun read-modify-write
+        accepted = RideBooking.objects.filter(
+            pk=booking.pk, status=RideBooking.Status.REQUESTED,
+        ).update(status=RideBooking.Status.ACCEPTED)
+        if not accepted:
+            return Response({'message': 'La prenotazione non è più in attesa'}, status=status.HTTP_409_CONFLICT)
+        if not RideOffer.reserve_seats(booking.ride_id, booking.seats_reserved):
+            transaction.set_rollback(True)
+            return Response({'message': 'Posti insufficienti'}, status=status.HTTP_409_CONFLICT)
+
+    booking.refresh_from_db()
+    return _booking_response(booking, 'Prenotazione accettata')
+
+
+@extend_schema(
+    request=None,
+    responses={200: RideBookingSerializer},
+    description='Annulla una prenotazione (passeggero o autista). Se era accettata, i posti tornano disponibili.'
+)
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def cancel_booking(request, booking_id):
+    """Annulla una prenotazione in attesa o accettata"""
+    try:
+        booking = RideBooking.objects.select_related('ride').get(pk=booking_id)
+    except RideBooking.DoesNotExist:
+        return Response({'message': 'Prenotazione non trovata'}, status=status.HTTP_404_NOT_FOUND)
+    if request.user.id not in (booking.passenger_id, booking.ride.driver_id):
+        return Response({'message': 'Non puoi annullare questa prenotazione'}, status=status.HTTP_403_FORBIDDEN)
+
+    with transaction.atomic():
+        bookings = RideBooking.objects.filter(pk=booking.pk)
+        if bookings.filter(status=RideBooking.Status.ACCEPTED).update(status=RideBooking.Status.CANCELLED):
+            # Posti già al massimo: i contatori non tornano, meglio non annullare
+            if not RideOffer.release_seats(booking.ride_id, booking.seats_reserved):
+                transaction.set_rollback(True)
+                return Response({'message': 'Impossibile restituire i posti'}, status=status.HTTP_409_CONFLICT)
+        elif not bookings.filter(status=RideBooking.Status.REQUESTED).update(status=RideBooking.Status.CANCELLED):
+            return Response({'message': 'La prenotazione non può essere annullata'}, status=status.HTTP_409_CONFLICT)
+
+    booking.refresh_from_db()
+    return _booking_response(booking, 'Prenotazione annullata')
+
+
+@extend_schema(
+    request=RideRatingCreateSerializer,
+    responses={201: RideRatingSerializer},
+    description='Il passeggero valuta l\'autista dopo la partenza (una volta per prenotazione). La media del profilo dell\'autista viene aggiornata subito.'
+)
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def rate_booking(request, booking_id):
+    """Valutazione dell'autista da parte del passeggero di una prenotazione accettata o completata"""
+    serializer = RideRatingCreateSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response({
+            'message': 'Dati non validi',
+            'errors': serializer.errors
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        booking = RideBooking.objects.select_related('ride').get(pk=booking_id)
+    except RideBooking.DoesNotExist:
+        return Response({'message': 'Prenotazione non trovata'}, status=status.HTTP_404_NOT_FOUND)
+    if booking.passenger_id != request.user.id:
+        return Response({'message': 'Solo il passeggero può valutare questa partenza'}, status=status.HTTP_403_FORBIDDEN)
+    departed = booking.ride.departure_time <= timezone.now()
+    if booking.status not in (RideBooking.Status.ACCEPTED, RideBooking.Status.COMPLETED) or not departed:
+        return Response({'message': 'Puoi valutare solo partenze già avvenute'}, status=status.HTTP_409_CONFLICT)
+
+    try:
+        with transaction.atomic():
+            rating = RideRating.objects.create(
+                booking=booking,
+                rater=request.user,
+                driver_id=booking.ride.driver_id,
+                **serializer.validated_data,
+            )
+            # Aggregato incrementale nella stessa transazione: mai ricalcolato in lettura
+            Profile.add_rating(booking.ride.driver_id, rating.score)
+    except IntegrityError:
+        return Response({'message': 'Hai già valutato questa partenza'}, status=status.HTTP_409_CONFLICT)
+
+    return Response(RideRatingSerializer(rating).data, status=status.HTTP_201_CREATED)
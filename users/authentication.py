@@ -0,0 +1,105 @@
+"""
+Autenticazione JWT con l'utente in cache.
+
+JWTAuthentication di simplejwt legge auth_user a ogni richiesta, e le view
+che usano request.user.profile aggiungono una seconda query. Qui i campi di
+utente e profilo (select_related) sono salvati nella cache di Django per
+AUTH_USER_CACHE_TIMEOUT secondi, sotto una chiave con la versione
+dell'utente (users/cache.py): salvataggi e cancellazioni di User e Profile,
+disattivazione compresa, la incrementano dopo il commit, quindi la richiesta
+successiva rilegge dal database. Con la voce in cache l'autenticazione non
+fa query.
+
+In cache vanno solo i valori dei campi, senza la password: l'utente
+ricostruito la ha come campo differito (letta dal database solo se serve).
+Con CHECK_REVOKE_TOKEN si salva al suo posto l'hash usato da simplejwt.
+
+I controlli di simplejwt (utente attivo, token revocato dal cambio
+password) sono ripetuti anche sull'utente letto dalla cache.
+
+Come per il profilo pubblico, la versione invalida gli altri processi solo
+con una cache condivisa (REDIS_URL); con la LocMemCache un processo può
+autenticare un utente disattivato altrove fino a AUTH_USER_CACHE_TIMEOUT
+secondi.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import router
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+# Modulo e non funzione: users.cache importa DRF, che importa questa classe dai settings
+from . import cache as user_cache
+
+
+USER_KEY = "users:auth_user:{user_id}:{version}"
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication che legge utente e profilo dalla cache"""
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_("Token contained no recognizable user identification")) from e
+
+        key = USER_KEY.format(user_id=user_id, version=user_cache.user_version(user_id))
+        payload = cache.get(key)
+        if payload is None:
+            try:
+                user = self.user_model.objects.select_related('profile').get(
+                    **{api_settings.USER_ID_FIELD: user_id}
+                )
+            except self.user_model.DoesNotExist as e:
+                raise AuthenticationFailed(_("User not found"), code="user_not_found") from e
+            payload = self.cache_payload(user)
+            cache.set(key, payload, settings.AUTH_USER_CACHE_TIMEOUT)
+        else:
+            user = self.user_from_payload(payload)
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != payload["password_hash"]:
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+        return user
+
+    @staticmethod
+    def _field_values(instance, exclude=()):
+        return {
+            field.attname: getattr(instance, field.attname)
+            for field in instance._meta.concrete_fields
+            if field.name not in exclude
+        }
+
+    def cache_payload(self, user):
+        """Valori dei campi di utente e profilo da salvare in cache, senza la password"""
+        profile = getattr(user, 'profile', None)
+        payload = {
+            "user": self._field_values(user, exclude=("password",)),
+            "profile": self._field_values(profile) if profile is not None else None,
+        }
+        if api_settings.CHECK_REVOKE_TOKEN:
+            payload["password_hash"] = get_md5_hash_password(user.password)
+        return payload
+
+    def user_from_payload(self, payload):
+        """Utente (con il profilo già collegato) ricostruito dai valori in cache"""
+        db = router.db_for_read(self.user_model)
+        user = self.user_model.from_db(db, list(payload["user"]), list(payload["user"].values()))
+        profile_relation = self.user_model._meta.get_field('profile')
+        profile = None
+        if payload["profile"] is not None:
+            values = payload["profile"]
+            profile = profile_relation.related_model.from_db(db, list(values), list(values.values()))
+            profile_relation.field.set_cached_value(profile, user)
+        # Come select_related: user.profile non fa query, anche se il profilo manca
+        profile_relation.set_cached_value(user, profile)
+        return user
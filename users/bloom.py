@@ -0,0 +1,210 @@
+"""
+Filtro di Bloom delle email registrate, per check_email_availability.
+
+Il controllo dell'email viene chiamato a ogni tasto premuto nel form di
+registrazione e quasi sempre riguarda email libere. Ogni processo tiene in
+memoria un filtro di Bloom delle email (minuscole): se il filtro dice che
+l'email non c'è, è libera senza interrogare il database; solo i possibili
+positivi (email registrate o falsi positivi, circa l'1%) vengono confermati
+con una query sull'indice LOWER(email) (migrazione users 0003).
+
+Aggiornamento:
+- le email salvate da questo processo entrano subito nel filtro (segnale
+  post_save di User, users/signals.py), anche durante una ricostruzione;
+- ogni EMAIL_BLOOM_REFRESH_SECONDS il filtro legge gli utenti creati dagli
+  altri processi (pk oltre l'ultimo letto, con un margine per le transazioni
+  confermate in ritardo);
+- ogni EMAIL_BLOOM_REBUILD_SECONDS, o quando supera la capacità prevista,
+  il filtro viene ricostruito da zero: così rientrano anche le email
+  cambiate da altri processi ed escono quelle non più usate.
+
+Costruzione e ricostruzione leggono tutta la tabella degli utenti e avvengono
+in un thread in background: intanto le richieste usano il filtro precedente
+(o il database, prima della prima costruzione), che viene sostituito solo a
+filtro nuovo completo.
+
+Le email cambiate su utenti esistenti non si possono leggere in modo
+incrementale (auth_user non ha una data di modifica): un'email cambiata in
+un altro processo può risultare libera fino alla ricostruzione successiva,
+al massimo EMAIL_BLOOM_REBUILD_SECONDS (10 minuti di default). La risposta è
+solo un suggerimento, la registrazione la verifica sempre sul database.
+"""
+
+import hashlib
+import logging
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.db.models.functions import Lower
+
+
+# Probabilità di falso positivo alla capacità prevista
+FALSE_POSITIVE_RATE = 0.01
+MIN_CAPACITY = 10_000
+# Pk già letti riletti a ogni aggiornamento: utenti con pk più basso confermati dopo
+CATCH_UP_OVERLAP = 100
+BUILD_CHUNK_SIZE = 5_000
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    """Filtro di Bloom su stringhe, dimensionato per capacity elementi"""
+
+    def __init__(self, capacity, error_rate=FALSE_POSITIVE_RATE):
+        self.capacity = capacity
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, value):
+        # Doppio hashing (Kirsch-Mitzenmacher): due hash da 64 bit per k posizioni
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hash_count)]
+
+    def add(self, value):
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+
+def users_with_email(email):
+    """Utenti con questa email, senza distinguere maiuscole (usa l'indice LOWER(email))"""
+    return get_user_model().objects.alias(email_lower=Lower('email')).filter(email_lower=email.lower())
+
+
+class RegisteredEmails:
+    """Filtro delle email registrate del processo, costruito al primo uso"""
+
+    def __init__(self):
+        self._filter = None
+        self._last_pk = 0
+        self._refreshed_at = 0.0
+        self._built_at = 0.0
+        # Un solo thread alla volta aggiorna il filtro dal database: durante una
+        # ricostruzione il lock è del thread in background...
+        self._refresh_lock = threading.Lock()
+        # ...mentre le scritture sui bit sono brevi e serializzate: add (segnale) e
+        # _catch_up fanno read-modify-write sugli stessi byte
+        self._bits_lock = threading.Lock()
+        # Email aggiunte durante una ricostruzione, da riportare nel nuovo filtro
+        self._added_during_build = None
+
+    def reset(self):
+        with self._bits_lock:
+            self._filter = None
+
+    def add(self, email):
+        if not email:
+            return
+        email = email.lower()
+        with self._bits_lock:
+            if self._added_during_build is not None:
+                self._added_during_build.append(email)
+            bloom = self._filter
+            if bloom is not None and email not in bloom:
+                bloom.add(email)
+
+    def might_contain(self, email):
+        """False se l'email sicuramente non è registrata"""
+        self._refresh_if_needed()
+        bloom = self._filter
+        # Filtro non ancora pronto (in costruzione in un altro thread): decide il database
+        return bloom is None or email.lower() in bloom
+
+    def _refresh_if_needed(self):
+        now = time.monotonic()
+        if self._filter is not None and now - self._refreshed_at < settings.EMAIL_BLOOM_REFRESH_SECONDS:
+            return
+        # Un solo thread aggiorna, gli altri usano il filtro corrente
+        if not self._refresh_lock.acquire(blocking=False):
+            return
+        bloom = self._filter
+        if (
+            bloom is None
+            or bloom.count > bloom.capacity
+            or now - self._built_at >= settings.EMAIL_BLOOM_REBUILD_SECONDS
+        ):
+            # Il lock passa al thread della ricostruzione, che lo rilascia alla fine
+            self._start_build()
+            return
+        try:
+            self._catch_up(bloom)
+            self._refreshed_at = now
+        finally:
+            self._refresh_lock.release()
+
+    def _start_build(self):
+        """Ricostruisce il filtro in un thread: la richiesta non lo attende"""
+        def run():
+            try:
+                self._build_and_release()
+            finally:
+                # Connessione aperta dal thread della ricostruzione
+                connection.close()
+
+        threading.Thread(target=run, name="email-bloom-build", daemon=True).start()
+
+    def _build_and_release(self):
+        try:
+            self._build()
+            self._refreshed_at = time.monotonic()
+        except Exception:
+            # Il filtro corrente resta in uso: si riprova alla richiesta successiva
+            logger.exception("Ricostruzione del filtro delle email non riuscita")
+        finally:
+            self._refresh_lock.release()
+
+    def _rows(self, **filters):
+        return get_user_model().objects.filter(**filters).exclude(email='').order_by().values_list(
+            'pk', Lower('email'),
+        )
+
+    def _build(self):
+        with self._bits_lock:
+            self._added_during_build = []
+        try:
+            # Il filtro corrente conta già le email: il COUNT serve solo la prima volta
+            current = self._filter
+            count = current.count if current is not None else get_user_model().objects.exclude(email='').count()
+            bloom = BloomFilter(max(MIN_CAPACITY, count * 2))
+            last_pk = 0
+            for pk, email in self._rows().iterator(chunk_size=BUILD_CHUNK_SIZE):
+                bloom.add(email)
+                last_pk = max(last_pk, pk)
+            with self._bits_lock:
+                # Salvate da questo processo dopo l'inizio della lettura
+                for email in self._added_during_build:
+                    if email not in bloom:
+                        bloom.add(email)
+                self._filter, self._last_pk, self._built_at = bloom, last_pk, time.monotonic()
+        finally:
+            with self._bits_lock:
+                self._added_during_build = None
+
+    def _catch_up(self, bloom):
+        rows = list(self._rows(pk__gt=self._last_pk - CATCH_UP_OVERLAP))
+        with self._bits_lock:
+            for pk, email in rows:
+                # Le righe del margine sono quasi tutte già presenti: non contano sulla capacità
+                if email not in bloom:
+                    bloom.add(email)
+        self._last_pk = max([self._last_pk, *(pk for pk, _ in rows)])
+
+
+registered_emails = RegisteredEmails()
+
+
+def is_email_registered(email):
+    """Controllo dell'email: il database solo se il filtro non la esclude"""
+    return registered_emails.might_contain(email) and users_with_email(email).exists()
@@ -0,0 +1,173 @@
+"""
+Cache versionata del profilo pubblico (get_public_profile).
+
+Il payload di ogni utente è salvato nella cache di Django sotto una chiave
+che contiene la versione corrente dell'utente. Salvataggi di Profile e User
+(segnali) e gli aggiornamenti atomici dei contatori incrementano la versione
+dopo il commit: le voci vecchie non vengono più lette e scadono da sole, e un
+ricalcolo partito prima della modifica scrive sotto la versione vecchia,
+senza mai sovrascrivere quella nuova. La stessa versione è nella chiave
+dell'utente in cache per l'autenticazione (users/authentication.py).
+
+Versioni e voci vivono nella cache di Django, quindi l'invalidazione
+raggiunge gli altri processi solo con una cache condivisa (REDIS_URL, vedi
+CACHES nei settings; manage.py check --deploy lo segnala con rides.W001).
+Con la LocMemCache ogni processo ha le sue versioni: quelli diversi da
+chi ha fatto la modifica servono il profilo vecchio fino alla scadenza
+morbida della voce (PUBLIC_PROFILE_CACHE_TIMEOUT).
+
+Protezione dallo stampede: ogni voce ha una scadenza "morbida"
+(PUBLIC_PROFILE_CACHE_TIMEOUT) e resta in cache per un ulteriore periodo di
+grazia. Dopo la scadenza morbida una sola richiesta (lock con cache.add)
+ricalcola il payload mentre le altre continuano a ricevere quello
+precedente; se la voce manca del tutto le altre attendono brevemente il
+risultato invece di interrogare il database in parallelo.
+
+Contatori di hit/miss esposti su /api/metrics/ (skipool_public_profile_cache_total).
+"""
+
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from config.metrics import registry
+
+
+VERSION_KEY = "users:version:{user_id}"
+ENTRY_KEY = "users:public_profile:{user_id}:{version}"
+LOCK_KEY = "users:public_profile:lock:{user_id}:{version}"
+# Durata massima di un ricalcolo: oltre, il lock scade e un'altra richiesta ci riprova
+LOCK_TIMEOUT = 10
+# Attesa massima di chi trova la voce mancante e il ricalcolo già in corso
+WAIT_FOR_RECOMPUTE = 0.5
+WAIT_STEP = 0.02
+
+
+class CacheStats:
+    """Contatori per esito, condivisi da tutti i thread del processo"""
+
+    RESULTS = ("hit", "stale", "miss", "wait")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = dict.fromkeys(self.RESULTS, 0)
+
+    def record(self, result):
+        with self._lock:
+            self._counts[result] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counts)
+
+    def render(self):
+        lines = [
+            "# HELP skipool_public_profile_cache_total Letture del profilo pubblico per esito della cache",
+            "# TYPE skipool_public_profile_cache_total counter",
+        ]
+        for result, count in self.snapshot().items():
+            lines.append(f'skipool_public_profile_cache_total{{result="{result}"}} {count}')
+        return lines
+
+
+stats = CacheStats()
+registry.register_collector(stats.render)
+
+
+def user_version(user_id):
+    """Versione corrente dei dati in cache dell'utente"""
+    key = VERSION_KEY.format(user_id=user_id)
+    version = cache.get(key)
+    if version is None:
+        # Valore iniziale unico: se la chiave della versione viene rimossa
+        # dalla cache non si tornano a leggere voci di una versione passata
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_user_version(user_id):
+    key = VERSION_KEY.format(user_id=user_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), timeout=None)
+
+
+def invalidate_public_profile(user_id):
+    """Rende obsoleti profilo e utente in cache dopo il commit della transazione corrente"""
+    transaction.on_commit(lambda: bump_user_version(user_id))
+
+
+def build_public_profile(user_id):
+    """Payload del profilo pubblico dal database, o None se non esiste"""
+    from .models import Profile
+
+    try:
+        profile = Profile.objects.select_related('user').get(user_id=user_id)
+    except Profile.DoesNotExist:
+        return None
+    # Dati pubblici limitati
+    return {
+        'id': profile.id,
+        'display_name': profile.display_name,
+        'photo_url': profile.photo_url,
+        'bio': profile.bio,
+        'has_car': profile.has_car,
+        'ski_level': profile.ski_level,
+        'rating_avg': profile.rating_avg,
+        'rating_count': profile.rating_count,
+        'rides_as_driver': profile.rides_as_driver,
+        'rides_as_passenger': profile.rides_as_passenger,
+        'is_verified': profile.is_verified,
+        'member_since': profile.member_since_display,
+    }
+
+
+def _recompute(user_id, entry_key, lock_key):
+    try:
+        data = build_public_profile(user_id)
+        if data is not None:
+            timeout = settings.PUBLIC_PROFILE_CACHE_TIMEOUT
+            entry = (data, time.time() + timeout)
+            cache.set(entry_key, entry, timeout + settings.PUBLIC_PROFILE_CACHE_GRACE)
+        return data
+    finally:
+        cache.delete(lock_key)
+
+
+def get_public_profile_data(user_id):
+    """Payload del profilo pubblico (dalla cache se possibile), o None se non esiste"""
+    version = user_version(user_id)
+    entry_key = ENTRY_KEY.format(user_id=user_id, version=version)
+    lock_key = LOCK_KEY.format(user_id=user_id, version=version)
+
+    entry = cache.get(entry_key)
+    if entry is not None:
+        data, refresh_at = entry
+        if time.time() < refresh_at:
+            stats.record("hit")
+            return data
+        # Scaduta: la ricalcola solo chi prende il lock, gli altri usano la copia in cache
+        if not cache.add(lock_key, 1, LOCK_TIMEOUT):
+            stats.record("stale")
+            return data
+        stats.record("miss")
+        return _recompute(user_id, entry_key, lock_key)
+
+    if cache.add(lock_key, 1, LOCK_TIMEOUT):
+        stats.record("miss")
+        return _recompute(user_id, entry_key, lock_key)
+
+    # Ricalcolo già in corso in un'altra richiesta: attende il risultato
+    stats.record("wait")
+    deadline = time.monotonic() + WAIT_FOR_RECOMPUTE
+    while time.monotonic() < deadline:
+        time.sleep(WAIT_STEP)
+        entry = cache.get(entry_key)
+        if entry is not None:
+            return entry[0]
+    return build_public_profile(user_id)
@@ -0,0 +1,81 @@
+"""
+Ricalcola rating_avg e rating_count di tutti i profili dalle valutazioni.
+
+Gli aggregati sono mantenuti in modo incrementale a ogni valutazione
+(Profile.add_rating); questo comando ripara eventuali derive (valutazioni
+cancellate, correzioni manuali). Lavora a blocchi di --chunk-size profili:
+per ogni blocco una query di aggregazione sulle valutazioni e un
+bulk_update dei soli profili cambiati.
+
+Esempi:
+    python manage.py recompute_ratings
+    python manage.py recompute_ratings --chunk-size 500 --dry-run
+"""
+
+import math
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Avg, Count
+
+from rides.models import RideRating
+from users.cache import invalidate_public_profile
+from users.models import Profile
+
+
+class Command(BaseCommand):
+    help = 'Ricalcola a blocchi media e numero di valutazioni di tutti i profili'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Profili per blocco (default: 1000)')
+        parser.add_argument('--dry-run', action='store_true', help='Conta i profili da correggere senza salvarli')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        if chunk_size < 1:
+            raise CommandError('--chunk-size deve essere positivo')
+
+        checked = fixed = 0
+        last_pk = 0
+        while True:
+            with transaction.atomic():
+                count, changed, last_pk = self.recompute_chunk(last_pk, chunk_size, options['dry_run'])
+            if not count:
+                break
+            checked += count
+            fixed += changed
+
+        action = 'da correggere' if options['dry_run'] else 'corretti'
+        self.stdout.write(self.style.SUCCESS(f'{checked} profili controllati, {fixed} {action}'))
+
+    def recompute_chunk(self, last_pk, chunk_size, dry_run):
+        """Ricalcola i profili dopo last_pk; restituisce (controllati, corretti, ultimo pk)"""
+        profiles = Profile.objects.filter(pk__gt=last_pk).order_by('pk').only(
+            'pk', 'user_id', 'rating_avg', 'rating_count',
+        )
+        if not dry_run:
+            # Le righe restano bloccate fino al salvataggio: una valutazione
+            # concorrente attende e poi incrementa il valore ricalcolato
+            profiles = profiles.select_for_update()
+        profiles = list(profiles[:chunk_size])
+        if not profiles:
+            return 0, 0, last_pk
+
+        aggregates = {
+            row['driver_id']: (row['avg'], row['count'])
+            for row in RideRating.objects.filter(driver_id__in=[profile.user_id for profile in profiles])
+            .values('driver_id').annotate(avg=Avg('score'), count=Count('id'))
+        }
+        changed = []
+        for profile in profiles:
+            avg, count = aggregates.get(profile.user_id, (0.0, 0))
+            if profile.rating_count != count or not math.isclose(profile.rating_avg, avg, abs_tol=1e-9):
+                profile.rating_avg, profile.rating_count = float(avg), count
+                changed.append(profile)
+
+        if changed and not dry_run:
+            Profile.objects.bulk_update(changed, ['rating_avg', 'rating_count'])
+            # bulk_update non invia post_save
+            for profile in changed:
+                invalidate_public_profile(profile.user_id)
+        return len(profiles), len(changed), profiles[-1].pk
@@ -0,0 +1,78 @@
+"""
+Riallinea rides_as_driver e rides_as_passenger di tutti i profili.
+
+I contatori sono mantenuti a ogni passaggio a COMPLETED (rides/signals.py);
+questo comando ripara le derive (queryset.update, bulk_create, cancellazioni).
+I profili vengono letti in streaming con iterator(chunk_size=...) insieme ai
+conteggi reali, calcolati dal database con subquery: in memoria c'è al
+massimo un blocco, anche con milioni di prenotazioni. Le differenze vengono
+applicate a blocchi con bulk_update come incrementi F() + delta, così un
+passaggio a COMPLETED confermato durante l'esecuzione non viene perso.
+
+Esempi:
+    python manage.py reconcile_ride_counters
+    python manage.py reconcile_ride_counters --chunk-size 5000 --dry-run
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from rides.models import RideBooking, RideOffer
+from users.cache import invalidate_public_profile
+from users.models import Profile
+
+
+def completed_count(model, user_field):
+    """Subquery con il numero di righe COMPLETED dell'utente del profilo"""
+    rows = model.objects.filter(
+        **{user_field: OuterRef('user_id')}, status=model.Status.COMPLETED,
+    ).order_by().values(user_field).annotate(count=Count('pk')).values('count')
+    return Coalesce(Subquery(rows, output_field=IntegerField()), 0)
+
+
+class Command(BaseCommand):
+    help = 'Ricalcola a blocchi i contatori rides_as_driver / rides_as_passenger dei profili'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Profili per blocco (default: 2000)')
+        parser.add_argument('--dry-run', action='store_true', help='Conta i profili da correggere senza salvarli')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        if chunk_size < 1:
+            raise CommandError('--chunk-size deve essere positivo')
+
+        rows = Profile.objects.order_by('pk').annotate(
+            driver_count=completed_count(RideOffer, 'driver'),
+            passenger_count=completed_count(RideBooking, 'passenger'),
+        ).values_list('pk', 'user_id', 'rides_as_driver', 'rides_as_passenger', 'driver_count', 'passenger_count')
+
+        checked = 0
+        corrections = []
+        fixed = 0
+        for pk, user_id, as_driver, as_passenger, driver_count, passenger_count in rows.iterator(chunk_size=chunk_size):
+            checked += 1
+            if (as_driver, as_passenger) == (driver_count, passenger_count):
+                continue
+            profile = Profile(pk=pk, user_id=user_id)
+            profile.rides_as_driver = F('rides_as_driver') + (driver_count - as_driver)
+            profile.rides_as_passenger = F('rides_as_passenger') + (passenger_count - as_passenger)
+            corrections.append(profile)
+            if len(corrections) >= chunk_size:
+                fixed += self.apply(corrections, options['dry_run'])
+                corrections = []
+        fixed += self.apply(corrections, options['dry_run'])
+
+        action = 'da correggere' if options['dry_run'] else 'corretti'
+        self.stdout.write(self.style.SUCCESS(f'{checked} profili controllati, {fixed} {action}'))
+
+    def apply(self, corrections, dry_run):
+        if corrections and not dry_run:
+            with transaction.atomic():
+                Profile.objects.bulk_update(corrections, ['rides_as_driver', 'rides_as_passenger'])
+                # bulk_update non invia post_save
+                for profile in corrections:
+                    invalidate_public_profile(profile.user_id)
+        return len(corrections)
@@ -0,0 +1,104 @@
+# Generated by Django 5.2.10 on 2026-10-17 23:50
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rides', '0002_skiresort_destination_ski_resort'),
+        ('users', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='car_model',
+            field=models.CharField(blank=True, help_text="Modello dell'auto", max_length=100),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='car_seats',
+            field=models.PositiveSmallIntegerField(default=4, help_text='Posti disponibili in auto'),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='favorite_resorts',
+            field=models.ManyToManyField(blank=True, related_name='fans', to='rides.skiresort'),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='has_car',
+            field=models.BooleanField(default=False, help_text="L'utente ha una macchina disponibile"),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='instagram_handle',
+            field=models.CharField(blank=True, max_length=50),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='is_phone_verified',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='is_verified',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='phone',
+            field=models.CharField(blank=True, max_length=20),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='profile_type',
+            field=models.CharField(choices=[('normal', 'Utente Normale'), ('travel_agency', 'Agenzia Viaggio'), ('association', 'Associazione'), ('special', 'Special')], default='normal', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='rides_as_driver',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='rides_as_passenger',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='ski_level',
+            field=models.CharField(blank=True, choices=[('beginner', 'Principiante'), ('intermediate', 'Intermedio'), ('advanced', 'Avanzato'), ('expert', 'Esperto')], max_length=20),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AlterField(
+            model_name='profile',
+            name='bio',
+            field=models.TextField(blank=True, max_length=500),
+        ),
+        migrations.AlterField(
+            model_name='profile',
+            name='photo_url',
+            field=models.URLField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='profile',
+            name='user',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='profile', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
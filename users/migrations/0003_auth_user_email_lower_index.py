@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.db import migrations
+
+
+INDEX_NAME = "users_auth_user_email_lower_idx"
+
+
+def user_table(apps):
+    return apps.get_model(settings.AUTH_USER_MODEL)._meta.db_table
+
+
+def create_email_lower_index(apps, schema_editor):
+    # auth_user appartiene all'app auth: l'indice funzionale si crea a mano,
+    # con la stessa espressione di users.bloom.users_with_email
+    quote = schema_editor.quote_name
+    schema_editor.execute(
+        f"CREATE INDEX IF NOT EXISTS {quote(INDEX_NAME)} "
+        f"ON {quote(user_table(apps))} (LOWER({quote('email')}))"
+    )
+
+
+def drop_email_lower_index(apps, schema_editor):
+    schema_editor.execute(f"DROP INDEX IF EXISTS {schema_editor.quote_name(INDEX_NAME)}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_profile_car_model_profile_car_seats_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(create_email_lower_index, drop_email_lower_index),
+    ]
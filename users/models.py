@@ -1,6 +1,9 @@
 from django.db import models
+from django.db.models import F, Value
 from django.conf import settings
 
+from .cache import invalidate_public_profile
+
 
 class Profile(models.Model):
     """Profilo esteso dell'utente"""
@@ -64,6 +67,32 @@ class Profile(models.Model):
     def __str__(self):
         return self.display_name or self.user.username
     
+    @classmethod
+    def add_rating(cls, user_id, score):
+        """
+        Aggiorna media e numero di valutazioni con un solo UPDATE atomico:
+        nuova media = (media * n + voto) / (n + 1). Le espressioni leggono i
+        valori precedenti della riga, quindi valutazioni concorrenti non si
+        sovrascrivono e non serve rileggere tutte le valutazioni.
+        """
+        updated = cls.objects.filter(user_id=user_id).update(
+            rating_avg=(F('rating_avg') * F('rating_count') + Value(float(score))) / (F('rating_count') + 1),
+            rating_count=F('rating_count') + 1,
+        )
+        # update() non invia post_save: il profilo pubblico in cache va invalidato qui
+        invalidate_public_profile(user_id)
+        return updated == 1
+
+    @classmethod
+    def adjust_ride_counter(cls, user_id, field, delta):
+        """Somma `delta` a rides_as_driver o rides_as_passenger con un UPDATE atomico (mai sotto zero)"""
+        profiles = cls.objects.filter(user_id=user_id)
+        if delta < 0:
+            profiles = profiles.filter(**{f'{field}__gte': -delta})
+        updated = profiles.update(**{field: F(field) + delta})
+        invalidate_public_profile(user_id)
+        return updated == 1
+
     @property
     def total_rides(self):
         return self.rides_as_driver + self.rides_as_passenger
@@ -0,0 +1,9 @@
+"""Estensioni drf-spectacular dell'app users (importate in UsersConfig.ready)"""
+
+from drf_spectacular.contrib.rest_framework_simplejwt import SimpleJWTScheme
+
+
+class CachedJWTScheme(SimpleJWTScheme):
+    """Stesso schema Bearer (jwtAuth) di JWTAuthentication per CachedJWTAuthentication"""
+
+    target_class = "users.authentication.CachedJWTAuthentication"
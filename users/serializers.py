@@ -1,6 +1,7 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
 from django.contrib.auth.password_validation import validate_password
+from .bloom import users_with_email
 from .models import Profile
 
 User = get_user_model()
@@ -109,7 +110,7 @@ class UserRegistrationSerializer(serializers.Serializer):
     
     def validate_email(self, value):
         """Verifica che l'email non sia già in uso"""
-        if User.objects.filter(email=value.lower()).exists():
+        if users_with_email(value).exists():
             raise serializers.ValidationError("Questa email è già registrata.")
         return value.lower()
     
@@ -167,7 +168,7 @@ class UserUpdateSerializer(serializers.ModelSerializer):
     def validate_email(self, value):
         """Verifica che l'email non sia già in uso da altri"""
         user = self.context.get('request').user
-        if User.objects.filter(email=value.lower()).exclude(pk=user.pk).exists():
+        if users_with_email(value).exclude(pk=user.pk).exists():
             raise serializers.ValidationError("Questa email è già in uso.")
         return value.lower()
 
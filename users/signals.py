@@ -1,6 +1,8 @@
 from django.contrib.auth import get_user_model
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
+from .bloom import registered_emails
+from .cache import invalidate_public_profile
 from .models import Profile
 
 User = get_user_model()
@@ -13,3 +15,20 @@ def create_profile(sender, instance, created, **kwargs):
         if not hasattr(instance, 'profile') or not Profile.objects.filter(user=instance).exists():
             display_name = f"{instance.first_name} {instance.last_name}".strip() or instance.username
             Profile.objects.create(user=instance, display_name=display_name)
+
+
+@receiver([post_save, post_delete], sender=User)
+def user_changed(sender, instance, **kwargs):
+    """Il profilo pubblico in cache usa anche i dati dell'utente"""
+    invalidate_public_profile(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Profile)
+def profile_changed(sender, instance, **kwargs):
+    invalidate_public_profile(instance.user_id)
+
+
+@receiver(post_save, sender=User)
+def remember_email(sender, instance, **kwargs):
+    """Email nuove o cambiate subito nel filtro di check_email_availability"""
+    registered_emails.add(instance.email)
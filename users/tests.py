@@ -1,3 +1,258 @@
-from django.test import TestCase
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.checks import run_checks
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+from drf_spectacular.generators import SchemaGenerator
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import cache as profile_cache
+from .authentication import USER_KEY
+from .bloom import BloomFilter, registered_emails
+from .models import Profile
+
+User = get_user_model()
+
+
+class PublicProfileCacheTests(TestCase):
+    """Profilo pubblico servito dalla cache e invalidato dalle modifiche"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="mario@example.com", first_name="Mario")
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = f"/api/users/{self.user.pk}/profile/"
+
+    def test_hit_avoids_queries(self):
+        self.assertEqual(self.client.get(self.url).data["display_name"], "Mario")
+        before = profile_cache.stats.snapshot()
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertEqual(response.data["display_name"], "Mario")
+        self.assertEqual(profile_cache.stats.snapshot()["hit"], before["hit"] + 1)
+
+    def test_changes_invalidate_after_commit(self):
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            profile = Profile.objects.get(user=self.user)
+            profile.display_name = "Mario R."
+            profile.save()
+        self.assertEqual(self.client.get(self.url).data["display_name"], "Mario R.")
+
+        # Aggiornamenti atomici senza post_save
+        with self.captureOnCommitCallbacks(execute=True):
+            Profile.add_rating(self.user.pk, 4)
+        self.assertEqual(self.client.get(self.url).data["rating_count"], 1)
+
+    def test_expired_entry_served_while_recomputing(self):
+        data = profile_cache.get_public_profile_data(self.user.pk)
+        version = profile_cache.user_version(self.user.pk)
+        entry_key = profile_cache.ENTRY_KEY.format(user_id=self.user.pk, version=version)
+        lock_key = profile_cache.LOCK_KEY.format(user_id=self.user.pk, version=version)
+        cache.set(entry_key, (data, time.time() - 1))
+
+        # Un'altra richiesta sta già ricalcolando: copia precedente, nessuna query
+        cache.add(lock_key, 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(profile_cache.get_public_profile_data(self.user.pk), data)
+
+        cache.delete(lock_key)
+        with self.assertNumQueries(1):
+            profile_cache.get_public_profile_data(self.user.pk)
+        self.assertIsNone(cache.get(lock_key))
+        self.assertGreater(cache.get(entry_key)[1], time.time())
+
+    def test_missing_profile(self):
+        self.assertEqual(self.client.get("/api/users/999999/profile/").status_code, 404)
+
+    def test_deploy_check_requires_shared_cache(self):
+        def warnings():
+            return [message.id for message in run_checks(include_deployment_checks=True)]
+
+        with override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}):
+            self.assertIn("rides.W001", warnings())
+        redis = {"default": {"BACKEND": "django.core.cache.backends.redis.RedisCache", "LOCATION": "redis://cache:6379"}}
+        with override_settings(CACHES=redis):
+            self.assertNotIn("rides.W001", warnings())
+
+    def test_stats_exposed(self):
+        with mock.patch.object(profile_cache.stats, "_counts", dict.fromkeys(profile_cache.CacheStats.RESULTS, 0)):
+            profile_cache.get_public_profile_data(self.user.pk)
+            profile_cache.get_public_profile_data(self.user.pk)
+            lines = profile_cache.stats.render()
+        self.assertIn('skipool_public_profile_cache_total{result="miss"} 1', lines)
+        self.assertIn('skipool_public_profile_cache_total{result="hit"} 1', lines)
+
+
+class CachedJWTAuthenticationTests(TestCase):
+    """Con l'utente in cache le richieste autenticate non leggono auth_user"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="lucia@example.com", first_name="Lucia")
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.user)}")
+
+    def test_cache_hit_costs_no_queries(self):
+        self.assertEqual(self.client.get("/api/users/me/").status_code, 200)
+        # Utente e profilo dalla cache: /me/ non fa query
+        with self.assertNumQueries(0):
+            response = self.client.get("/api/users/me/")
+        self.assertEqual(response.data["profile"]["display_name"], "Lucia")
+
+    def test_changes_invalidate_cached_user(self):
+        self.client.get("/api/users/me/")
+        with self.captureOnCommitCallbacks(execute=True):
+            profile = Profile.objects.get(user=self.user)
+            profile.display_name = "Lucia B."
+            profile.save()
+        self.assertEqual(self.client.get("/api/users/me/").data["profile"]["display_name"], "Lucia B.")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        self.assertEqual(self.client.get("/api/users/me/").status_code, 401)
+
+
+    def cached_payload(self):
+        key = USER_KEY.format(user_id=self.user.pk, version=profile_cache.user_version(self.user.pk))
+        return cache.get(key)
+
+    def test_password_is_not_cached(self):
+        self.client.get("/api/users/me/")
+        payload = self.cached_payload()
+        self.assertEqual(payload["user"]["username"], "lucia@example.com")
+        self.assertNotIn("password", payload["user"])
+        self.assertNotIn("password_hash", payload)
+        self.assertEqual(payload["profile"]["display_name"], "Lucia")
+
+    def test_revoked_token_rejected_from_cache(self):
+        with mock.patch.object(jwt_settings, "CHECK_REVOKE_TOKEN", True):
+            self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.user)}")
+            self.assertEqual(self.client.get("/api/users/me/").status_code, 200)
+            self.assertIn("password_hash", self.cached_payload())
+            with self.assertNumQueries(0):
+                self.assertEqual(self.client.get("/api/users/me/").status_code, 200)
+
+            with self.captureOnCommitCallbacks(execute=True):
+                self.user.set_password("nuova-password")
+                self.user.save()
+            self.assertEqual(self.client.get("/api/users/me/").status_code, 401)
+
+    def test_schema_documents_bearer_scheme(self):
+        with mock.patch("drf_spectacular.openapi.warn") as warn:
+            schema = SchemaGenerator().get_schema(request=None, public=True)
+        self.assertFalse([call for call in warn.call_args_list if "authenticator" in str(call)])
+        self.assertEqual(schema["components"]["securitySchemes"]["jwtAuth"]["scheme"], "bearer")
+        self.assertIn({"jwtAuth": []}, schema["paths"]["/api/users/me/"]["get"]["security"])
+
+
+class EmailAvailabilityTests(TestCase):
+    """Le email libere non interrogano il database, quelle registrate sì"""
+
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create_user(username="anna@example.com", email="anna@example.com")
+
+    def setUp(self):
+        registered_emails.reset()
+        self.client = APIClient()
+        # Ricostruzione nel thread della richiesta: il thread in background non
+        # vedrebbe i dati della transazione del test
+        self.inline_build = mock.patch.object(registered_emails, "_start_build", registered_emails._build_and_release)
+        self.inline_build.start()
+        self.addCleanup(self.inline_build.stop)
+
+    def check(self, email):
+        return self.client.get("/api/users/check-email/", {"email": email}).data["available"]
+
+    def test_bloom_filter_has_no_false_negatives(self):
+        bloom = BloomFilter(1000)
+        emails = [f"utente{i}@example.com" for i in range(1000)]
+        for email in emails:
+            bloom.add(email)
+        self.assertTrue(all(email in bloom for email in emails))
+        false_positives = sum(f"altro{i}@example.com" in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+    def test_available_email_skips_database(self):
+        self.assertFalse(self.check("Anna@Example.com"))
+        with self.assertNumQueries(0):
+            self.assertTrue(self.check("nuovo@example.com"))
+
+    @override_settings(EMAIL_BLOOM_REFRESH_SECONDS=3600)
+    def test_registration_updates_filter(self):
+        self.assertTrue(self.check("marco@example.com"))
+        User.objects.create_user(username="marco@example.com", email="Marco@example.com")
+        self.assertFalse(self.check("marco@example.com"))
+
+    def test_catch_up_reads_users_from_other_processes(self):
+        self.check("luca@example.com")
+        # Utente creato senza segnali, come da un altro processo
+        User.objects.bulk_create([User(username="luca@example.com", email="luca@example.com")])
+        with override_settings(EMAIL_BLOOM_REFRESH_SECONDS=0):
+            self.assertFalse(self.check("luca@example.com"))
+
+    def test_email_changed_elsewhere_found_after_rebuild(self):
+        self.assertTrue(self.check("anna.nuova@example.com"))
+        # Cambio di email senza segnali, come da un altro processo
+        User.objects.filter(username="anna@example.com").update(email="anna.nuova@example.com")
+        with override_settings(EMAIL_BLOOM_REFRESH_SECONDS=0, EMAIL_BLOOM_REBUILD_SECONDS=0):
+            self.assertFalse(self.check("anna.nuova@example.com"))
+
+    def test_emails_added_during_rebuild_are_kept(self):
+        self.check("anna@example.com")
+        rows = registered_emails._rows
+
+        def rows_with_concurrent_save(**filters):
+            # Un altro thread salva un utente mentre la ricostruzione legge il database
+            registered_emails.add("Durante@example.com")
+            return rows(**filters)
+
+        with mock.patch.object(registered_emails, "_rows", rows_with_concurrent_save):
+            registered_emails._build()
+        self.assertTrue(registered_emails.might_contain("durante@example.com"))
+        self.assertIsNone(registered_emails._added_during_build)
+
+    def test_request_during_rebuild_uses_current_filter(self):
+        self.check("anna@example.com")
+        current = registered_emails._filter
+        self.inline_build.stop()
+        reading, release = threading.Event(), threading.Event()
+
+        def slow_rows(**filters):
+            # La ricostruzione in background resta ferma sulla lettura degli utenti
+            reading.set()
+            release.wait(timeout=5)
+            return mock.Mock(iterator=lambda chunk_size: iter([(1, "anna@example.com"), (2, "nuovo@example.com")]))
+
+        with (
+            mock.patch.object(registered_emails, "_rows", slow_rows),
+            override_settings(EMAIL_BLOOM_REFRESH_SECONDS=0, EMAIL_BLOOM_REBUILD_SECONDS=0),
+        ):
+            # La richiesta che avvia la ricostruzione e quelle successive non la attendono
+            with self.assertNumQueries(0):
+                self.assertTrue(self.check("nuovo@example.com"))
+            self.assertTrue(reading.wait(timeout=5))
+            with self.assertNumQueries(0):
+                self.assertTrue(self.check("nuovo@example.com"))
+            self.assertIs(registered_emails._filter, current)
+
+            release.set()
+            for thread in threading.enumerate():
+                if thread.name == "email-bloom-build":
+                    thread.join(timeout=5)
+        self.assertIsNot(registered_emails._filter, current)
+        self.assertIn("nuovo@example.com", registered_emails._filter)
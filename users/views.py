@@ -6,7 +6,8 @@ from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth import get_user_model
 from drf_spectacular.utils import extend_schema, OpenApiParameter, OpenApiExample
 
-from .models import Profile
+from .bloom import is_email_registered
+from .cache import get_public_profile_data
 from .serializers import (
     UserSerializer,
     UserRegistrationSerializer,
@@ -143,32 +144,13 @@ def update_profile(request):
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def get_public_profile(request, user_id):
-    """Restituisce il profilo pubblico di un utente"""
-    try:
-        profile = Profile.objects.select_related('user').get(user_id=user_id)
-        
-        # Dati pubblici limitati
-        data = {
-            'id': profile.id,
-            'display_name': profile.display_name,
-            'photo_url': profile.photo_url,
-            'bio': profile.bio,
-            'has_car': profile.has_car,
-            'ski_level': profile.ski_level,
-            'rating_avg': profile.rating_avg,
-            'rating_count': profile.rating_count,
-            'rides_as_driver': profile.rides_as_driver,
-            'rides_as_passenger': profile.rides_as_passenger,
-            'is_verified': profile.is_verified,
-            'member_since': profile.member_since_display,
-        }
-        
-        return Response(data)
-    
-    except Profile.DoesNotExist:
+    """Restituisce il profilo pubblico di un utente (in cache, vedi users/cache.py)"""
+    data = get_public_profile_data(user_id)
+    if data is None:
         return Response({
             'message': 'Profilo non trovato'
         }, status=status.HTTP_404_NOT_FOUND)
+    return Response(data)
 
 
 @extend_schema(
@@ -186,7 +168,8 @@ def check_email_availability(request):
             'message': 'Email non fornita'
         }, status=status.HTTP_400_BAD_REQUEST)
     
-    is_available = not User.objects.filter(email=email).exists()
+    # Filtro di Bloom: le email libere non interrogano il database (users/bloom.py)
+    is_available = not is_email_registered(email)
     
     return Response({
         'email': email,